@@ -0,0 +1,261 @@
+# analysis_service.py
+"""Long-lived analysis pipeline.
+
+Loads the embedding model, the FAISS store, the LLMs and the compiled RAG chain once,
+so that main.py (one query) and main_api.py (many queries) share the same setup and the
+API does not pay the model/index load for every request.
+
+When a build publishes a new index version (see index_versions.py), `reload_index` loads it next
+to the current one and swaps it in for new queries; queries already running finish on the old
+version, whose files are closed once the last of them completes.
+"""
+import os
+import time
+import datetime
+import threading
+
+from config import VECTOR_STORE_PATH, PDF_OUTPUT_FILENAME, SMALL_MODEL_NAME, LARGE_MODEL_NAME, INDEX_RELOAD_CHECK_SECONDS, SEARCH_WORKER_ADDRESSES
+from vector_store_utils import get_embedding_function, load_search_store, get_index_path
+from index_versions import current_version
+from llm_interface import get_llm, create_rag_chain
+from pdf_generator import create_pdf
+
+class IndexGeneration:
+    """One loaded index version with the RAG chain built on it, and the number of queries using it."""
+
+    def __init__(self, version: str | None, vector_store, rag_chain):
+        self.version = version
+        self.vector_store = vector_store
+        self.rag_chain = rag_chain
+        self.in_flight = 0
+        self.retired = False
+
+    def close(self):
+        if hasattr(self.vector_store, "close"):
+            self.vector_store.close() # Search worker connections
+        docstore = getattr(self.vector_store, "docstore", None)
+        if hasattr(docstore, "close"):
+            docstore.close()
+        print(f"Released index version {self.version}.")
+
+class AnalysisService:
+    def __init__(self):
+        self.embeddings = None
+        self.llms = None
+        self.generation = None
+        self._load_lock = threading.Lock()
+        self._generation_lock = threading.Lock()
+        self._watcher_stop = threading.Event()
+        self._watcher = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.generation is not None
+
+    @property
+    def vector_store(self):
+        return self.generation.vector_store if self.generation else None
+
+    @property
+    def rag_chain(self):
+        return self.generation.rag_chain if self.generation else None
+
+    def load(self):
+        """Loads embeddings, vector store, LLMs and the RAG chain. Raises on failure."""
+        with self._load_lock:
+            if self.is_loaded:
+                return
+            start_time = time.time()
+            # With search workers the index only has to exist on the worker hosts
+            if not SEARCH_WORKER_ADDRESSES and (not os.path.exists(VECTOR_STORE_PATH) or not os.listdir(VECTOR_STORE_PATH)):
+                raise FileNotFoundError(
+                    f"Vector store not found or empty at {VECTOR_STORE_PATH}. Please run 'python build_vector_store.py' first."
+                )
+
+            try:
+                self.embeddings = get_embedding_function()
+            except Exception as e:
+                print(f"Failed to initialize embedding model: {e}")
+                raise
+
+            print(f"Loading pre-built vector store from: {VECTOR_STORE_PATH}")
+            try:
+                version = current_version()
+                vector_store = load_search_store(self.embeddings, get_index_path())
+            except Exception as e:
+                print(f"Error loading vector store: {e}")
+                print(f"Ensure the store was built correctly and collection name ('{VECTOR_STORE_PATH}') matches.")
+                raise
+
+            try:
+                # Pro model for the final, polished answer
+                main_llm_for_answer = get_llm(
+                    temperature=0.7,
+                    include_thoughts_in_response=True,
+                    model_name=LARGE_MODEL_NAME,
+                )
+
+                # Fast & cheaper Flash model for all intermediate steps
+                reranking_llm = get_llm(temperature=0.3, model_name=SMALL_MODEL_NAME)
+                decomposition_llm = get_llm(temperature=0.4, model_name=SMALL_MODEL_NAME)
+                broad_query_llm = get_llm(temperature=0.4, model_name=SMALL_MODEL_NAME)
+                filter_generation_llm = get_llm(temperature=0.0, model_name=SMALL_MODEL_NAME)
+            except Exception as e:
+                print(f"Failed to initialize LLMs: {e}")
+                raise
+            self.llms = (main_llm_for_answer, reranking_llm, decomposition_llm, filter_generation_llm, broad_query_llm)
+
+            try:
+                self.generation = IndexGeneration(version, vector_store, create_rag_chain(vector_store, *self.llms))
+            except Exception as e:
+                print(f"Failed to create RAG chain: {e}")
+                raise
+            print(f"Analysis service loaded in {time.time() - start_time:.2f} seconds (index version {version}).")
+
+    def reload_index(self) -> bool:
+        """Loads the published index version if it changed and swaps it in. Returns True if it swapped.
+
+        The new version is loaded and warmed up before the swap, so queries never wait for it; the old
+        one is closed when its last in-flight query finishes. Search workers switch versions on their own.
+        """
+        if not self.is_loaded or SEARCH_WORKER_ADDRESSES:
+            return False
+        version = current_version()
+        if version is None or version == self.generation.version:
+            return False
+        with self._load_lock:
+            if version == self.generation.version:
+                return False
+            start_time = time.time()
+            vector_store = load_search_store(self.embeddings, get_index_path())
+            new_generation = IndexGeneration(version, vector_store, create_rag_chain(vector_store, *self.llms))
+            vector_store.similarity_search_with_score_by_vector(self.embeddings.embed_query("maritime industry warm-up query"), k=1)
+            with self._generation_lock:
+                old_generation = self.generation
+                self.generation = new_generation
+                old_generation.retired = True
+                close_old = old_generation.in_flight == 0
+            if close_old:
+                old_generation.close()
+            print(f"Swapped to index version {version} in {time.time() - start_time:.2f} seconds "
+                  f"({old_generation.in_flight} queries still running on {old_generation.version}).")
+            return True
+
+    def start_index_watcher(self, interval: float = INDEX_RELOAD_CHECK_SECONDS):
+        """Checks for a newly published index version every `interval` seconds in a background thread."""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while not self._watcher_stop.wait(interval):
+                try:
+                    self.reload_index()
+                except Exception as e:
+                    print(f"Error reloading index: {e}. Still serving version {self.generation.version if self.generation else None}.")
+
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_index_watcher(self):
+        self._watcher_stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _acquire_generation(self) -> IndexGeneration:
+        with self._generation_lock:
+            self.generation.in_flight += 1
+            return self.generation
+
+    def _release_generation(self, generation: IndexGeneration):
+        with self._generation_lock:
+            generation.in_flight -= 1
+            close = generation.retired and generation.in_flight == 0
+        if close:
+            generation.close()
+
+    def warm_up(self):
+        """Runs a dummy encode and search so the first real request does not pay for lazy initialization."""
+        start_time = time.time()
+        query_vector = self.embeddings.embed_query("maritime industry warm-up query")
+        self.vector_store.similarity_search_with_score_by_vector(query_vector, k=1)
+        print(f"Analysis service warmed up in {time.time() - start_time:.2f} seconds.")
+
+    def run(self, query: str, pdf_filename: str = PDF_OUTPUT_FILENAME) -> dict | None:
+        """Runs the RAG chain for `query` and writes the PDF report.
+
+        Returns a dict with final_answer, reasoning_trail, analyzed_metadata, rerank_stats,
+        pdf_path, current_date and generation_date, or None if no valid answer was produced.
+        """
+        self.load()
+        current_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
+        print(f"Using current date: {current_date_str} for analysis context.")
+
+        print(f"\nInvoking RAG chain with query: '{query}'")
+        # The whole query runs on one index version, even if a new one is swapped in meanwhile
+        generation = self._acquire_generation()
+        try:
+            chain_output = generation.rag_chain.invoke({"question": query, "current_date": current_date_str})
+        finally:
+            self._release_generation(generation)
+
+        rerank_stats = None
+        if isinstance(chain_output, dict):
+            final_answer = chain_output.get('final_answer', 'Error: Final answer not found')
+            reasoning_trail = chain_output.get('reasoning_trail', 'Error: Reasoning trail not found or not enabled.')
+            analyzed_docs_metadata = chain_output.get('analyzed_metadata', [])
+            rerank_stats = chain_output.get('rerank_stats')
+
+            print("\n--- Reasoning Trail from API --- (if present)")
+            print(reasoning_trail if reasoning_trail else "(No reasoning trail content provided by API or parsing)")
+            print("--------------------------------")
+            print("\n--- Final Analysis Result --- (from dict)")
+            print(final_answer)
+            print("---------------------------")
+
+            if analyzed_docs_metadata:
+                print(f"--- Metadata for {len(analyzed_docs_metadata)} Documents Used in Final Context ---")
+                for meta_item in analyzed_docs_metadata:
+                    print(f"  - Title: {meta_item.get('title')}, MongoID: {meta_item.get('mongo_id')}, Type: {meta_item.get('doc_type')}, Date: {meta_item.get('date')}")
+            else:
+                print("--- No specific document metadata returned from chain for final context ---")
+
+            if rerank_stats:
+                print(f"--- Rerank: {rerank_stats['rerank_candidates']} candidates from {rerank_stats['retrieved_chunks']} retrieved chunks "
+                      f"({rerank_stats['rerank_judgments_saved']} rerank judgments saved by merging first) ---")
+        else:
+            print("Warning: Chain output was not a dictionary.")
+            # Attempt to treat the whole output as the answer if it's a string
+            final_answer = str(chain_output) if isinstance(chain_output, str) else "Error: Unexpected output format."
+            reasoning_trail = "(Chain output was not a dict, reasoning trail not parsed)"
+            analyzed_docs_metadata = []
+            print("\n--- Reasoning Trail from API --- (if present)")
+            print(reasoning_trail)
+            print("--------------------------------")
+            print("\n--- Final Analysis Result --- (fallback)")
+            print(final_answer)
+            print("---------------------------\n")
+
+        if final_answer is None or final_answer.startswith("Error:"):
+            print("Error: Analysis generation failed or produced no valid answer.")
+            return None
+
+        generation_date_for_pdf = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # This is the PDF generation timestamp
+        create_pdf(
+            query=query,
+            generation_date=generation_date_for_pdf,
+            analysis_result=final_answer,
+            analyzed_docs=analyzed_docs_metadata,
+            filename=pdf_filename,
+            reasoning_trail=reasoning_trail,
+            current_date_for_analysis=current_date_str
+        )
+        return {
+            "final_answer": final_answer,
+            "reasoning_trail": reasoning_trail,
+            "analyzed_metadata": analyzed_docs_metadata,
+            "rerank_stats": rerank_stats,
+            "pdf_path": pdf_filename,
+            "current_date": current_date_str,
+            "generation_date": generation_date_for_pdf,
+        }
@@ -0,0 +1,167 @@
+# bm25_index.py
+"""BM25 keyword index over the indexed chunks, fused with FAISS hits for hybrid retrieval.
+
+Dense retrieval often misses exact terms (patent codes, "ECDIS", "NASAMS", vessel names). Each build writes
+an inverted index of the chunks in chunks.sqlite (text plus title and patent code) under `bm25/` in the index
+version, as memory-mapped NumPy arrays:
+  - terms.npy        sorted UTF-8 terms
+  - offsets.npy      postings of term i are entries offsets[i]:offsets[i + 1]
+  - labels.npy       FAISS label of each posting (uint32, ascending within a term)
+  - frequencies.npy  term frequency of each posting (uint16)
+  - lengths.npy      token count per label (0 = no chunk)
+  - stats.json       document count, average length, BM25 parameters
+
+Postings use the FAISS labels, so keyword hits map to chunks and metadata columns like vector hits do.
+`reciprocal_rank_fusion` merges the ranked lists of both searches (see MaritimeFAISS.similarity_search_with_score).
+"""
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import time
+from array import array
+import numpy as np
+
+from config import BM25_K1, BM25_B, HYBRID_RRF_K
+from chunk_store import CHUNK_STORE_FILENAME
+
+BM25_DIRNAME = "bm25"
+MAX_TERM_BYTES = 64 # Longer tokens (URLs, base64, ...) are not indexed
+MAX_FREQUENCY = np.iinfo(np.uint16).max
+# Words, numbers and codes joined by - / . (e.g. "us-2023/0123456", "dp-2"); compounds are indexed whole and by part
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-/.][^\W_]+)*")
+PART_PATTERN = re.compile(r"[-/.]")
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.casefold()):
+        tokens.append(token)
+        if PART_PATTERN.search(token):
+            tokens.extend(PART_PATTERN.split(token))
+    return [token for token in tokens if len(token.encode("utf-8")) <= MAX_TERM_BYTES]
+
+def _searchable_text(content: str, metadata: dict) -> str:
+    return " ".join(str(value) for value in (content, metadata.get("title"), metadata.get("patent_code")) if value)
+
+def remove_bm25_index(index_path: str):
+    shutil.rmtree(os.path.join(index_path, BM25_DIRNAME), ignore_errors=True)
+
+def write_bm25_index(index_path: str, num_rows: int, k1: float = BM25_K1, b: float = BM25_B):
+    """Rebuilds the BM25 index for every labelled chunk in the chunks.sqlite at `index_path`."""
+    start_time = time.time()
+    vocabulary = {}
+    term_ids, labels, frequencies = array("i"), array("I"), array("H")
+    lengths = np.zeros(num_rows, dtype=np.uint32)
+    conn = sqlite3.connect(f"file:{os.path.join(index_path, CHUNK_STORE_FILENAME)}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(
+            "SELECT rows.row, chunks.page_content, chunks.metadata FROM rows JOIN chunks ON chunks.id = rows.id ORDER BY rows.row"
+        )
+        for label, content, metadata in cursor:
+            if label >= num_rows:
+                continue
+            tokens = tokenize(_searchable_text(content, json.loads(metadata)))
+            lengths[label] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                labels.append(label)
+                frequencies.append(min(count, MAX_FREQUENCY))
+    finally:
+        conn.close()
+
+    terms = sorted(vocabulary)
+    # Renumber terms in sorted order; a stable sort keeps each term's postings in label order
+    rank = np.empty(len(vocabulary), dtype=np.int64)
+    rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+    posting_terms = rank[np.frombuffer(term_ids, dtype=np.int32)] if len(term_ids) else np.zeros(0, dtype=np.int64)
+    order = np.argsort(posting_terms, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+
+    target_dir = os.path.join(index_path, BM25_DIRNAME)
+    temp_dir = target_dir + ".tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    np.save(os.path.join(temp_dir, "terms.npy"), np.array([term.encode("utf-8") for term in terms], dtype=f"S{MAX_TERM_BYTES}"))
+    np.save(os.path.join(temp_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(temp_dir, "labels.npy"), np.frombuffer(labels, dtype=np.uint32)[order] if len(labels) else np.zeros(0, dtype=np.uint32))
+    np.save(os.path.join(temp_dir, "frequencies.npy"), np.frombuffer(frequencies, dtype=np.uint16)[order] if len(frequencies) else np.zeros(0, dtype=np.uint16))
+    np.save(os.path.join(temp_dir, "lengths.npy"), lengths)
+    num_docs = int(np.count_nonzero(lengths))
+    stats = {"num_docs": num_docs, "avg_length": float(lengths.sum() / num_docs) if num_docs else 0.0,
+             "label_bound": num_rows, "k1": k1, "b": b}
+    with open(os.path.join(temp_dir, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(temp_dir, target_dir)
+    print(f"Wrote BM25 index ({len(terms)} terms, {len(labels)} postings over {num_docs} chunks) "
+          f"in {time.time() - start_time:.2f} seconds.")
+
+class BM25Index:
+    def __init__(self, terms, offsets, labels, frequencies, lengths, stats: dict):
+        self.terms = terms
+        self.offsets = offsets
+        self.labels = labels
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.stats = stats
+
+    @classmethod
+    def load(cls, index_path: str):
+        """The memory-mapped BM25 index of the index version at `index_path`, or None if it was built without one."""
+        bm25_dir = os.path.join(index_path, BM25_DIRNAME)
+        if not os.path.exists(os.path.join(bm25_dir, "stats.json")):
+            return None
+        with open(os.path.join(bm25_dir, "stats.json"), "r", encoding="utf-8") as f:
+            stats = json.load(f)
+        arrays = [np.load(os.path.join(bm25_dir, name), mmap_mode="r")
+                  for name in ("terms.npy", "offsets.npy", "labels.npy", "frequencies.npy", "lengths.npy")]
+        return cls(*arrays, stats)
+
+    def search(self, query: str, k: int, mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """`(scores, labels)` of the `k` best BM25 matches of `query`, best first (restricted to `mask` if given)."""
+        num_docs, avg_length = self.stats["num_docs"], self.stats["avg_length"] or 1.0
+        k1, b = self.stats["k1"], self.stats["b"]
+        found_labels, found_scores = [], []
+        for term in set(tokenize(query)):
+            encoded = term.encode("utf-8")
+            position = int(np.searchsorted(self.terms, encoded))
+            if position >= len(self.terms) or self.terms[position] != encoded:
+                continue
+            start, end = self.offsets[position], self.offsets[position + 1]
+            labels = np.asarray(self.labels[start:end], dtype=np.int64)
+            frequencies = np.asarray(self.frequencies[start:end], dtype=np.float32)
+            idf = math.log(1 + (num_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            norms = k1 * (1 - b + b * self.lengths[labels] / avg_length)
+            found_labels.append(labels)
+            found_scores.append(idf * frequencies * (k1 + 1) / (frequencies + norms))
+        if not found_labels:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        # Sum the per-term contributions of each label
+        labels, inverse = np.unique(np.concatenate(found_labels), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(found_scores)).astype(np.float32)
+        if mask is not None:
+            keep = labels < len(mask)
+            keep[keep] = mask[labels[keep]]
+            labels, scores = labels[keep], scores[keep]
+        if len(labels) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            labels, scores = labels[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], labels[order]
+
+def reciprocal_rank_fusion(result_lists: list[list], k: int, rrf_k: int = HYBRID_RRF_K) -> list:
+    """Top `k` `(doc, fused_score)` over ranked `(doc, score)` lists; a doc at rank r adds 1 / (rrf_k + r) per list."""
+    fused, docs = {}, {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = doc.id or doc.page_content
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return [(docs[key], score) for key, score in ranked[:k]]
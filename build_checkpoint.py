@@ -0,0 +1,84 @@
+# build_checkpoint.py
+"""Per-doc-type high-watermarks for resumable builds.
+
+A watermark is the `(scrape_time, _id)` key of the last document a build actually ingested, in the
+order build_vector_store.py reads Mongo. It is saved to `build_state.json` next to the index, each
+time the index is checkpointed, so a restarted build continues after the last checkpoint and the
+next incremental build starts right after the newest ingested document rather than at the wall-clock
+time the previous build finished (which skipped documents scraped while it ran).
+"""
+import os
+import threading
+from bson import json_util
+
+BUILD_STATE_FILENAME = "build_state.json"
+
+def load_watermarks(index_path: str) -> dict[str, tuple]:
+    """{doc_type: (scrape_time, _id)} from the last checkpoint, or {} if there is none."""
+    state_path = os.path.join(index_path, BUILD_STATE_FILENAME)
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json_util.loads(f.read())
+        return {doc_type: (mark["scrape_time"], mark["_id"]) for doc_type, mark in state.get("watermarks", {}).items()}
+    except Exception as e:
+        print(f"Error reading build watermarks from {state_path}: {e}. Ignoring them.")
+        return {}
+
+def save_watermarks(index_path: str, watermarks: dict[str, tuple]):
+    """Atomically replaces `build_state.json` (written after the index it describes)."""
+    state_path = os.path.join(index_path, BUILD_STATE_FILENAME)
+    state = {"watermarks": {doc_type: {"scrape_time": key[0], "_id": key[1]} for doc_type, key in watermarks.items()}}
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(json_util.dumps(state, indent=2))
+    os.replace(state_path + ".tmp", state_path)
+
+class WatermarkTracker:
+    """Tracks which read batches finished so the watermark only covers documents that were ingested.
+
+    With `ordered=True` (one cursor per doc type) batches are registered in key order and the watermark is
+    the last key of the longest run of finished batches. Partitioned reads arrive out of key order, so the
+    watermark then only moves once every batch of the doc type finished. A failed batch stops the watermark
+    of its doc type for the rest of the run, so the next build reads it again.
+    """
+
+    def __init__(self, watermarks: dict[str, tuple] | None = None, ordered: bool = True):
+        self.ordered = ordered
+        self._watermarks = dict(watermarks or {})
+        self._batches = {} # doc_type -> [[last_key, state]] in registration order; state is None, "done" or "failed"
+        self._next = {}    # doc_type -> position of the first unfinished batch
+        self._source_finished = set()
+        self._lock = threading.Lock()
+
+    def register(self, doc_type: str, last_key: tuple) -> int:
+        with self._lock:
+            batches = self._batches.setdefault(doc_type, [])
+            batches.append([last_key, None])
+            return len(batches) - 1
+
+    def finished(self, doc_type: str, position: int, ok: bool = True):
+        with self._lock:
+            self._batches[doc_type][position][1] = "done" if ok else "failed"
+
+    def source_finished(self, doc_type: str):
+        with self._lock:
+            self._source_finished.add(doc_type)
+
+    def watermarks(self) -> dict[str, tuple]:
+        with self._lock:
+            for doc_type, batches in self._batches.items():
+                if self.ordered:
+                    position = self._next.get(doc_type, 0)
+                    while position < len(batches) and batches[position][1] == "done":
+                        self._watermarks[doc_type] = batches[position][0]
+                        position += 1
+                    self._next[doc_type] = position
+                elif doc_type in self._source_finished and batches and all(state == "done" for _, state in batches):
+                    self._watermarks[doc_type] = max(batches, key=lambda batch: _sort_key(batch[0]))[0]
+            return dict(self._watermarks)
+
+def _sort_key(key: tuple):
+    """(scrape_time, _id) in Mongo's sort order: missing scrape_time first, then by time, then _id by BSON type."""
+    scrape_time, doc_id = key
+    return (scrape_time is not None, scrape_time or 0, type(doc_id).__name__ != "str", str(doc_id))
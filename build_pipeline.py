@@ -0,0 +1,180 @@
+# build_pipeline.py
+"""Staged producer/consumer pipeline used by build_vector_store.py.
+
+Each stage runs in its own thread(s) and hands its output to the next stage through a bounded
+queue, so Mongo I/O, chunking, embedding and FAISS adds overlap. A full queue blocks the upstream
+stage (backpressure), which keeps memory bounded while the slowest stage (embedding) always has
+input waiting. Per-stage timings show where the time goes:
+  - busy:    time spent in the stage function
+  - starved: time waiting for input (the stage is faster than the one before it)
+  - blocked: time waiting for room in the output queue (the stage is faster than the one after it)
+Time spent producing the source items (e.g. reading Mongo pages) is reported as `source`.
+"""
+import queue
+import threading
+import time
+
+_END = object()
+
+class Stage:
+    def __init__(self, name: str, fn, workers: int = 1, unit: str = "batches", size=None):
+        """`fn(item)` returns the item for the next stage, or None to drop it. `size(output)` counts units for throughput."""
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.unit = unit
+        self.size = size
+        self.items_in = 0
+        self.items_out = 0
+        self.units_out = 0
+        self.busy_seconds = 0.0
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, output, busy: float):
+        with self._lock:
+            self.items_in += 1
+            self.busy_seconds += busy
+            if output is not None:
+                self.items_out += 1
+                self.units_out += self.size(output) if self.size else 1
+
+    def summary(self, wall_seconds: float) -> str:
+        rate = self.units_out / self.busy_seconds if self.busy_seconds else 0.0
+        return (f"{self.name:<8} {self.items_in:>6} in / {self.items_out:>6} out, {self.units_out} {self.unit} "
+                f"({rate:.1f} {self.unit}/s busy) | busy {self.busy_seconds:.1f}s "
+                f"({self.busy_seconds / max(wall_seconds, 1e-9) / self.workers:.0%} of wall per worker), "
+                f"starved {self.starved_seconds:.1f}s, blocked {self.blocked_seconds:.1f}s")
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], queue_size: int = 4):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall_seconds = 0.0
+        self.source_seconds = 0.0
+        self.source_items = 0
+        self._error = None
+        self._abort = threading.Event()
+
+    def run(self, source, threaded: bool = True):
+        """Pushes every item of `source` through the stages. Re-raises the first exception a stage raised."""
+        start_time = time.time()
+        try:
+            if threaded:
+                self._run_threaded(source)
+            else:
+                self._run_inline(source)
+        finally:
+            self.wall_seconds = time.time() - start_time
+        if self._error is not None:
+            raise self._error
+
+    def _timed(self, source):
+        """Iterates `source`, adding the time spent inside it to `source_seconds`."""
+        iterator = iter(source)
+        while True:
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.source_seconds += time.time() - started
+            self.source_items += 1
+            yield item
+
+    def _run_inline(self, source):
+        for item in self._timed(source):
+            for stage in self.stages:
+                started = time.time()
+                item = stage.fn(item)
+                stage._record(item, time.time() - started)
+                if item is None:
+                    break
+
+    def _put(self, q: queue.Queue, item, stage: Stage | None = None):
+        """Blocking put that gives up when the pipeline is aborted."""
+        started = time.time()
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        if stage is not None:
+            with stage._lock:
+                stage.blocked_seconds += time.time() - started
+
+    def _run_threaded(self, source):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+
+        def feed():
+            try:
+                for item in self._timed(source):
+                    if self._abort.is_set():
+                        break
+                    self._put(queues[0], item)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    self._put(queues[0], _END)
+
+        finished_workers = [0] * len(self.stages)
+        finished_lock = threading.Lock()
+
+        def work(position: int):
+            stage = self.stages[position]
+            in_queue = queues[position]
+            out_queue = queues[position + 1] if position + 1 < len(self.stages) else None
+            while not self._abort.is_set():
+                waited = time.time()
+                try:
+                    item = in_queue.get(timeout=0.2)
+                except queue.Empty:
+                    with stage._lock:
+                        stage.starved_seconds += time.time() - waited
+                    continue
+                with stage._lock:
+                    stage.starved_seconds += time.time() - waited
+                if item is _END:
+                    break
+                try:
+                    started = time.time()
+                    output = stage.fn(item)
+                    stage._record(output, time.time() - started)
+                except Exception as e:
+                    self._fail(e)
+                    continue
+                if output is not None and out_queue is not None:
+                    self._put(out_queue, output, stage)
+            # The last worker of a stage to finish tells the next stage's workers that no more input is coming
+            with finished_lock:
+                finished_workers[position] += 1
+                last = finished_workers[position] == stage.workers
+            if last and out_queue is not None:
+                for _ in range(self.stages[position + 1].workers):
+                    self._put(out_queue, _END)
+
+        for position, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=work, args=(position,), name=f"build-{stage.name}-{worker}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        feed()
+        for thread in threads:
+            thread.join()
+
+    def _fail(self, error: Exception):
+        if self._error is None:
+            print(f"Build pipeline stage failed: {error}. Stopping the pipeline.")
+            self._error = error
+        self._abort.set()
+
+    def report(self):
+        print(f"--- Build pipeline stages (wall time {self.wall_seconds:.1f}s) ---")
+        print(f"  {'source':<8} {self.source_items:>6} items, {self.source_seconds:.1f}s producing them")
+        for stage in self.stages:
+            print(f"  {stage.summary(self.wall_seconds)}")
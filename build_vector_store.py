@@ -1,17 +1,62 @@
 # build_vector_store.py
 import chromadb
 import hashlib
+import json
 import time
 import os # For reading/writing timestamp file
-import datetime # For generating current timestamp
+import datetime # For the watermark overlap window
 from dateutil import parser as date_parser # For parsing stored timestamp
 import pickle
 import numpy as np
 
 # Use the existing functions/config for loading, chunking, embeddings
-from data_loader import load_and_chunk_documents
-from vector_store_utils import get_embedding_function
-from config import VECTOR_STORE_PATH, LAST_BUILD_TIMESTAMP_PATH, MONGO_URI, MONGO_DATABASE_NAME
+from data_loader import documents_from_mongo_records, split_documents
+from build_pipeline import Pipeline, Stage
+from vector_store_utils import get_embedding_function, load_vector_store, get_index_path, get_embedding_cache_name
+from faiss_index_utils import (
+    load_index_params,
+    save_index_params,
+    convert_index,
+    is_quantized,
+    load_rescore_vectors,
+    write_rescore_vectors,
+    truncate_rescore_vectors,
+    label_bound,
+    supports_removal,
+    store_exact_vectors,
+    exact_vectors_of,
+    report_index_quality,
+)
+from faiss_vector_store import MaritimeFAISS
+from chunk_store import CHUNK_STORE_FILENAME, SqliteDocstore, SqliteRowMap, known_chunk_ids, document_hashes, chunk_ids_for_documents
+from build_checkpoint import WatermarkTracker, load_watermarks, save_watermarks
+from metadata_columns import METADATA_COLUMNS_FILENAME, write_metadata_columns
+from partitioned_index import build_partitions, remove_partitions
+from bm25_index import write_bm25_index, remove_bm25_index
+from search_workers import build_shards, remove_shards
+from index_versions import prepare_build_dir, discard_build_dir, write_manifest, publish
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_pool import ProcessPoolEmbeddings
+from config import (
+    VECTOR_STORE_PATH,
+    LAST_BUILD_TIMESTAMP_PATH,
+    MONGO_URI,
+    MONGO_DATABASE_NAME,
+    FAISS_INDEX_TYPE,
+    FAISS_TOMBSTONE_REBUILD_FRACTION,
+    FAISS_PARTITIONED_SEARCH,
+    BM25_INDEX_ENABLED,
+    SEARCH_WORKER_SHARDS,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_WORKERS,
+    EMBEDDING_TORCH_THREADS_PER_WORKER,
+    BUILD_PIPELINE_ENABLED,
+    BUILD_PIPELINE_QUEUE_SIZE,
+    VECTORIZATION_READ_PARTITIONS,
+    VECTORIZATION_CURSOR_BATCH_SIZE,
+    BUILD_CHECKPOINT_INTERVAL_SECONDS,
+    BUILD_WATERMARK_OVERLAP_SECONDS,
+)
 from data_base import MongoHandler # For counting documents
 from langchain_community.vectorstores import FAISS
 
@@ -21,6 +66,11 @@ def generate_deterministic_id(text_content):
     """Generates a SHA-256 hash for the text content."""
     return hashlib.sha256(text_content.encode('utf-8')).hexdigest()
 
+def document_content_hash(document):
+    """SHA-256 of a document's text and metadata, except scrape_time (a re-scrape of unchanged content keeps its hash)."""
+    metadata = {key: value for key, value in document.metadata.items() if key != "scrape_time"}
+    return generate_deterministic_id(document.page_content + json.dumps(metadata, sort_keys=True, default=str))
+
 def read_last_build_timestamp(path):
     """Reads the last build timestamp from the specified file."""
     if os.path.exists(path):
@@ -39,28 +89,10 @@ def read_last_build_timestamp(path):
             print(f"Error reading or parsing timestamp from {path}: {e}. Proceeding with full build.")
     return None
 
-def write_current_build_timestamp(path):
-    """Writes the current UTC timestamp to the specified file in ISO format."""
-    try:
-        # Store timestamp in UTC and ISO format for consistency
-        current_utc_timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        with open(path, 'w') as f:
-            f.write(current_utc_timestamp)
-        print(f"Successfully wrote current build timestamp ({current_utc_timestamp}) to {path}")
-    except Exception as e:
-        print(f"Error writing timestamp to {path}: {e}")
-
 def main(data_types_to_process="all", overall_doc_limit_per_type=0):
     print("--- Starting Vector Store Build/Update Process ---")
     start_time = time.time()
 
-    # 0. Read the last build timestamp
-    last_build_ts = read_last_build_timestamp(LAST_BUILD_TIMESTAMP_PATH)
-    if last_build_ts:
-        print(f"Last build timestamp found: {last_build_ts}. Loading documents since this time.")
-    else:
-        print("No last build timestamp found. Performing a full load of all documents.")
-
     # 1. Initialize Embedding Function
     try:
         embeddings_model = get_embedding_function()
@@ -68,39 +100,67 @@ def main(data_types_to_process="all", overall_doc_limit_per_type=0):
         print(f"Failed to initialize embedding model: {e}. Aborting build.")
         return
 
-    # 2. Connect to FAISS (in-memory, save to disk later)
-    print(f"Creating FAISS vector store (in-memory, will save to disk at: {VECTOR_STORE_PATH})")
+    # Chunks are embedded by a pool of worker processes when configured (the in-process model still embeds queries),
+    # and through the cache so rebuilds only run the model on text it has not seen
+    chunk_embedder = embeddings_model
+    embedding_pool = None
+    if EMBEDDING_WORKERS > 0:
+        try:
+            embedding_pool = ProcessPoolEmbeddings(EMBEDDING_WORKERS, EMBEDDING_TORCH_THREADS_PER_WORKER)
+            chunk_embedder = embedding_pool
+        except Exception as e:
+            print(f"Error starting embedding pool: {e}. Embedding in the build process.")
+    embedding_cache = None
+    if EMBEDDING_CACHE_ENABLED:
+        try:
+            dimension = len(embeddings_model.embed_query("embedding dimension probe"))
+            embedding_cache = EmbeddingCache(get_embedding_cache_name(), dimension)
+            chunk_embedder = CachedEmbeddings(chunk_embedder, embedding_cache)
+            print(f"Using embedding cache at {embedding_cache.directory}")
+        except Exception as e:
+            print(f"Error opening embedding cache: {e}. Embedding without cache.")
+
+    # 2. Connect to FAISS. The build writes a new index version (a copy of the published one, or an unfinished
+    # build to resume) and publishes it at the end, so readers never load a half-written index
+    try:
+        index_path, resumed_build = prepare_build_dir(VECTOR_STORE_PATH)
+    except Exception as e:
+        print(f"Error preparing index version directory under {VECTOR_STORE_PATH}: {e}. Aborting build.")
+        return
+    print(f"Building index version in {index_path} (published: {get_index_path()})")
     try:
-        # Initialize an empty FAISS index with the embedding model
-        # We'll save it to disk at the end if successful
         faiss_store = None
-        index_path = f"{VECTOR_STORE_PATH}/faiss_index"
-        if os.path.exists(index_path):
+        index_params = {"index_type": "flat"}
+        if os.path.exists(os.path.join(index_path, "index.faiss")):
             print(f"Loading existing FAISS index from {index_path}...")
             try:
-                faiss_store = FAISS.load_local(index_path, embeddings_model, allow_dangerous_deserialization=True)
-                print(f"Loaded existing FAISS store with {len(faiss_store.index_to_docstore_id)} documents.")
+                faiss_store = load_vector_store(embeddings_model, index_path, writable=True)
+                index_params = load_index_params(index_path)
+                if is_quantized(index_params["index_type"]):
+                    truncate_rescore_vectors(index_path, faiss_store.index.d, label_bound(faiss_store.index))
             except Exception as e:
                 print(f"Error loading existing FAISS index: {e}. Starting fresh.")
                 faiss_store = None
         if faiss_store is None:
             print("No existing FAISS index found or failed to load. Creating a new one.")
             # Create a new empty FAISS store without relying on embed_documents
-            from langchain_community.vectorstores.faiss import FAISS as FAISSStore
             from langchain_community.vectorstores.utils import DistanceStrategy
             import faiss
             # Define the dimension of embeddings (based on all-MiniLM-L6-v2, it's 384)
             dimension = 384
-            # Create a FAISS index manually
-            index = faiss.IndexFlatL2(dimension)
+            # Create a FAISS index manually. New stores start flat; other index types are built from the
+            # collected vectors at the end of the run (IVF and quantizers need a training sample first).
+            # Vectors are added under stable labels (the chunks.sqlite row), so chunks can be removed without renumbering.
+            index = faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
             # Wrap it in a docstore for LangChain compatibility
-            from langchain_community.docstore.in_memory import InMemoryDocstore
             from langchain_community.vectorstores.faiss import dependable_faiss_import
             dependable_faiss_import()  # Ensure FAISS is imported
-            docstore = InMemoryDocstore({})
-            index_to_docstore_id = {}
+            # Chunks go straight to chunks.sqlite in the index directory, so checkpoints only commit what is new
+            docstore = SqliteDocstore(os.path.join(index_path, CHUNK_STORE_FILENAME), read_only=False)
+            docstore.truncate_rows(0) # Leftovers of a store that could not be loaded
+            index_to_docstore_id = SqliteRowMap(docstore)
             # Manually create the FAISS store without an embedding function
-            faiss_store = FAISSStore(
+            faiss_store = MaritimeFAISS(
                 embedding_function=embeddings_model,  # We'll handle embeddings manually if needed
                 index=index,
                 docstore=docstore,
@@ -112,11 +172,31 @@ def main(data_types_to_process="all", overall_doc_limit_per_type=0):
         print(f"Error initializing FAISS store: {e}. Aborting build.")
         return
 
+    # 0. Where to start reading: after each doc type's watermark from the last checkpoint of this index
+    # (last_build_timestamp.txt is only read by stores built before watermarks existed)
+    starting_watermarks = load_watermarks(index_path) if faiss_store.index.ntotal > 0 else {}
+    last_build_ts = None
+    if starting_watermarks:
+        for doc_type, (scrape_time, doc_id) in starting_watermarks.items():
+            print(f"Resuming {doc_type} after watermark scrape_time={scrape_time}, _id={doc_id}.")
+    elif faiss_store.index.ntotal > 0:
+        last_build_ts = read_last_build_timestamp(LAST_BUILD_TIMESTAMP_PATH)
+    if not starting_watermarks and last_build_ts:
+        print(f"Last build timestamp found: {last_build_ts}. Loading documents since this time.")
+    elif not starting_watermarks:
+        print("No build watermarks found. Performing a full load of all documents.")
+
     mongo_handler = MongoHandler(MONGO_URI, MONGO_DATABASE_NAME)
+    try:
+        mongo_handler.ensure_vectorization_indexes()
+    except Exception as e:
+        print(f"Warning: could not create the (scrape_time, _id) index used for vectorization reads: {e}")
     
     RAW_DOC_BATCH_SIZE = 500  # Number of raw documents to process from MongoDB at a time (increased from 100)
     processed_doc_counts = {"news": 0, "patents": 0}
-    total_chunks_processed_overall = 0
+    new_vectors = [] # (first label, exact vectors) added this run, written to vectors.f32 when the index is quantized
+    chunk_counts = {"new": 0, "already_indexed": 0, "duplicate_in_run": 0, "replaced": 0}
+    document_counts = {"unchanged": 0, "changed": 0}
 
     if isinstance(data_types_to_process, str):
         if data_types_to_process.lower() == "all":
@@ -133,157 +213,315 @@ def main(data_types_to_process="all", overall_doc_limit_per_type=0):
         print("Error: Invalid data_types_to_process. Must be 'news', 'patents', 'all', or a list.")
         return
 
-    for doc_type in doc_types_to_iterate:
-        print(f"--- Processing document type: {doc_type.upper()} ---")
-        current_skip = 0
-        
-        if doc_type == "news":
-            total_docs_for_type = mongo_handler.count_news_for_vectorization(since_timestamp=last_build_ts)
-        elif doc_type == "patents":
-            total_docs_for_type = mongo_handler.count_patents_for_vectorization(since_timestamp=last_build_ts)
-        else:
-            print(f"Unknown document type: {doc_type}. Skipping.")
-            continue
-            
-        print(f"Found {total_docs_for_type} {doc_type} documents to process based on timestamp.")
-        
-        # Apply overall_doc_limit_per_type if specified
-        docs_to_fetch_for_type = total_docs_for_type
-        if overall_doc_limit_per_type > 0 and overall_doc_limit_per_type < total_docs_for_type:
-            docs_to_fetch_for_type = overall_doc_limit_per_type
-            print(f"Applying overall limit: will process up to {docs_to_fetch_for_type} {doc_type} documents.")
-
-        while current_skip < docs_to_fetch_for_type:
-            limit_for_this_batch = RAW_DOC_BATCH_SIZE
-            # Adjust limit if overall_doc_limit_per_type would be exceeded
-            if overall_doc_limit_per_type > 0 and (current_skip + RAW_DOC_BATCH_SIZE > docs_to_fetch_for_type):
-                 limit_for_this_batch = docs_to_fetch_for_type - current_skip
-
-            if limit_for_this_batch <= 0: # Should not happen if loop condition is correct, but as safeguard
-                break
-
-            print(f"Fetching raw {doc_type} batch: limit={limit_for_this_batch}, skip={current_skip}")
-            
-            _, chunked_docs = load_and_chunk_documents(
-                data_types=[doc_type], # Process one type at a time
-                limit_per_type=limit_for_this_batch,
-                skip_offsets={doc_type: current_skip},
-                last_build_timestamp=last_build_ts
-            )
-
-            if not chunked_docs:
-                print(f"No more {doc_type} documents found or processed in this batch (skip: {current_skip}). Moving to next type or finishing.")
-                break # Exit while loop for this doc_type
-
-            print(f"Loaded and chunked {len(chunked_docs)} chunks from {doc_type} batch.")
-            
-            # --- Start: Processing for this batch of chunks ---
-            ids = []
-            documents_content = []
-            metadatas_list = []
-            embeddings_list = []
-
-            print("Generating embeddings for current batch...")
-            try:
-                all_chunk_texts = [chunk.page_content for chunk in chunked_docs]
-                if not all_chunk_texts:
-                    print("No text content in current chunk batch. Skipping.")
-                    current_skip += limit_for_this_batch
-                    processed_doc_counts[doc_type] += limit_for_this_batch
-                    continue
-
-                all_embeddings = embeddings_model.embed_documents(all_chunk_texts)
-                if len(all_embeddings) != len(chunked_docs):
-                    raise ValueError("Mismatch between number of chunks and generated embeddings in batch.")
-            except Exception as e:
-                print(f"Error generating embeddings for batch: {e}. Skipping this batch.")
-                current_skip += limit_for_this_batch
-                processed_doc_counts[doc_type] += limit_for_this_batch
+    seen_this_run = set()
+    docs_to_fetch = {}
+    # Partitioned reads arrive out of key order, so their watermarks only move once a doc type is complete
+    watermarks = WatermarkTracker(starting_watermarks, ordered=VECTORIZATION_READ_PARTITIONS <= 1)
+    last_checkpoint_time = time.time()
+
+    def read_start(doc_type):
+        """(since_timestamp, after) for a doc type: its watermark (minus the overlap), or the legacy timestamp."""
+        watermark = starting_watermarks.get(doc_type)
+        if watermark is None:
+            return last_build_ts, None
+        scrape_time = watermark[0]
+        if BUILD_WATERMARK_OVERLAP_SECONDS > 0 and scrape_time is not None:
+            # Re-read a short window so documents inserted late with an older scrape_time are not missed;
+            # their chunks are skipped as already indexed before embedding
+            return scrape_time - datetime.timedelta(seconds=BUILD_WATERMARK_OVERLAP_SECONDS), None
+        return None, watermark
+
+    def fetch_batches():
+        """Raw record batches per doc type, read by (scrape_time, _id) key from Mongo."""
+        for doc_type in doc_types_to_iterate:
+            print(f"--- Processing document type: {doc_type.upper()} ---")
+            since_timestamp, after = read_start(doc_type)
+            count_since = since_timestamp if after is None else after[0]
+            if doc_type == "news":
+                total_docs_for_type = mongo_handler.count_news_for_vectorization(since_timestamp=count_since)
+            elif doc_type == "patents":
+                total_docs_for_type = mongo_handler.count_patents_for_vectorization(since_timestamp=count_since)
+            else:
+                print(f"Unknown document type: {doc_type}. Skipping.")
+                continue
+            print(f"Found {total_docs_for_type} {doc_type} documents to process based on the watermark/timestamp.")
+
+            # Apply overall_doc_limit_per_type if specified
+            docs_to_fetch_for_type = total_docs_for_type
+            if overall_doc_limit_per_type > 0 and overall_doc_limit_per_type < total_docs_for_type:
+                docs_to_fetch_for_type = overall_doc_limit_per_type
+                print(f"Applying overall limit: will process up to {docs_to_fetch_for_type} {doc_type} documents.")
+            docs_to_fetch[doc_type] = docs_to_fetch_for_type
+
+            for records in mongo_handler.iter_vectorization_batches(
+                doc_type, since_timestamp=since_timestamp, batch_size=RAW_DOC_BATCH_SIZE,
+                max_docs=overall_doc_limit_per_type, partitions=VECTORIZATION_READ_PARTITIONS,
+                cursor_batch_size=VECTORIZATION_CURSOR_BATCH_SIZE, after=after,
+            ):
+                processed_doc_counts[doc_type] += len(records)
+                position = watermarks.register(doc_type, MongoHandler.vectorization_key(records[-1]))
+                yield {"doc_type": doc_type, "records": records, "fetched": processed_doc_counts[doc_type], "position": position}
+            watermarks.source_finished(doc_type)
+
+    def finish_batch(batch, ok=True):
+        """Marks a batch as ingested (or dropped with nothing to add) or failed, for the watermarks."""
+        watermarks.finished(batch["doc_type"], batch["position"], ok)
+        return None
+
+    def checkpoint():
+        """Saves the index, its chunks and the watermarks of everything added so far (called from the index stage)."""
+        for first_label, vectors in new_vectors:
+            write_rescore_vectors(index_path, first_label, vectors)
+        new_vectors.clear()
+        faiss_store.save_local(index_path)
+        save_index_params(index_path, index_params)
+        save_watermarks(index_path, watermarks.watermarks())
+
+    def load_stage(batch):
+        doc_type = batch["doc_type"]
+        batch["documents"] = documents_from_mongo_records(batch.pop("records"), "news" if doc_type == "news" else "patent")
+        if not batch["documents"]:
+            print(f"No usable {doc_type} documents in this batch.")
+            return finish_batch(batch)
+        return batch
+
+    def split_stage(batch):
+        # Documents whose content hash is unchanged since they were indexed are skipped before chunking;
+        # a changed document has all its indexed chunks replaced
+        documents = batch.pop("documents")
+        doc_hashes = {doc.metadata["mongo_id"]: document_content_hash(doc) for doc in documents}
+        stored_hashes = document_hashes(faiss_store.docstore, list(doc_hashes))
+        unchanged = {mongo_id for mongo_id, content_hash in doc_hashes.items() if stored_hashes.get(mongo_id) == content_hash}
+        changed = {mongo_id for mongo_id in doc_hashes if mongo_id in stored_hashes and mongo_id not in unchanged}
+        document_counts["unchanged"] += len(unchanged)
+        document_counts["changed"] += len(changed)
+        documents = [doc for doc in documents if doc.metadata["mongo_id"] not in unchanged]
+        for mongo_id in unchanged:
+            del doc_hashes[mongo_id]
+        indexed_chunks = chunk_ids_for_documents(faiss_store.docstore, list(doc_hashes))
+
+        chunked_docs = split_documents(documents)
+        ids = []
+        documents_content = []
+        metadatas_list = []
+
+        for chunk in chunked_docs:
+            if not chunk.page_content:
+                print(f"Warning: Chunk has empty content. Skipping. Metadata: {chunk.metadata}")
                 continue
 
-            for i_chunk, chunk in enumerate(chunked_docs):
-                if not chunk.page_content:
-                    print(f"Warning: Chunk has empty content. Skipping. Metadata: {chunk.metadata}")
-                    continue
-
-                deterministic_id = generate_deterministic_id(chunk.page_content + str(chunk.metadata.get('mongo_id')))
-                ids.append(deterministic_id)
-                documents_content.append(chunk.page_content)
-
-                sanitized_meta = {}
-                for key, value in chunk.metadata.items():
-                    if isinstance(value, list):
-                        sanitized_meta[key] = str(value)
-                    elif value is None:
-                        sanitized_meta[key] = ""
-                    else:
-                        sanitized_meta[key] = value
-                metadatas_list.append(sanitized_meta)
-                embeddings_list.append(all_embeddings[i_chunk])
-
-            if not ids:
-                print("No valid data to upsert from this batch. Continuing.")
-                current_skip += limit_for_this_batch
-                processed_doc_counts[doc_type] += limit_for_this_batch
+            deterministic_id = generate_deterministic_id(chunk.page_content + str(chunk.metadata.get('mongo_id')))
+            # Filter duplicates (within this run; earlier batches may still be in flight)
+            if deterministic_id in seen_this_run:
+                chunk_counts["duplicate_in_run"] += 1
                 continue
+            seen_this_run.add(deterministic_id)
+            ids.append(deterministic_id)
+            documents_content.append(chunk.page_content)
+
+            sanitized_meta = {}
+            for key, value in chunk.metadata.items():
+                if isinstance(value, list):
+                    # Keyword lists stay lists (chunks.sqlite stores JSON) so metadata_columns.py can index them
+                    sanitized_meta[key] = [str(item) for item in value if item is not None]
+                elif value is None:
+                    sanitized_meta[key] = ""
+                else:
+                    sanitized_meta[key] = value
+            metadatas_list.append(sanitized_meta)
+
+        # Changed documents are re-added in full. Documents indexed before content hashes were stored lose the chunks
+        # they no longer produce; their other chunks, like those of documents re-read through the watermark overlap,
+        # are skipped as already indexed before embedding them.
+        stale_ids = {chunk_id for mongo_id in changed for chunk_id in indexed_chunks.get(mongo_id, ())}
+        new_ids = set(ids)
+        for mongo_id, chunk_ids in indexed_chunks.items():
+            if mongo_id not in changed:
+                stale_ids.update(chunk_ids - new_ids)
+        candidate_ids = [chunk_id for chunk_id in ids if chunk_id not in stale_ids]
+        known_ids = known_chunk_ids(faiss_store.docstore, candidate_ids) if candidate_ids else set()
+        if known_ids:
+            chunk_counts["already_indexed"] += len(known_ids)
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in known_ids]
+            ids = [ids[i] for i in keep]
+            documents_content = [documents_content[i] for i in keep]
+            metadatas_list = [metadatas_list[i] for i in keep]
+        print(f"{len(ids)} new chunks in {batch['doc_type']} batch ending at document {batch['fetched']} "
+              f"({len(known_ids)} already indexed, {len(stale_ids)} to replace, {len(unchanged)} documents unchanged).")
+        if not ids and not stale_ids and not doc_hashes:
+            return finish_batch(batch)
+        batch.update(ids=ids, texts=documents_content, metadatas=metadatas_list, stale_ids=stale_ids, doc_hashes=doc_hashes)
+        return batch
+
+    def embed_stage(batch):
+        if not batch["ids"]:
+            batch["embeddings"] = []
+            return batch
+        try:
+            new_embeddings = chunk_embedder.embed_documents(batch["texts"])
+            if len(new_embeddings) != len(batch["ids"]):
+                raise ValueError("Mismatch between number of chunks and generated embeddings in batch.")
+        except Exception as e:
+            print(f"Error generating embeddings for batch: {e}. Skipping this batch.")
+            return finish_batch(batch, ok=False)
+        batch["embeddings"] = [emb.tolist() if isinstance(emb, np.ndarray) else emb for emb in new_embeddings]
+        return batch
 
-            # Filter duplicates (within this batch)
-            unique_data_store = {}
-            filtered_ids = []
-            filtered_embeddings = []
-            filtered_metadatas_batch = []
-            filtered_documents_batch = []
-
-            for i_unique, doc_id in enumerate(ids):
-                if doc_id not in unique_data_store:
-                    unique_data_store[doc_id] = True
-                    filtered_ids.append(doc_id)
-                    filtered_embeddings.append(embeddings_list[i_unique])
-                    filtered_metadatas_batch.append(metadatas_list[i_unique])
-                    filtered_documents_batch.append(documents_content[i_unique])
-
-            print(f"Filtered down to {len(filtered_ids)} unique items in this batch for upsert.")
-
-            if filtered_ids:
-                print(f"Adding {len(filtered_ids)} items to FAISS store...")
-                try:
-                    embeddings_for_faiss = [emb.tolist() if isinstance(emb, np.ndarray) else emb for emb in filtered_embeddings]
-                    faiss_store.add_embeddings(
-                        text_embeddings=list(zip(filtered_documents_batch, embeddings_for_faiss)),
-                        metadatas=filtered_metadatas_batch,
-                        ids=filtered_ids
-                    )
-                    print("FAISS batch added successfully.")
-                    total_chunks_processed_overall += len(filtered_ids)
-                except Exception as e:
-                    print(f"Error adding batch to FAISS store: {e}. Skipping this batch.")
-
-            # --- End: Processing for this batch of chunks ---
-            current_skip += limit_for_this_batch
-            processed_doc_counts[doc_type] += limit_for_this_batch
-            print(f"Completed processing raw document batch for {doc_type}. Processed so far for this type: {current_skip}/{docs_to_fetch_for_type}")
-
-        print(f"--- Finished processing document type: {doc_type.upper()}. Total processed for this type: {processed_doc_counts[doc_type]} raw documents ---")
+    def index_stage(batch):
+        nonlocal last_checkpoint_time
+        try:
+            # Outdated chunks go first, so a changed document never has old and new chunks in the index at once
+            if batch["stale_ids"]:
+                faiss_store.delete(list(batch["stale_ids"]))
+                chunk_counts["replaced"] += len(batch["stale_ids"])
+            if batch["ids"]:
+                faiss_store.add_embeddings(
+                    text_embeddings=list(zip(batch["texts"], batch["embeddings"])),
+                    metadatas=batch["metadatas"],
+                    ids=batch["ids"]
+                )
+            if isinstance(faiss_store.docstore, SqliteDocstore):
+                faiss_store.docstore.set_document_hashes(batch["doc_hashes"])
+        except Exception as e:
+            print(f"Error adding batch to FAISS store: {e}. Skipping this batch.")
+            return finish_batch(batch, ok=False)
+        chunk_counts["new"] += len(batch["ids"])
+        if is_quantized(index_params["index_type"]) and batch["ids"]:
+            new_vectors.append((faiss_store.next_label - len(batch["ids"]), np.asarray(batch["embeddings"], dtype=np.float32)))
+        doc_type = batch["doc_type"]
+        print(f"Added {len(batch['ids'])} chunks to FAISS store ({len(batch['stale_ids'])} outdated chunks removed). "
+              f"Processed so far for {doc_type}: {batch['fetched']}/{docs_to_fetch[doc_type]}")
+        finish_batch(batch)
+
+        if BUILD_CHECKPOINT_INTERVAL_SECONDS and time.time() - last_checkpoint_time >= BUILD_CHECKPOINT_INTERVAL_SECONDS:
+            checkpoint_start = time.time()
+            try:
+                checkpoint()
+                print(f"Checkpoint: saved {faiss_store.index.ntotal} vectors and watermarks in {time.time() - checkpoint_start:.2f} seconds.")
+            except Exception as e:
+                print(f"Error writing build checkpoint: {e}. Continuing; the next checkpoint will retry.")
+            last_checkpoint_time = time.time()
+        return batch
+
+    count_chunks = lambda batch: len(batch["ids"])
+    pipeline = Pipeline([
+        Stage("load", load_stage, unit="docs", size=lambda batch: len(batch["documents"])),
+        Stage("split", split_stage, unit="chunks", size=count_chunks),
+        Stage("embed", embed_stage, unit="chunks", size=count_chunks),
+        Stage("index", index_stage, unit="chunks", size=count_chunks),
+    ], queue_size=BUILD_PIPELINE_QUEUE_SIZE)
+    try:
+        pipeline.run(fetch_batches(), threaded=BUILD_PIPELINE_ENABLED)
+    except Exception as e:
+        # Keep what was added; the watermarks stop at the last batch that was fully ingested
+        print(f"Error in build pipeline: {e}. Saving what was added so far.")
+    pipeline.report()
+    total_chunks_processed_overall = chunk_counts["new"]
 
     # End of iterating through doc_types
 
     print(f"--- All document types processed. Total chunks added to FAISS store: {total_chunks_processed_overall} ---")
     print(f"Final document counts from MongoDB processing attempts: {processed_doc_counts}")
+    print(f"Chunks: {chunk_counts['new']} new (embedded), {chunk_counts['already_indexed']} skipped as already indexed, "
+          f"{chunk_counts['duplicate_in_run']} skipped as duplicates within this run, {chunk_counts['replaced']} outdated chunks removed.")
+    print(f"Documents: {document_counts['changed']} changed since they were indexed, {document_counts['unchanged']} unchanged (skipped).")
+    if embedding_cache is not None:
+        embedding_cache.flush()
+        print(f"Embedding cache: {embedding_cache.stats()}.")
+    if embedding_pool is not None:
+        embedding_pool.close()
     
-    # Write timestamp only if the entire process (or a significant portion) seems successful.
-    # This condition might need refinement.
-    if total_chunks_processed_overall > 0 or (
-        last_build_ts is None and sum(processed_doc_counts.values()) == 0
+    # Save if chunks were added, a watermark moved (e.g. every read chunk was already indexed) or this is a new store
+    final_watermarks = watermarks.watermarks()
+    if total_chunks_processed_overall > 0 or chunk_counts["replaced"] > 0 or final_watermarks != starting_watermarks or resumed_build or not os.path.exists(
+        os.path.join(get_index_path(), "index.faiss")
     ):
-        write_current_build_timestamp(LAST_BUILD_TIMESTAMP_PATH)
+        for first_label, vectors in new_vectors:
+            write_rescore_vectors(index_path, first_label, vectors)
+        # Vectors of removed chunks stay in an HNSW graph (searches skip them); rebuild it once there are too many
+        dead_vectors = faiss_store.index.ntotal - len(faiss_store.index_to_docstore_id)
+        compact = not supports_removal(faiss_store.index) and dead_vectors > FAISS_TOMBSTONE_REBUILD_FRACTION * faiss_store.index.ntotal
+        exact_vectors = exact_labels = None
+        if (index_params["index_type"] != FAISS_INDEX_TYPE or compact) and faiss_store.index.ntotal > 0:
+            try:
+                if compact:
+                    print(f"Rebuilding the index without the vectors of {dead_vectors} removed chunks.")
+                exact_labels, exact_vectors = exact_vectors_of(faiss_store.index, index_path, live_labels=list(faiss_store.index_to_docstore_id))
+                faiss_store.index, index_params = convert_index(faiss_store.index, FAISS_INDEX_TYPE, vectors=exact_vectors, labels=exact_labels)
+                store_exact_vectors(index_path, FAISS_INDEX_TYPE, exact_labels, exact_vectors)
+            except Exception as e:
+                print(f"Error converting FAISS index to '{FAISS_INDEX_TYPE}': {e}. Keeping '{index_params['index_type']}'.")
+        saved = False
         try:
             print(f"Saving FAISS index to {index_path}...")
             faiss_store.save_local(index_path)
-            print("FAISS index saved successfully.")
+            save_index_params(index_path, index_params)
+            save_watermarks(index_path, final_watermarks)
+            saved = True
+            print(f"FAISS index saved successfully. Watermarks: {final_watermarks}")
         except Exception as e:
-            print(f"Error saving FAISS index: {e}. Index not saved, but process completed.")
+            print(f"Error saving FAISS index: {e}. Index not saved or published; the next build resumes this version.")
+        try:
+            if exact_vectors is None and index_params["index_type"] != "flat":
+                exact_labels, exact_vectors = exact_vectors_of(faiss_store.index, index_path, live_labels=list(faiss_store.index_to_docstore_id))
+            rescore_vectors = load_rescore_vectors(index_path, faiss_store.index.d, label_bound(faiss_store.index))
+            report_index_quality(faiss_store.index, index_params["index_type"], exact_vectors, rescore_vectors, labels=exact_labels)
+        except Exception as e:
+            print(f"Error measuring FAISS index memory/recall: {e}")
+        columns = None
+        if saved and isinstance(faiss_store.docstore, SqliteDocstore):
+            try:
+                columns = write_metadata_columns(index_path, label_bound(faiss_store.index))
+            except Exception as e:
+                print(f"Error writing metadata columns: {e}. Searches on this version filter in Python.")
+                stale_columns_path = os.path.join(index_path, METADATA_COLUMNS_FILENAME) # Copied from the previous version
+                if os.path.exists(stale_columns_path):
+                    os.remove(stale_columns_path)
+        if saved:
+            # Partitions copied from the previous version are reused where their labels did not change
+            try:
+                if columns is None or not FAISS_PARTITIONED_SEARCH:
+                    remove_partitions(index_path)
+                else:
+                    rescore_vectors = load_rescore_vectors(index_path, faiss_store.index.d, label_bound(faiss_store.index))
+                    build_partitions(faiss_store.index, index_path, columns, index_params["index_type"], rescore_vectors)
+            except Exception as e:
+                print(f"Error writing index partitions: {e}. Searches on this version use the full index.")
+                remove_partitions(index_path)
+        if saved:
+            try:
+                if BM25_INDEX_ENABLED and isinstance(faiss_store.docstore, SqliteDocstore):
+                    write_bm25_index(index_path, label_bound(faiss_store.index))
+                else:
+                    remove_bm25_index(index_path)
+            except Exception as e:
+                print(f"Error writing BM25 index: {e}. Hybrid retrieval on this version searches FAISS only.")
+                remove_bm25_index(index_path)
+        if saved:
+            try:
+                if SEARCH_WORKER_SHARDS > 0:
+                    rescore_vectors = load_rescore_vectors(index_path, faiss_store.index.d, label_bound(faiss_store.index))
+                    build_shards(faiss_store.index, index_path, SEARCH_WORKER_SHARDS, index_params["index_type"],
+                                 list(faiss_store.index_to_docstore_id), rescore_vectors)
+                else:
+                    remove_shards(index_path)
+            except Exception as e:
+                print(f"Error writing search worker shards: {e}. Search workers cannot serve this version.")
+                remove_shards(index_path)
+        if saved:
+            try:
+                if isinstance(faiss_store.docstore, SqliteDocstore):
+                    faiss_store.docstore.seal()
+                manifest = write_manifest(index_path, faiss_store.index.ntotal, get_embedding_cache_name(), index_params)
+                publish(index_path, VECTOR_STORE_PATH)
+                print(f"Index version {manifest['version']}: {manifest['vectors']} vectors, chunks {manifest['chunks_by_doc_type']}.")
+            except Exception as e:
+                print(f"Error publishing index version {index_path}: {e}. The next build resumes it.")
     else:
-        print("No new chunks were processed and added. Timestamp not updated.")
+        print("No new chunks were processed and added. Watermarks not updated.")
+        if isinstance(faiss_store.docstore, SqliteDocstore):
+            faiss_store.docstore.close()
+        discard_build_dir(index_path)
 
     end_time = time.time()
     print(f"--- Vector Store Build/Update Finished in {end_time - start_time:.2f} seconds ---")
@@ -0,0 +1,241 @@
+# chunk_store.py
+"""On-disk chunk text and metadata for the FAISS store.
+
+Replaces the pickled `InMemoryDocstore` + `index_to_docstore_id` (index.pkl) that LangChain's FAISS
+saves with one SQLite file, `chunks.sqlite`, next to `index.faiss`. Chunks are read lazily by FAISS
+row id, so loading the store does not unpickle every chunk, and several processes reading the same
+file share its pages through the OS cache.
+
+`chunks.mongo_id` is the reverse map from a Mongo document to its chunks (and through `rows`, to
+its FAISS labels), and `documents` keeps a content hash per indexed document, so the build can
+replace the chunks of a document whose content changed.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+CHUNK_STORE_FILENAME = "chunks.sqlite"
+
+class SqliteDocstore(Docstore, AddableMixin):
+    """LangChain docstore backed by SQLite: `chunks` holds id -> text/metadata, `rows` maps FAISS labels ("rows") to chunk ids."""
+
+    def __init__(self, path: str, read_only: bool = True):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            # WAL lets readers (API, main.py) keep reading while a build writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS rows_id ON rows (id)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (mongo_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL)")
+            columns = {name for _, name, *_ in self._conn.execute("PRAGMA table_info(chunks)")}
+            if "mongo_id" not in columns:
+                # Stores written before the reverse map existed
+                self._conn.execute("ALTER TABLE chunks ADD COLUMN mongo_id TEXT")
+                self._conn.execute("UPDATE chunks SET mongo_id = json_extract(metadata, '$.mongo_id')")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_mongo_id ON chunks (mongo_id)")
+            self._conn.commit()
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _to_document(chunk_id: str, page_content: str, metadata: str) -> Document:
+        return Document(id=chunk_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, search: str):
+        rows = self._execute("SELECT id, page_content, metadata FROM chunks WHERE id = ?", (search,))
+        return self._to_document(*rows[0]) if rows else f"ID {search} not found."
+
+    def get_by_rows(self, row_ids: list[int]) -> dict[int, Document]:
+        """Documents for several FAISS row ids, in batched queries."""
+        rows = self._select_in(
+            "SELECT rows.row, chunks.id, chunks.page_content, chunks.metadata FROM rows "
+            "JOIN chunks ON chunks.id = rows.id WHERE rows.row IN ({})",
+            [int(row_id) for row_id in row_ids],
+        )
+        return {row_id: self._to_document(chunk_id, content, metadata) for row_id, chunk_id, content, metadata in rows}
+
+    def existing_ids(self, chunk_ids: list[str]) -> set[str]:
+        """The subset of `chunk_ids` that has a row in the FAISS index."""
+        return {chunk_id for (chunk_id,) in self._select_in("SELECT DISTINCT id FROM rows WHERE id IN ({})", list(chunk_ids))}
+
+    def add(self, texts: dict[str, Document]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, page_content, metadata, mongo_id) VALUES (?, ?, ?, ?)",
+                [(chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str),
+                  None if doc.metadata.get("mongo_id") is None else str(doc.metadata["mongo_id"]))
+                 for chunk_id, doc in texts.items()],
+            )
+
+    def delete(self, ids: list) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+
+    def _select_in(self, sql: str, values: list, batch_size: int = 500) -> list:
+        """Runs `sql` (with one `{}` for the IN placeholders) over `values` in batches."""
+        results = []
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            results.extend(self._execute(sql.format(",".join("?" * len(batch))), batch))
+        return results
+
+    def rows_for_ids(self, chunk_ids: list[str]) -> list[tuple[int, str]]:
+        """(FAISS label, chunk id) of every row holding one of `chunk_ids`."""
+        return self._select_in("SELECT row, id FROM rows WHERE id IN ({})", list(chunk_ids))
+
+    def chunk_ids_for_documents(self, mongo_ids: list[str]) -> dict[str, set[str]]:
+        """Indexed chunk ids per Mongo document (the mongo_id -> chunks reverse map)."""
+        chunks = {}
+        rows = self._select_in(
+            "SELECT DISTINCT chunks.mongo_id, chunks.id FROM chunks JOIN rows ON rows.id = chunks.id WHERE chunks.mongo_id IN ({})",
+            [str(mongo_id) for mongo_id in mongo_ids],
+        )
+        for mongo_id, chunk_id in rows:
+            chunks.setdefault(mongo_id, set()).add(chunk_id)
+        return chunks
+
+    def delete_rows(self, row_ids: list[int]):
+        """Removes FAISS label -> chunk mappings, and the chunks no other row refers to."""
+        with self._lock:
+            chunk_ids = set()
+            for start in range(0, len(row_ids), 500):
+                batch = [int(row_id) for row_id in row_ids[start:start + 500]]
+                placeholders = ",".join("?" * len(batch))
+                chunk_ids.update(chunk_id for (chunk_id,) in self._conn.execute(f"SELECT id FROM rows WHERE row IN ({placeholders})", batch))
+                self._conn.execute(f"DELETE FROM rows WHERE row IN ({placeholders})", batch)
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE id = ? AND NOT EXISTS (SELECT 1 FROM rows WHERE rows.id = chunks.id)",
+                [(chunk_id,) for chunk_id in chunk_ids],
+            )
+
+    def document_hashes(self, mongo_ids: list[str]) -> dict[str, str]:
+        """Content hash recorded for each of `mongo_ids` that was indexed since hashes were kept."""
+        return dict(self._select_in("SELECT mongo_id, content_hash FROM documents WHERE mongo_id IN ({})", [str(m) for m in mongo_ids]))
+
+    def set_document_hashes(self, hashes: dict[str, str]):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO documents (mongo_id, content_hash) VALUES (?, ?)",
+                                   [(str(mongo_id), content_hash) for mongo_id, content_hash in hashes.items()])
+
+    def truncate_rows(self, num_rows: int):
+        """Drops row mappings past `num_rows` (left by a build that committed chunks but crashed before writing the index)."""
+        with self._lock:
+            # Their documents are indexed again by the next build, so forget their content hashes too
+            self._conn.execute("DELETE FROM documents WHERE mongo_id IN "
+                               "(SELECT chunks.mongo_id FROM rows JOIN chunks ON chunks.id = rows.id WHERE rows.row >= ?)", (num_rows,))
+            deleted = self._conn.execute("DELETE FROM rows WHERE row >= ?", (num_rows,)).rowcount
+            if deleted:
+                self._conn.execute("DELETE FROM chunks WHERE id NOT IN (SELECT id FROM rows)")
+            self._conn.commit()
+        if deleted:
+            print(f"Dropped {deleted} row mappings in {self.path} that are not in the FAISS index.")
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def seal(self):
+        """Commits, folds the WAL back into the database file and closes it, leaving one self-contained file to publish."""
+        with self._lock:
+            self._conn.commit()
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+            self._conn.close()
+
+class SqliteRowMap(MutableMapping):
+    """`index_to_docstore_id` for a SqliteDocstore: FAISS row id -> chunk id, read on demand."""
+
+    def __init__(self, docstore: SqliteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, row_id):
+        rows = self.docstore._execute("SELECT id FROM rows WHERE row = ?", (int(row_id),))
+        if not rows:
+            raise KeyError(row_id)
+        return rows[0][0]
+
+    def __setitem__(self, row_id, chunk_id):
+        self.update({row_id: chunk_id})
+
+    def __delitem__(self, row_id):
+        self.docstore._execute("DELETE FROM rows WHERE row = ?", (int(row_id),))
+
+    def __iter__(self):
+        return iter([row_id for (row_id,) in self.docstore._execute("SELECT row FROM rows ORDER BY row")])
+
+    def __len__(self):
+        return self.docstore._execute("SELECT COUNT(*) FROM rows")[0][0]
+
+    def items(self):
+        return self.docstore._execute("SELECT row, id FROM rows ORDER BY row")
+
+    def update(self, mapping=(), **kwargs):
+        pairs = mapping.items() if hasattr(mapping, "items") else mapping
+        with self.docstore._lock:
+            self.docstore._conn.executemany(
+                "INSERT OR REPLACE INTO rows (row, id) VALUES (?, ?)", [(int(row_id), chunk_id) for row_id, chunk_id in pairs]
+            )
+
+def document_hashes(docstore, mongo_ids: list[str]) -> dict[str, str]:
+    """Recorded content hashes (a SqliteDocstore only; in-memory docstores keep none)."""
+    return docstore.document_hashes(mongo_ids) if hasattr(docstore, "document_hashes") else {}
+
+def chunk_ids_for_documents(docstore, mongo_ids: list[str]) -> dict[str, set[str]]:
+    """Indexed chunk ids per Mongo document (a SqliteDocstore only)."""
+    return docstore.chunk_ids_for_documents(mongo_ids) if hasattr(docstore, "chunk_ids_for_documents") else {}
+
+def known_chunk_ids(docstore, chunk_ids: list[str]) -> set[str]:
+    """Chunk ids already stored, for a SqliteDocstore or an in-memory docstore."""
+    if hasattr(docstore, "existing_ids"):
+        return docstore.existing_ids(chunk_ids)
+    return {chunk_id for chunk_id in chunk_ids if isinstance(docstore.search(chunk_id), Document)}
+
+def write_chunk_store(path: str, docstore, index_to_docstore_id, batch_size: int = 10_000):
+    """Writes any docstore (e.g. a legacy InMemoryDocstore) and its row map to a new SQLite file at `path`."""
+    temp_path = path + ".tmp"
+    for leftover in (temp_path, temp_path + "-wal", temp_path + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    target = SqliteDocstore(temp_path, read_only=False)
+    row_map = SqliteRowMap(target)
+    pending = {}
+    for row_id, chunk_id in sorted(index_to_docstore_id.items()):
+        pending[row_id] = chunk_id
+        if len(pending) >= batch_size:
+            _copy_rows(docstore, target, row_map, pending)
+            pending = {}
+    _copy_rows(docstore, target, row_map, pending)
+    with target._lock:
+        target._conn.commit()
+        # Back to a single self-contained file before it is moved into place
+        target._conn.execute("PRAGMA journal_mode=DELETE")
+    target.close()
+    os.replace(temp_path, path)
+
+def _copy_rows(docstore, target: SqliteDocstore, row_map: SqliteRowMap, pending: dict):
+    if not pending:
+        return
+    if hasattr(docstore, "get_by_rows"):
+        docs_by_row = docstore.get_by_rows(list(pending))
+    else:
+        docs_by_row = {row_id: docstore.search(chunk_id) for row_id, chunk_id in pending.items()}
+    target.add({pending[row_id]: doc for row_id, doc in docs_by_row.items() if isinstance(doc, Document)})
+    row_map.update(pending)
@@ -5,7 +5,36 @@ from dotenv import load_dotenv
 load_dotenv() # Load variables from .env file
 
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2' # Or another suitable model
+EMBEDDING_BACKEND = "torch" # "torch" (HuggingFaceEmbeddings) or "onnx" (onnx_embeddings.py, no torch needed at run time)
+ONNX_MODEL_DIR = "./onnx_models/all-MiniLM-L6-v2" # Written by 'python onnx_embeddings.py export'
+ONNX_USE_INT8 = True # Load the dynamically quantized int8 model instead of the fp32 export
+EMBEDDING_MAX_SEQ_LENGTH = 256 # Token limit of all-MiniLM-L6-v2 (longer chunks are truncated, as sentence-transformers does)
 VECTOR_STORE_PATH = "./faiss_store" # Directory to persist FAISS data
+INDEX_VERSIONS_TO_KEEP = 3 # Published index versions kept under VECTOR_STORE_PATH/versions (including the current one)
+INDEX_RELOAD_CHECK_SECONDS = 30 # How often the API checks for a newly published index version (0 = never)
+
+# FAISS index type (see faiss_index_utils.py): "flat" (exact), "ivf_flat", "ivf_pq", "hnsw",
+# or the compressed "sq8" (int8 scalar quantization) / "pq" (product quantization).
+# build_vector_store.py converts the index when this differs from the persisted one.
+FAISS_INDEX_TYPE = "flat"
+FAISS_INDEX_PARAMS = {
+    "nlist": 1024, # IVF cells (capped at num_vectors / 39 during training)
+    "nprobe": 16, # IVF cells searched per query
+    "pq_m": 48, # PQ sub-quantizers, must divide the embedding dimension (384)
+    "pq_nbits": 8, # Bits per PQ code
+    "hnsw_m": 32, # HNSW links per node
+    "ef_construction": 200,
+    "ef_search": 128, # HNSW candidates per query
+}
+FAISS_TRAINING_SAMPLE_SIZE = 100_000 # Vectors sampled for IVF / quantizer training
+FAISS_RESCORE_FACTOR = 4 # Quantized indexes: candidates fetched per result and re-scored with exact float vectors
+FAISS_RECALL_SAMPLE_QUERIES = 200 # Queries used by the build to report recall of non-flat indexes
+FAISS_TOMBSTONE_REBUILD_FRACTION = 0.1 # HNSW cannot remove vectors: the build rebuilds it once this share of its vectors belong to deleted chunks
+FAISS_PARTITIONED_SEARCH = True # Build per-(doc_type, year) partitions and search only those a filter can match
+FAISS_PARTITION_FLAT_MAX_VECTORS = 200_000 # Partitions up to this size are exact (flat); larger ones use FAISS_INDEX_TYPE
+BM25_INDEX_ENABLED = True # Builds also write the BM25 keyword index (bm25/, see bm25_index.py) used by hybrid retrieval
+BM25_K1 = 1.2 # BM25 term frequency saturation
+BM25_B = 0.75 # BM25 chunk length normalization
 
 MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
@@ -26,7 +55,83 @@ GEMINI_MODEL_NAME = SMALL_MODEL_NAME
 PDF_OUTPUT_FILENAME = 'analysis_report_langchain.pdf'
 RETRIEVER_TOP_K = 50 # How many chunks to retrieve for context for each sub-query
 
-LAST_BUILD_TIMESTAMP_PATH = "./last_build_timestamp.txt" # Path to store the timestamp of the last build
+# Sub-query fan-out: the sub-queries and the broad query are retrieved/reranked on a bounded thread pool
+RETRIEVAL_MODE = "concurrent" # "concurrent" or "sequential"
+RETRIEVAL_MAX_CONCURRENCY = 4 # Max sub-queries processed at the same time
+RETRIEVAL_TIMEOUT_SECONDS = 300 # Per sub-query budget, counted from when it starts; slower ones contribute no chunks
+RETRIEVAL_SEARCH_MODE = "dense" # "dense": FAISS only; "hybrid": FAISS + BM25 keyword hits fused by reciprocal rank (needs bm25/ in the index)
+HYBRID_RRF_K = 60 # Reciprocal rank fusion constant: a hit at rank r scores 1 / (HYBRID_RRF_K + r) in each list
+# Adaptive cutoff of each query's hits before reranking (see retrieval_cutoff.py). Every rule is off by default,
+# so each query keeps its hits up to the stage cap; None also disables it
+RETRIEVAL_CUTOFF = {
+    "max_distance": None, # Absolute: drop hits with a squared L2 distance above this (0..4 for normalized embeddings)
+    "max_distance_ratio": None, # Relative gap: drop hits farther than this multiple of the best hit's distance (e.g. 1.5)
+    "knee": False, # Cut where the sorted scores jump away from the best hits
+    "knee_min_gain": 0.2, # How pronounced (0..1) the bend of the score curve must be to count as a knee
+    "knee_min_jump": 0.25, # ...and the step between the hits on either side of it, as a share (0..1) of the score range
+    "min_keep": 5, # Never cut a query's hits below this
+}
+# Per-stage caps: hits per sub-query, hits for the broad query, merged candidates sent to the reranker (None = no cap)
+RETRIEVAL_STAGE_CAPS = {"sub_query": RETRIEVER_TOP_K, "broad_query": RETRIEVER_TOP_K * 2, "rerank": None}
+
+# LLM reranking: "batched" sends RERANK_BATCH_SIZE chunks per call, "concurrent" sends one chunk per call via .batch(),
+# "sequential" is the original one-call-at-a-time loop. Reranking runs once, on the merged candidates of all sub-queries
+# and the broad query, so at most RERANK_MAX_CONCURRENCY calls are in flight.
+RERANK_MODE = "batched"
+RERANK_BATCH_SIZE = 20
+RERANK_MAX_CONCURRENCY = 8
+
+# Reranking backend: "llm" (Gemini, see RERANK_MODE), "cross_encoder" (local CPU model, no LLM calls)
+# or "hybrid" (cross-encoder keeps the best HYBRID_RERANK_LLM_CANDIDATES chunks, then the LLM decides)
+RERANKER_BACKEND = "llm"
+CROSS_ENCODER_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+CROSS_ENCODER_BATCH_SIZE = 32
+CROSS_ENCODER_SCORE_THRESHOLD = None # On the model's raw output scale (logits for ms-marco models); None = top-n only
+CROSS_ENCODER_TOP_N = 60 # Chunks kept (out of all merged candidates) by the "cross_encoder" backend
+HYBRID_RERANK_LLM_CANDIDATES = 80 # Chunks passed on to the LLM by the "hybrid" backend
+
+# Results of all sub-queries and the broad query are merged before reranking; each unique chunk is judged once
+# and at most this many chunks of the same Mongo document are sent to the reranker
+RERANK_MAX_CHUNKS_PER_DOC = 1
+
+LAST_BUILD_TIMESTAMP_PATH = "./last_build_timestamp.txt" # Legacy build timestamp; only read for stores saved without build_state.json
+BUILD_CHECKPOINT_INTERVAL_SECONDS = 600 # Save index, chunks and per-doc-type watermarks this often during a build (0 = only at the end)
+BUILD_WATERMARK_OVERLAP_SECONDS = 3600 # Re-read this much scrape_time before each watermark; already indexed chunks are skipped before embedding
+
+# build_vector_store.py overlaps Mongo fetch, chunking, embedding and FAISS adds (see build_pipeline.py)
+BUILD_PIPELINE_ENABLED = True # False runs the stages one batch at a time, in the main thread (for debugging)
+BUILD_PIPELINE_QUEUE_SIZE = 4 # Batches buffered between stages; bounds memory and applies backpressure
+VECTORIZATION_READ_PARTITIONS = 1 # >1 reads each collection as that many scrape_time ranges with concurrent cursors
+VECTORIZATION_CURSOR_BATCH_SIZE = 500 # Documents per Mongo getMore round trip (lower it if large patents hit the 16MB reply limit)
+
+# Multi-process CPU embedding for the build (see embedding_pool.py); 0 = one model in the build process
+EMBEDDING_WORKERS = 0
+EMBEDDING_TORCH_THREADS_PER_WORKER = None # None = cpu_count // EMBEDDING_WORKERS
+EMBEDDING_POOL_SHARD_SIZE = 64 # Texts per task sent to a worker
+
+# Build-time embedding cache (see embedding_cache.py), keyed by model name + normalized chunk text
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = "./embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = 2_000_000 # ~1.5 GB of float16 384-d vectors; least recently used entries are evicted beyond this
+EMBEDDING_CACHE_DTYPE = "float16" # "float16" halves the file size; "float32" stores vectors exactly
+
+# API background jobs (see job_queue.py)
+JOB_STORE_PATH = "./api_jobs/jobs.sqlite" # Job records; survives API restarts
+JOB_LOG_DIR = "./api_jobs/logs" # Output of scraper / build jobs
+JOB_MAX_WORKERS = 4 # Jobs running at the same time, over all kinds
+JOB_KIND_CONCURRENCY = {"analysis": 2, "scraper": 1, "build": 1} # Per-kind limits
+
+# API report artifacts (see report_store.py): one content-addressed PDF + metadata JSON per analysis
+REPORT_STORE_PATH = "./reports"
+REPORT_STORE_MAX_BYTES = 500 * 1024 * 1024 # Least-recently-served reports are evicted above this
+REPORT_STORE_TTL_SECONDS = 30 * 24 * 3600 # Reports older than this are evicted
+
+# Search workers (see search_workers.py): index shards searched by separate processes / hosts
+SEARCH_WORKER_SHARDS = 0 # >0: builds also split the index into this many shards (by label) for search workers
+SEARCH_WORKER_ADDRESSES = [address for address in os.getenv("SEARCH_WORKER_ADDRESSES", "").split(",") if address] # "host:port" of each worker; empty = search in the API process
+SEARCH_WORKER_AUTHKEY = os.getenv("SEARCH_WORKER_AUTHKEY") # Shared secret of workers and API; required, workers refuse to start without it
+SEARCH_WORKER_TIMEOUT_SECONDS = 10 # A shard answering slower than this is left out of the results
+SEARCH_WORKER_BASE_PORT = 7601 # Worker for shard i listens on this port + i by default
 
 # Check if API key is set
 if not GEMINI_API_KEY:
@@ -5,6 +5,8 @@ import pandas as pd
 import time
 from datetime import datetime
 import asyncio
+import queue
+import threading
 import processor
 import numpy as np
 from bson.objectid import ObjectId
@@ -201,9 +203,10 @@ class MongoHandler:
         
         return collection.count_documents(query)
 
-    def get_news_for_vectorization(self, limit=0, skip=0, since_timestamp=None):
+    def get_news_for_vectorization(self, limit=0, skip=0, since_timestamp=None, after=None, extra_query=None, batch_size=None):
         """Fetches news documents for vectorization, returning _id and text.
-           Optionally fetches documents newer than since_timestamp based on 'scrape_time'."""
+           Optionally fetches documents newer than since_timestamp based on 'scrape_time'.
+           Results are ordered by (scrape_time, _id); pass `after` (see vectorization_key) to page by key instead of `skip`."""
         collection = self.collections.get("news")
         if collection is None:
             return []
@@ -221,17 +224,13 @@ class MongoHandler:
 
         projection = {"_id": 1, "text": 1, "title":1, "date":1, "url":1, "scrape_time": 1, "keywords_maritime":1, "keywords_kongsberg":1}
         
-        cursor = collection.find(query, projection)
-        if skip > 0:
-            cursor = cursor.skip(skip)
-        if limit > 0:
-            cursor = cursor.limit(limit)
-            
+        cursor = self._vectorization_cursor(collection, query, projection, limit, skip, after, extra_query, batch_size)
         return list(cursor)
 
-    def get_patents_for_vectorization(self, limit=0, skip=0, since_timestamp=None):
+    def get_patents_for_vectorization(self, limit=0, skip=0, since_timestamp=None, after=None, extra_query=None, batch_size=None):
         """Fetches patent documents for vectorization, returning _id and concatenated text fields.
-           Optionally fetches documents newer than since_timestamp based on 'scrape_time'."""
+           Optionally fetches documents newer than since_timestamp based on 'scrape_time'.
+           Results are ordered by (scrape_time, _id); pass `after` (see vectorization_key) to page by key instead of `skip`."""
         collection = self.collections.get("patents")
         if collection is None:
             return []
@@ -247,11 +246,7 @@ class MongoHandler:
 
         projection = {"_id": 1, "abstract": 1, "claims": 1, "description": 1, "title":1, "date":1, "url":1, "patent_code":1, "scrape_time": 1, "keywords_maritime":1, "keywords_kongsberg":1}
         
-        cursor = collection.find(query, projection)
-        if skip > 0:
-            cursor = cursor.skip(skip)
-        if limit > 0:
-            cursor = cursor.limit(limit)
+        cursor = self._vectorization_cursor(collection, query, projection, limit, skip, after, extra_query, batch_size)
         
         patents_data = []
         for doc in cursor:
@@ -271,6 +266,165 @@ class MongoHandler:
             patents_data.append(patent_item)
         return patents_data
 
+    # --- Keyset pagination / partitioned scans for build_vector_store.py ---
+
+    VECTORIZATION_SORT = [("scrape_time", 1), ("_id", 1)]
+
+    @staticmethod
+    def vectorization_key(record):
+        """(scrape_time, _id) of a record returned by get_*_for_vectorization, to pass as `after` for the next page."""
+        return (record.get("scrape_time"), record["_id"])
+
+    @staticmethod
+    def _vectorization_cursor(collection, query, projection, limit=0, skip=0, after=None, extra_query=None, batch_size=None):
+        """find() ordered by (scrape_time, _id), starting after the `after` key when given.
+
+        Paging by key costs the same for every page (skip is O(skip) on the server) and is not shifted
+        by documents inserted while a build runs.
+        """
+        conditions = [query] if query else []
+        if extra_query:
+            conditions.append(extra_query)
+        if after is not None:
+            last_scrape_time, last_id = after
+            if last_scrape_time is not None:
+                # Plain range so the (scrape_time, _id) index narrows the scan
+                conditions.append({"scrape_time": {"$gte": last_scrape_time}})
+            # $expr compares across BSON types in sort order (string and ObjectId _ids are mixed in this project,
+            # and a plain {"_id": {"$gt": ...}} only matches _ids of the same type); $ifNull treats a missing
+            # scrape_time as null, like the sort does
+            scrape_time = {"$ifNull": ["$scrape_time", None]}
+            conditions.append({"$expr": {"$or": [
+                {"$gt": [scrape_time, last_scrape_time]},
+                {"$and": [{"$eq": [scrape_time, last_scrape_time]}, {"$gt": ["$_id", last_id]}]},
+            ]}})
+        final_query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+
+        cursor = collection.find(final_query, projection).sort(MongoHandler.VECTORIZATION_SORT)
+        if skip > 0:
+            cursor = cursor.skip(skip)
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def ensure_vectorization_indexes(self):
+        """Creates the (scrape_time, _id) index the vectorization scans are ordered by (no-op if it exists)."""
+        for domain in ("news", "patents"):
+            self.collections[domain].create_index(self.VECTORIZATION_SORT, name="scrape_time_id")
+
+    def vectorization_partitions(self, domain, since_timestamp=None, partitions=4):
+        """Splits the documents to vectorize into about `partitions` disjoint scrape_time ranges.
+
+        Uses $bucketAuto, which never splits equal scrape_time values across buckets, so the ranges
+        do not overlap. Returns a list of extra queries for get_*_for_vectorization.
+        """
+        collection = self.collections.get(domain)
+        match = {}
+        if since_timestamp:
+            since_dt = date_parser.isoparse(since_timestamp) if isinstance(since_timestamp, str) else since_timestamp
+            match["scrape_time"] = {"$gt": since_dt}
+        buckets = list(collection.aggregate([
+            {"$match": match},
+            {"$bucketAuto": {"groupBy": {"$ifNull": ["$scrape_time", None]}, "buckets": partitions}},
+        ], allowDiskUse=True))
+        if len(buckets) <= 1:
+            return [None]
+
+        ranges = []
+        for position, bucket in enumerate(buckets):
+            low, high = bucket["_id"]["min"], bucket["_id"]["max"]
+            is_last = position == len(buckets) - 1
+            upper = {"$lte": high} if is_last else {"$lt": high}
+            if low is None:
+                # Documents without scrape_time sort first and land in the first bucket
+                ranges.append({"$or": [{"scrape_time": None}, {"scrape_time": upper}]})
+            else:
+                ranges.append({"scrape_time": {"$gte": low, **upper}})
+        return ranges
+
+    def iter_vectorization_batches(self, domain, since_timestamp=None, batch_size=500, max_docs=0, partitions=1, cursor_batch_size=None, after=None):
+        """Yields lists of up to `batch_size` records to vectorize, paging by (scrape_time, _id) key
+           (starting after the `after` key when given, e.g. a build watermark).
+
+        With `partitions` > 1 the collection is split into scrape_time ranges (vectorization_partitions)
+        that are read by concurrent cursors; batches are then yielded in arrival order.
+        `max_docs` > 0 stops after that many records.
+        """
+        fetch = self.get_news_for_vectorization if domain == "news" else self.get_patents_for_vectorization
+        ranges = self.vectorization_partitions(domain, since_timestamp, partitions) if partitions > 1 else [None]
+
+        start_after = after
+
+        def pages(extra_query):
+            after = start_after
+            while True:
+                records = fetch(limit=batch_size, since_timestamp=since_timestamp, after=after,
+                                extra_query=extra_query, batch_size=cursor_batch_size or batch_size)
+                if records:
+                    yield records
+                if len(records) < batch_size:
+                    return
+                after = self.vectorization_key(records[-1])
+
+        yielded = 0
+        if len(ranges) == 1:
+            for records in pages(ranges[0]):
+                if max_docs > 0:
+                    records = records[:max_docs - yielded]
+                yielded += len(records)
+                yield records
+                if max_docs > 0 and yielded >= max_docs:
+                    return
+            return
+
+        print(f"Reading {domain} in {len(ranges)} parallel scrape_time partitions.")
+        batch_queue = queue.Queue(maxsize=2 * len(ranges))
+        stopped = threading.Event()
+        done = object()
+
+        def emit(records):
+            while not stopped.is_set():
+                try:
+                    batch_queue.put(records, timeout=0.2)
+                    return
+                except queue.Full:
+                    continue
+
+        def run_range(extra_query):
+            try:
+                for records in pages(extra_query):
+                    if stopped.is_set():
+                        break
+                    emit(records)
+            except Exception as e:
+                emit(e)
+            finally:
+                emit(done)
+
+        threads = [threading.Thread(target=run_range, args=(extra_query,), name=f"mongo-{domain}-{i}", daemon=True)
+                   for i, extra_query in enumerate(ranges)]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = batch_queue.get()
+                if item is done:
+                    finished += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                if max_docs > 0:
+                    item = item[:max_docs - yielded]
+                yielded += len(item)
+                yield item
+                if max_docs > 0 and yielded >= max_docs:
+                    return
+        finally:
+            stopped.set()
+
     def count_patents_for_vectorization(self, since_timestamp=None):
         """Counts patent documents, optionally filtered by since_timestamp based on 'scrape_time'."""
         collection = self.collections.get("patents")
@@ -310,6 +464,35 @@ class MongoHandler:
                 # not a valid ObjectId string – ignore
                 pass
 
+        return self._ensure_text(domain, doc)
+
+    def get_documents_by_ids(self, domain: str, doc_ids, projection=None):
+        """Fetches many documents by _id with a single `$in` query.
+
+        Each id is matched both as the raw string and, when it parses as one, as an ObjectId
+        (see get_document_by_id). Returns a dict keyed by the *string* form of the _id; ids
+        that were not found are simply absent.
+        """
+        collection = self.collections.get(domain)
+        if collection is None:
+            print(f"Warning: Collection for domain '{domain}' not found.")
+            return {}
+
+        lookup_ids = []
+        for doc_id in dict.fromkeys(str(i) for i in doc_ids):
+            lookup_ids.append(doc_id)
+            if ObjectId.is_valid(doc_id):
+                lookup_ids.append(ObjectId(doc_id))
+        if not lookup_ids:
+            return {}
+
+        docs_by_id = {}
+        for doc in collection.find({"_id": {"$in": lookup_ids}}, projection):
+            docs_by_id[str(doc["_id"])] = self._ensure_text(domain, doc)
+        return docs_by_id
+
+    @staticmethod
+    def _ensure_text(domain, doc):
         if doc and "text" not in doc:  # For patents, reconstruct text if not directly stored
             if domain == "patents" and not doc.get("text"):
                 text_parts = [
@@ -40,16 +40,21 @@ def _create_document_from_mongo_record(record, text_field_name='text'):
             
     return Document(page_content=content, metadata=metadata)
 
-def load_news_from_mongo(mongo_handler, limit=0, skip=0, since_timestamp=None):
-    """Loads news documents from MongoDB, optionally filtered by since_timestamp."""
-    print(f"Loading news from MongoDB (collection: {NEWS_COLLECTION_NAME}, limit: {limit}, skip: {skip})...")
-    news_records = mongo_handler.get_news_for_vectorization(limit=limit, skip=skip, since_timestamp=since_timestamp)
+def documents_from_mongo_records(records, doc_type):
+    """Langchain Documents for records returned by get_news/get_patents_for_vectorization; doc_type is 'news' or 'patent'."""
     documents = []
-    for record in news_records:
+    for record in records:
         doc = _create_document_from_mongo_record(record, text_field_name='text')
         if doc:
-            doc.metadata['doc_type'] = 'news'
+            doc.metadata['doc_type'] = doc_type
             documents.append(doc)
+    return documents
+
+def load_news_from_mongo(mongo_handler, limit=0, skip=0, since_timestamp=None):
+    """Loads news documents from MongoDB, optionally filtered by since_timestamp."""
+    print(f"Loading news from MongoDB (collection: {NEWS_COLLECTION_NAME}, limit: {limit}, skip: {skip})...")
+    news_records = mongo_handler.get_news_for_vectorization(limit=limit, skip=skip, since_timestamp=since_timestamp)
+    documents = documents_from_mongo_records(news_records, 'news')
     print(f"Loaded {len(documents)} news documents from MongoDB.")
     return documents
 
@@ -57,12 +62,7 @@ def load_patents_from_mongo(mongo_handler, limit=0, skip=0, since_timestamp=None
     """Loads patent documents from MongoDB, optionally filtered by since_timestamp."""
     print(f"Loading patents from MongoDB (collection: {PATENTS_COLLECTION_NAME}, limit: {limit}, skip: {skip})...")
     patent_records = mongo_handler.get_patents_for_vectorization(limit=limit, skip=skip, since_timestamp=since_timestamp)
-    documents = []
-    for record in patent_records:
-        doc = _create_document_from_mongo_record(record, text_field_name='text')
-        if doc:
-            doc.metadata['doc_type'] = 'patent'
-            documents.append(doc)
+    documents = documents_from_mongo_records(patent_records, 'patent')
     print(f"Loaded {len(documents)} patent documents from MongoDB.")
     return documents
 
@@ -0,0 +1,159 @@
+# embedding_cache.py
+"""Disk-backed embedding cache for build_vector_store.py.
+
+Embeddings are keyed by the SHA-256 of (model name, normalized chunk text) so rebuilds from scratch,
+`CHUNK_SIZE` changes that leave most chunks identical, and index recovery do not re-run the model on
+text it has already seen. Vectors live in one fixed-width array file (`vectors.f16` or `vectors.f32`,
+memory-mapped); a small SQLite file maps keys to rows and tracks last use for size-bounded LRU eviction.
+Each model gets its own subdirectory.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_DTYPE
+
+def normalize_chunk_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace: changes that do not change the model's tokens."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, dimension: int, root: str = EMBEDDING_CACHE_PATH,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, dtype: str = EMBEDDING_CACHE_DTYPE):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, f"vectors.{'f16' if self.dtype == np.float16 else 'f32'}")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('next_slot', '0')")
+        self._vectors = None
+        self._open_vectors()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_chunk_text(text)}".encode("utf-8")).hexdigest()
+
+    def _row_bytes(self) -> int:
+        return self.dimension * self.dtype.itemsize
+
+    def _open_vectors(self, min_rows: int = 0):
+        """(Re)maps the vector file, growing it (doubling) to hold at least `min_rows` rows."""
+        current_rows = os.path.getsize(self.vectors_path) // self._row_bytes() if os.path.exists(self.vectors_path) else 0
+        rows = current_rows
+        if min_rows > current_rows:
+            rows = max(min_rows, min(2 * current_rows, self.max_entries), 1024)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(rows * self._row_bytes())
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(rows, self.dimension)) if rows else None
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """Cached float32 vectors for `texts` (None for misses). Hits are marked as recently used."""
+        keys = [self._key(text) for text in texts]
+        slots = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                slots.update(self._conn.execute(f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch).fetchall())
+            if slots:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in slots])
+            results = [np.asarray(self._vectors[slots[key]], dtype=np.float32) if key in slots else None for key in keys]
+        self.hits += len(slots)
+        self.misses += len(keys) - len(slots)
+        return results
+
+    def put_many(self, texts: list[str], vectors):
+        """Stores vectors for `texts`, evicting least-recently-used entries beyond `max_entries`."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._conn:
+            new_entries = {}
+            for text, vector in zip(texts, vectors):
+                key = self._key(text)
+                if key in new_entries:
+                    continue
+                existing = self._conn.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                new_entries[key] = (existing[0] if existing else self._allocate_slot(), vector)
+
+            self._ensure_capacity(max(slot for slot, _ in new_entries.values()) + 1 if new_entries else 0)
+            now = time.time()
+            for key, (slot, vector) in new_entries.items():
+                self._vectors[slot] = vector
+            self._conn.executemany("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                   [(key, slot, now) for key, (slot, _) in new_entries.items()])
+            self._evict()
+
+    def _allocate_slot(self) -> int:
+        free = self._conn.execute("SELECT slot FROM free_slots LIMIT 1").fetchone()
+        if free:
+            self._conn.execute("DELETE FROM free_slots WHERE slot = ?", free)
+            return free[0]
+        next_slot = int(self._conn.execute("SELECT value FROM meta WHERE name = 'next_slot'").fetchone()[0])
+        self._conn.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (str(next_slot + 1),))
+        return next_slot
+
+    def _ensure_capacity(self, rows: int):
+        if self._vectors is None or rows > len(self._vectors):
+            self._open_vectors(rows)
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Evict down to 90% so eviction does not run on every put once the cache is full
+        excess = count - int(self.max_entries * 0.9)
+        evicted = self._conn.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (excess,)).fetchall()
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+        self._conn.executemany("INSERT OR IGNORE INTO free_slots (slot) VALUES (?)", [(slot,) for _, slot in evicted])
+        print(f"Embedding cache: evicted {len(evicted)} least-recently-used entries (limit {self.max_entries}).")
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model: `embed_documents` only runs the model on texts missing from the cache."""
+
+    def __init__(self, model: Embeddings, cache: EmbeddingCache):
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        cached = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            computed = self.model.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], computed)
+            # Rounded to the cache dtype like hits, so a chunk's vector does not depend on whether it was cached
+            for i, vector in zip(missing, computed):
+                cached[i] = np.asarray(vector, dtype=self.cache.dtype).astype(np.float32)
+        return [vector.tolist() for vector in cached]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.model.embed_query(text)
@@ -0,0 +1,64 @@
+# embedding_pool.py
+"""Multi-process CPU embedding for build_vector_store.py.
+
+One `HuggingFaceEmbeddings` instance in one interpreter does not use all cores of a CPU-only build
+host. `ProcessPoolEmbeddings` starts `workers` processes, each loading its own copy of the model
+with `torch_threads` intra-op threads (torch or ONNX Runtime), shards every `embed_documents` call into `shard_size` texts
+and returns the vectors in input order.
+"""
+import multiprocessing
+import os
+import time
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_POOL_SHARD_SIZE
+
+_worker_model = None
+
+def _init_worker(torch_threads: int):
+    global _worker_model
+    # Set before torch is imported so OpenMP / MKL size their thread pools accordingly
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(torch_threads)
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass # ONNX backend
+    from vector_store_utils import get_embedding_function
+    _worker_model = get_embedding_function(device="cpu", num_threads=torch_threads)
+
+def _embed_shard(texts: list[str]) -> list[list[float]]:
+    return _worker_model.embed_documents(texts)
+
+def default_torch_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+class ProcessPoolEmbeddings(Embeddings):
+    def __init__(self, workers: int, torch_threads: int | None = None, shard_size: int = EMBEDDING_POOL_SHARD_SIZE):
+        self.workers = workers
+        self.torch_threads = torch_threads or default_torch_threads(workers)
+        self.shard_size = shard_size
+        print(f"Starting embedding pool: {workers} worker processes x {self.torch_threads} torch threads...")
+        start_time = time.time()
+        # "spawn": forking a process that already holds torch / FAISS / Mongo state is not safe
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            processes=workers, initializer=_init_worker, initargs=(self.torch_threads,)
+        )
+        # Make sure every worker has loaded the model before the first real batch
+        self._pool.map(_embed_shard, [["embedding pool warm-up"]] * workers, chunksize=1)
+        print(f"Embedding pool ready in {time.time() - start_time:.2f} seconds.")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        shards = [texts[start:start + self.shard_size] for start in range(0, len(texts), self.shard_size)]
+        # map() keeps shard order, so vectors line up with `texts`
+        return [vector for shard_vectors in self._pool.map(_embed_shard, shards, chunksize=1) for vector in shard_vectors]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
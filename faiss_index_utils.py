@@ -0,0 +1,499 @@
+# faiss_index_utils.py
+"""FAISS index types beyond the brute-force IndexFlatL2.
+
+Supported `index_type`s:
+  - "flat":     exact search, memory and query time linear in the corpus
+  - "ivf_flat": inverted lists over `nlist` k-means cells, `nprobe` cells searched per query
+  - "ivf_pq":   IVF with product-quantized vectors (`pq_m` sub-quantizers of `pq_nbits` bits)
+  - "hnsw":     graph index (`hnsw_m` links per node, `ef_search` candidates per query)
+  - "sq8":      exact scan over int8 scalar-quantized vectors (4x smaller than flat)
+  - "pq":       exact scan over product-quantized codes (`pq_m` bytes per vector with 8-bit codes)
+
+The parameters actually used are persisted as `index_params.json` next to the index so readers
+apply the same `nprobe` / `ef_search`. Quantized indexes ("sq8", "pq", "ivf_pq") also keep the
+exact float32 vectors in `vectors.f32` (row = label), which is memory-mapped and only read for
+the top candidates of each query to re-score them exactly.
+
+Vectors are stored under stable int64 labels (the `row` of chunks.sqlite) rather than positions,
+so chunks can be removed without renumbering the rest: non-IVF indexes are wrapped in an
+`IndexIDMap`, IVF indexes store labels themselves. HNSW cannot remove vectors; removed labels
+stay in the graph as tombstones (no chunk maps to them) until the index is rebuilt.
+
+Run `python faiss_index_utils.py migrate --index-type hnsw` to convert the published index: it is converted
+in a new index version (with its partitions and search worker shards rebuilt), which is then published.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+import faiss
+
+from index_versions import current_index_path, current_version, prepare_build_dir, discard_build_dir, read_manifest, write_manifest, publish
+from config import (
+    VECTOR_STORE_PATH,
+    FAISS_INDEX_TYPE,
+    FAISS_INDEX_PARAMS,
+    FAISS_TRAINING_SAMPLE_SIZE,
+    FAISS_RESCORE_FACTOR,
+    FAISS_RECALL_SAMPLE_QUERIES,
+)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "pq")
+QUANTIZED_INDEX_TYPES = ("ivf_pq", "sq8", "pq") # Lossy vector storage, re-scored from vectors.f32
+INDEX_PARAMS_FILENAME = "index_params.json"
+FAISS_INDEX_FILENAME = "index.faiss" # Name used by LangChain's FAISS.save_local / load_local
+RESCORE_VECTORS_FILENAME = "vectors.f32"
+SELECTOR_UNSUPPORTED_TYPES = (faiss.IndexPQ,) # Their search() raises on any SearchParameters, including an ID selector
+
+def index_needs_training(index_type: str) -> bool:
+    return index_type in ("ivf_flat", "ivf_pq", "sq8", "pq")
+
+def is_quantized(index_type: str) -> bool:
+    return index_type in QUANTIZED_INDEX_TYPES
+
+def resolve_index_params(index_type: str, num_vectors: int, overrides: dict | None = None) -> dict:
+    """Config defaults + overrides, with `nlist` capped so every cell gets enough training points."""
+    params = {**FAISS_INDEX_PARAMS, **(overrides or {}), "index_type": index_type}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # FAISS wants ~39 training points per centroid; cap nlist instead of training on too few points
+        params["nlist"] = max(1, min(int(params["nlist"]), num_vectors // 39 or 1))
+        params["nprobe"] = max(1, min(int(params["nprobe"]), params["nlist"]))
+    return params
+
+def create_faiss_index(index_type: str, dimension: int, params: dict):
+    """Creates an empty (untrained) index of the given type."""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, int(params["nlist"]))
+    if index_type == "ivf_pq":
+        if dimension % int(params["pq_m"]) != 0:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}.")
+        return faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, int(params["nlist"]),
+                                int(params["pq_m"]), int(params["pq_nbits"]))
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, int(params["hnsw_m"]))
+        index.hnsw.efConstruction = int(params["ef_construction"])
+        return index
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "pq":
+        if dimension % int(params["pq_m"]) != 0:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}.")
+        return faiss.IndexPQ(dimension, int(params["pq_m"]), int(params["pq_nbits"]))
+    raise ValueError(f"Unknown FAISS index type '{index_type}'. Expected one of: {', '.join(INDEX_TYPES)}")
+
+def base_index(index):
+    """The index inside an IndexIDMap wrapper (the index itself otherwise)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def _ivf_of(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None # Not an IVF index
+
+def is_id_mapped(index) -> bool:
+    """True if the index keeps explicit labels (IndexIDMap wrapper, or IVF)."""
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) or _ivf_of(index) is not None
+
+def wrap_id_map(index):
+    """Wraps a positional index (built before labels were used) in an IndexIDMap; each vector's label is its position."""
+    if is_id_mapped(index):
+        return index
+    # IndexIDMap only accepts an empty index, so the filled one is swapped in afterwards
+    wrapped = faiss.IndexIDMap(create_faiss_index("flat", index.d, {}))
+    wrapped.index = index
+    wrapped.ntotal = index.ntotal
+    wrapped.referenced_objects = [index]
+    faiss.copy_array_to_vector(np.arange(index.ntotal, dtype=np.int64), wrapped.id_map)
+    return wrapped
+
+def index_labels(index) -> np.ndarray:
+    """Labels of every vector stored in `index`, in storage order."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    ivf = _ivf_of(index)
+    if ivf is None:
+        return np.arange(index.ntotal, dtype=np.int64)
+    invlists = ivf.invlists
+    parts = []
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = invlists.get_ids(list_no)
+            parts.append(faiss.rev_swig_ptr(ids, size).copy())
+            invlists.release_ids(list_no, ids)
+    return np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+
+def label_bound(index) -> int:
+    """1 + the largest label in `index` (0 when empty): the next label to assign."""
+    return int(index_labels(index).max()) + 1 if index.ntotal else 0
+
+def supports_removal(index) -> bool:
+    return not isinstance(base_index(index), faiss.IndexHNSW)
+
+def remove_labels(index, labels) -> int:
+    """Removes the vectors with these labels; returns how many were removed (0 for HNSW, which keeps them as tombstones)."""
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(labels) == 0 or not supports_removal(index):
+        return 0
+    return int(index.remove_ids(faiss.IDSelectorBatch(labels)))
+
+def selector_params(index, mask: np.ndarray):
+    """Search parameters restricting a search of `index` to the labels where `mask` is True (keeping nprobe / efSearch).
+
+    None for index types whose search rejects parameters (IndexPQ); callers then filter the hits themselves.
+    """
+    if isinstance(base_index(index), SELECTOR_UNSUPPORTED_TYPES):
+        return None
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)) # Size in bytes; labels past it are excluded
+    ivf = _ivf_of(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif isinstance(base_index(index), faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base_index(index).hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [selector, bitmap] # The selector only points at the bitmap
+    return params
+
+def apply_search_params(index, params: dict):
+    """Applies query-time parameters (nprobe / efSearch) to a loaded index."""
+    index_type = params.get("index_type", "flat")
+    if index_type.startswith("ivf"):
+        faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+    elif index_type == "hnsw":
+        faiss.downcast_index(base_index(index)).hnsw.efSearch = int(params["ef_search"])
+
+def sample_vectors(vectors: np.ndarray, sample_size: int = FAISS_TRAINING_SAMPLE_SIZE, seed: int = 0) -> np.ndarray:
+    """Random training sample (without replacement) of at most `sample_size` rows."""
+    if len(vectors) <= sample_size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+
+def reconstruct_all(index) -> tuple[np.ndarray, np.ndarray]:
+    """`(labels, vectors)` of everything stored in `index` (vectors are approximate for quantized indexes)."""
+    if index.ntotal == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, index.d), dtype=np.float32)
+    labels = index_labels(index)
+    ivf = _ivf_of(index)
+    if ivf is not None:
+        # Labels are not positions, so reconstruct through a label -> entry hash table
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return labels, ivf.reconstruct_batch(labels)
+    return labels, base_index(index).reconstruct_n(0, index.ntotal)
+
+def vectors_for_labels(index, labels: np.ndarray, rescore_vectors=None) -> np.ndarray:
+    """Vectors of `labels`, in that order: exact from `rescore_vectors` when given, reconstructed from `index` otherwise."""
+    labels = np.asarray(labels, dtype=np.int64)
+    if rescore_vectors is not None:
+        return np.asarray(rescore_vectors[labels], dtype=np.float32)
+    if len(labels) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    ivf = _ivf_of(index)
+    if ivf is not None:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return ivf.reconstruct_batch(labels)
+    stored = index_labels(index)
+    order = np.argsort(stored, kind="stable")
+    positions = order[np.searchsorted(stored, labels, sorter=order)]
+    return base_index(index).reconstruct_batch(positions)
+
+def build_index_from_vectors(vectors: np.ndarray, index_type: str, params: dict, sample_size: int = FAISS_TRAINING_SAMPLE_SIZE,
+                             labels: np.ndarray | None = None):
+    """Creates, trains (on a sample) and fills an id-mapped index. Row i of `vectors` gets label `labels[i]` (default i)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    labels = np.arange(len(vectors), dtype=np.int64) if labels is None else np.ascontiguousarray(labels, dtype=np.int64)
+    index = create_faiss_index(index_type, vectors.shape[1], params)
+    if not index_type.startswith("ivf"):
+        index = faiss.IndexIDMap(index)
+    if index_needs_training(index_type):
+        training_sample = sample_vectors(vectors, sample_size)
+        print(f"Training {index_type} index on {len(training_sample)} sample vectors...")
+        start_time = time.time()
+        index.train(training_sample)
+        print(f"Training finished in {time.time() - start_time:.2f} seconds.")
+    # Add in slices to keep peak memory of the temporary copies bounded
+    for start in range(0, len(vectors), 100_000):
+        index.add_with_ids(vectors[start:start + 100_000], labels[start:start + 100_000])
+    apply_search_params(index, params)
+    return index
+
+def convert_index(index, index_type: str, overrides: dict | None = None, sample_size: int = FAISS_TRAINING_SAMPLE_SIZE,
+                  vectors: np.ndarray | None = None, labels: np.ndarray | None = None):
+    """Rebuilds `index` as `index_type`, keeping every vector's label (so chunks.sqlite rows stay valid).
+
+    Pass the exact `labels` / `vectors` (see exact_vectors_of) when `index` is quantized or has tombstones;
+    otherwise everything stored is reconstructed from it. Returns `(new_index, params)`.
+    """
+    if vectors is None:
+        labels, vectors = reconstruct_all(index)
+    params = resolve_index_params(index_type, len(vectors), overrides)
+    print(f"Converting FAISS index with {len(vectors)} vectors to '{index_type}' ({params})...")
+    return build_index_from_vectors(vectors, index_type, params, sample_size, labels), params
+
+def read_faiss_index(faiss_file: str, mmap: bool = True):
+    """Reads an index, memory-mapping its data read-only when possible (falls back to a normal read)."""
+    if mmap:
+        try:
+            return faiss.read_index(faiss_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"Could not memory-map {faiss_file} ({e}). Reading it into memory instead.")
+    return faiss.read_index(faiss_file)
+
+def load_index_params(index_path: str) -> dict:
+    """Persisted parameters of the index at `index_path` ({"index_type": "flat"} for indexes built before they existed)."""
+    params_path = os.path.join(index_path, INDEX_PARAMS_FILENAME)
+    if os.path.exists(params_path):
+        with open(params_path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"index_type": "flat"}
+
+def save_index_params(index_path: str, params: dict):
+    os.makedirs(index_path, exist_ok=True)
+    temp_path = os.path.join(index_path, INDEX_PARAMS_FILENAME + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+    os.replace(temp_path, os.path.join(index_path, INDEX_PARAMS_FILENAME))
+
+def load_rescore_vectors(index_path: str, dimension: int, expected_rows: int | None = None):
+    """Memory-maps the exact vectors kept next to a quantized index, or returns None if there are none (or too few).
+
+    `expected_rows` is the index's label_bound: row `label` holds the vector of that label.
+    """
+    vectors_path = os.path.join(index_path, RESCORE_VECTORS_FILENAME)
+    if not os.path.exists(vectors_path) or os.path.getsize(vectors_path) == 0:
+        return None
+    vectors = np.memmap(vectors_path, dtype=np.float32, mode="r").reshape(-1, dimension)
+    if expected_rows is not None and len(vectors) < expected_rows:
+        print(f"Warning: {vectors_path} has {len(vectors)} vectors but the index has labels up to {expected_rows - 1}. Exact re-scoring disabled.")
+        return None
+    return vectors
+
+def save_rescore_vectors(index_path: str, labels: np.ndarray, vectors: np.ndarray):
+    """Writes vectors.f32 with each vector at the row of its label (rows of removed labels are zero)."""
+    os.makedirs(index_path, exist_ok=True)
+    vectors_path = os.path.join(index_path, RESCORE_VECTORS_FILENAME)
+    by_label = np.zeros((int(labels.max()) + 1 if len(labels) else 0, vectors.shape[1]), dtype=np.float32)
+    by_label[labels] = vectors
+    by_label.tofile(vectors_path + ".tmp")
+    os.replace(vectors_path + ".tmp", vectors_path)
+
+def write_rescore_vectors(index_path: str, first_label: int, vectors: np.ndarray):
+    """Writes the exact vectors of labels `first_label`, `first_label + 1`, ... into vectors.f32."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    vectors_path = os.path.join(index_path, RESCORE_VECTORS_FILENAME)
+    with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "wb") as f:
+        f.seek(first_label * vectors.shape[1] * vectors.itemsize)
+        vectors.tofile(f)
+
+def truncate_rescore_vectors(index_path: str, dimension: int, rows: int):
+    """Drops exact vectors past `rows` (written by a build checkpoint that crashed before writing the index)."""
+    vectors_path = os.path.join(index_path, RESCORE_VECTORS_FILENAME)
+    row_bytes = dimension * np.dtype(np.float32).itemsize
+    if os.path.exists(vectors_path) and os.path.getsize(vectors_path) > rows * row_bytes:
+        print(f"Dropping {os.path.getsize(vectors_path) // row_bytes - rows} vectors in {vectors_path} that are not in the index.")
+        with open(vectors_path, "r+b") as f:
+            f.truncate(rows * row_bytes)
+
+def remove_rescore_vectors(index_path: str):
+    vectors_path = os.path.join(index_path, RESCORE_VECTORS_FILENAME)
+    if os.path.exists(vectors_path):
+        os.remove(vectors_path)
+
+def search_with_rescore(index, queries: np.ndarray, k: int, rescore_vectors=None, rescore_factor: int = FAISS_RESCORE_FACTOR,
+                        params=None):
+    """`index.search`, but with `rescore_vectors` fetches `k * rescore_factor` candidates and re-ranks them by exact L2 distance.
+
+    `params` (e.g. from `selector_params`) is passed to FAISS. Returns `(distances, ids)` of shape (len(queries), k),
+    padded with -1 ids like FAISS.
+    """
+    if rescore_vectors is None:
+        return index.search(queries, k, params=params)
+    _, candidate_ids = index.search(queries, k * rescore_factor, params=params)
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, query in enumerate(queries):
+        candidates = candidate_ids[row][candidate_ids[row] >= 0]
+        if len(candidates) == 0:
+            continue
+        # Sorted ids keep the memmap reads sequential
+        candidates = np.sort(candidates)
+        exact = ((np.asarray(rescore_vectors[candidates]) - query) ** 2).sum(axis=1)
+        best = np.argsort(exact, kind="stable")[:k]
+        distances[row, :len(best)] = exact[best]
+        ids[row, :len(best)] = candidates[best]
+    return distances, ids
+
+def index_memory_bytes(index) -> int:
+    """Size of the index as FAISS holds it in memory (its serialized size)."""
+    return int(faiss.serialize_index(index).nbytes)
+
+def measure_recall(index, exact_vectors: np.ndarray, k: int = 10, num_queries: int = FAISS_RECALL_SAMPLE_QUERIES,
+                   rescore_vectors=None, rescore_factor: int = FAISS_RESCORE_FACTOR, seed: int = 0,
+                   labels: np.ndarray | None = None) -> float:
+    """recall@k of `index` against exact search over `exact_vectors` (whose labels are `labels`, default 0..n-1).
+
+    Queries are midpoints of random pairs of stored vectors, so they are realistic but not stored points themselves.
+    """
+    rng = np.random.default_rng(seed)
+    num_queries = min(num_queries, len(exact_vectors))
+    pairs = rng.integers(0, len(exact_vectors), size=(num_queries, 2))
+    queries = (np.asarray(exact_vectors[pairs[:, 0]]) + np.asarray(exact_vectors[pairs[:, 1]])) / 2
+    queries = np.ascontiguousarray(queries / np.linalg.norm(queries, axis=1, keepdims=True), dtype=np.float32)
+    _, true_ids = faiss.knn(queries, np.ascontiguousarray(exact_vectors, dtype=np.float32), k)
+    if labels is not None:
+        true_ids = np.asarray(labels)[true_ids]
+    _, found_ids = search_with_rescore(index, queries, k, rescore_vectors, rescore_factor)
+    hits = sum(len(set(true_row) & set(found_row)) for true_row, found_row in zip(true_ids, found_ids))
+    return hits / (num_queries * k)
+
+def report_index_quality(index, index_type: str, exact_vectors: np.ndarray | None, rescore_vectors=None, k: int = 10,
+                         labels: np.ndarray | None = None):
+    """Prints the index memory next to a flat float32 index and its recall@k against exact search (not needed for "flat")."""
+    if index.ntotal == 0:
+        return
+    index_bytes = index_memory_bytes(index)
+    flat_bytes = index.ntotal * index.d * 4
+    print(f"FAISS index memory ({index_type}): {index_bytes / 2**20:.1f} MB "
+          f"vs {flat_bytes / 2**20:.1f} MB for flat float32 ({index_bytes / flat_bytes:.0%}).")
+    if index_type == "flat" or exact_vectors is None:
+        return
+    recall = measure_recall(index, exact_vectors, k, labels=labels)
+    message = f"recall@{k} vs exact search: {recall:.3f}"
+    if rescore_vectors is not None:
+        rescored_recall = measure_recall(index, exact_vectors, k, rescore_vectors=rescore_vectors, labels=labels)
+        message += f" without re-scoring, {rescored_recall:.3f} with exact re-scoring of the top {k * FAISS_RESCORE_FACTOR} (vectors.f32 on disk, memory-mapped)"
+    print(f"FAISS index {message}.")
+
+def exact_vectors_of(index, index_path: str, live_labels=None) -> tuple[np.ndarray, np.ndarray]:
+    """`(labels, vectors)` of a persisted index, exact from vectors.f32 for quantized indexes, reconstructed otherwise.
+
+    With `live_labels` (the rows of chunks.sqlite) tombstoned vectors are left out.
+    """
+    rescore_vectors = load_rescore_vectors(index_path, index.d, label_bound(index))
+    if rescore_vectors is not None:
+        labels, vectors = np.sort(index_labels(index)), None # Sorted labels keep the memmap reads sequential
+    else:
+        labels, vectors = reconstruct_all(index)
+    if live_labels is not None:
+        keep = np.isin(labels, np.asarray(list(live_labels), dtype=np.int64))
+        labels = labels[keep]
+        if vectors is not None:
+            vectors = vectors[keep]
+    if vectors is None:
+        vectors = np.asarray(rescore_vectors[labels])
+    return labels, vectors
+
+def store_exact_vectors(index_path: str, index_type: str, labels: np.ndarray, vectors: np.ndarray):
+    """Keeps vectors.f32 in line with the index type: written for quantized indexes, removed otherwise."""
+    if is_quantized(index_type):
+        save_rescore_vectors(index_path, labels, vectors)
+    else:
+        remove_rescore_vectors(index_path)
+
+def _live_labels(index_path: str) -> list[int] | None:
+    """Labels that have a chunk in the chunks.sqlite at `index_path` (None without one); only reads the file."""
+    chunk_store_path = os.path.join(index_path, "chunks.sqlite")
+    if not os.path.exists(chunk_store_path):
+        return None
+    conn = sqlite3.connect(f"file:{chunk_store_path}?mode=ro", uri=True)
+    try:
+        return [row for (row,) in conn.execute("SELECT row FROM rows")]
+    finally:
+        conn.close()
+
+def migrate_index(index_path: str, index_type: str, overrides: dict | None = None):
+    """Converts the persisted index at `index_path` to `index_type` in place (docstore untouched).
+
+    Only for directories no reader has been given yet (an unpublished build or the legacy in-place index);
+    published versions are sealed, see `migrate_published_index`.
+    """
+    if read_manifest(index_path) is not None:
+        raise ValueError(f"{index_path} is a published index version and cannot be changed in place. "
+                         f"Use migrate_published_index to convert it into a new version.")
+    faiss_file = os.path.join(index_path, FAISS_INDEX_FILENAME)
+    current_params = load_index_params(index_path)
+    print(f"Loading {current_params['index_type']} index from {faiss_file}...")
+    index = faiss.read_index(faiss_file)
+    live_labels = _live_labels(index_path) # Drops HNSW tombstones
+    labels, vectors = exact_vectors_of(index, index_path, live_labels)
+    new_index, params = convert_index(index, index_type, overrides, vectors=vectors, labels=labels)
+    temp_file = faiss_file + ".tmp"
+    faiss.write_index(new_index, temp_file)
+    store_exact_vectors(index_path, index_type, labels, vectors)
+    os.replace(temp_file, faiss_file)
+    save_index_params(index_path, params)
+    print(f"Migrated {new_index.ntotal} vectors to '{index_type}' at {index_path}.")
+    report_index_quality(new_index, index_type, vectors, load_rescore_vectors(index_path, new_index.d, label_bound(new_index)), labels=labels)
+
+def migrate_published_index(index_type: str, overrides: dict | None = None, root: str = VECTOR_STORE_PATH) -> str:
+    """Converts the published index to `index_type` in a new version and publishes it. Returns the new version's directory.
+
+    The published version is copied (see prepare_build_dir) and converted there. Partitions and search worker
+    shards depend on the index type, so they are rebuilt if the version has them; chunks, metadata columns and
+    the BM25 index do not change.
+    """
+    # Imported here: both modules build on this one
+    from partitioned_index import build_partitions, read_catalog, remove_partitions
+    from search_workers import build_shards, read_shard_catalog
+    from metadata_columns import MetadataColumns
+
+    published_dir = current_index_path(root)
+    manifest = read_manifest(published_dir)
+    if current_version(root) is None or manifest is None:
+        raise FileNotFoundError(f"No published index version under {root}.")
+    build_dir, resumed = prepare_build_dir(root)
+    if resumed:
+        raise RuntimeError(f"An unfinished build is in {build_dir}. Finish it with build_vector_store.py "
+                           f"(which converts to FAISS_INDEX_TYPE) or remove it, then migrate again.")
+    try:
+        migrate_index(build_dir, index_type, overrides)
+        index = faiss.read_index(os.path.join(build_dir, FAISS_INDEX_FILENAME))
+        params = load_index_params(build_dir)
+        rescore_vectors = load_rescore_vectors(build_dir, index.d, label_bound(index))
+        if read_catalog(build_dir) is not None:
+            columns = MetadataColumns.load(build_dir)
+            if columns is None:
+                remove_partitions(build_dir)
+            else:
+                build_partitions(index, build_dir, columns, params["index_type"], rescore_vectors)
+        shard_catalog = read_shard_catalog(build_dir)
+        if shard_catalog is not None:
+            build_shards(index, build_dir, shard_catalog["num_shards"], params["index_type"],
+                         _live_labels(build_dir) or index_labels(index), rescore_vectors)
+        write_manifest(build_dir, index.ntotal, manifest["embedding_model"], params)
+    except Exception:
+        discard_build_dir(build_dir)
+        raise
+    publish(build_dir, root)
+    return build_dir
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="FAISS index maintenance.")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subcommands.add_parser("migrate", help="Convert the persisted index to another index type.")
+    migrate_parser.add_argument("--index-type", choices=INDEX_TYPES, default=FAISS_INDEX_TYPE)
+    migrate_parser.add_argument("--index-path", help="Convert this unpublished directory in place instead of publishing a new version")
+    migrate_parser.add_argument("--nlist", type=int)
+    migrate_parser.add_argument("--nprobe", type=int)
+    migrate_parser.add_argument("--pq-m", type=int)
+    migrate_parser.add_argument("--ef-search", type=int)
+    args = arg_parser.parse_args()
+
+    cli_overrides = {key: value for key, value in {
+        "nlist": args.nlist, "nprobe": args.nprobe, "pq_m": args.pq_m, "ef_search": args.ef_search,
+    }.items() if value is not None}
+    if args.index_path:
+        migrate_index(args.index_path, args.index_type, cli_overrides)
+    elif current_version(VECTOR_STORE_PATH) is None:
+        migrate_index(current_index_path(VECTOR_STORE_PATH), args.index_type, cli_overrides) # Legacy unversioned index
+    else:
+        migrate_published_index(args.index_type, cli_overrides)
@@ -0,0 +1,245 @@
+# faiss_vector_store.py
+"""LangChain FAISS store used by the build, the CLI and the API.
+
+`MaritimeFAISS` behaves like `langchain_community.vectorstores.FAISS` with two additions:
+  - quantized indexes: when `rescore_vectors` (the memory-mapped exact vectors, see
+    faiss_index_utils.py) is set, searches fetch `k * rescore_factor` candidates from the
+    compressed index and return them ordered by exact L2 distance.
+  - on-disk layout: `save_local` writes `index.faiss` + `chunks.sqlite` (see chunk_store.py)
+    instead of a pickle, and `load_local` memory-maps the index and reads chunks lazily.
+    Stores saved with the legacy `index.pkl` still load; `python faiss_vector_store.py migrate`
+    converts them.
+  - filters: with `metadata_columns` (metadata_columns.py, written by the build) a filter is compiled to a label
+    mask and applied inside the FAISS search, so it returns the `k` best matching chunks rather than the matches
+    among the `fetch_k` nearest ones. Filters the columns cannot evaluate still run in Python.
+  - partitions: with `partitions` (partitioned_index.py) a filter that bounds doc_type / date only searches the
+    (doc_type, year) partitions that can match, and merges their top k.
+  - hybrid search: with `bm25` (bm25_index.py) `similarity_search_with_score(..., hybrid=True)` also runs a BM25
+    keyword search under the same filter and returns both hit lists fused by reciprocal rank; scores are then
+    fusion scores (higher is better) instead of distances.
+  - adaptive cutoff: `similarity_search_with_score(..., cutoff=settings)` shortens the hit list where the scores
+    stop standing out (retrieval_cutoff.py); in hybrid searches each list is cut before fusion.
+  - removal: vectors carry stable labels (see faiss_index_utils.py), so `delete` and
+    `delete_documents` (by mongo_id) remove chunks without renumbering the others. Labels
+    without a chunk (HNSW tombstones) are skipped by searches.
+"""
+import argparse
+import os
+import time
+import uuid
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from config import VECTOR_STORE_PATH, FAISS_RESCORE_FACTOR
+from faiss_index_utils import search_with_rescore, read_faiss_index, wrap_id_map, label_bound, remove_labels, selector_params
+from index_versions import current_index_path
+from bm25_index import reciprocal_rank_fusion
+from retrieval_cutoff import cut_hits
+from chunk_store import CHUNK_STORE_FILENAME, SqliteDocstore, SqliteRowMap, write_chunk_store, chunk_ids_for_documents
+
+LEGACY_DOCSTORE_FILENAME = "index.pkl"
+
+class MaritimeFAISS(FAISS):
+    rescore_vectors = None
+    rescore_factor = FAISS_RESCORE_FACTOR
+    next_label = None # Label of the next added vector, read from the index on the first add
+    metadata_columns = None # MetadataColumns of the loaded index, used to push filters into the search
+    partitions = None # PartitionedIndex of the loaded index, searched instead of the full index when a filter allows
+    bm25 = None # BM25Index of the loaded index, searched alongside FAISS by hybrid searches
+
+    def _search(self, vector: np.ndarray, k: int, params=None):
+        """Returns `(distances, ids)` for one query row, like `index.search`."""
+        return search_with_rescore(self.index, vector, k, self.rescore_vectors, self.rescore_factor, params=params)
+
+    def _documents_for_rows(self, row_ids: list[int]) -> dict:
+        if hasattr(self.docstore, "get_by_rows"):
+            return self.docstore.get_by_rows(row_ids)
+        return {row_id: self.docstore.search(self.index_to_docstore_id[row_id]) for row_id in row_ids if row_id in self.index_to_docstore_id}
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> list[str]:
+        texts, embeddings = zip(*text_embeddings) if text_embeddings else ((), ())
+        return self._add_labeled(list(texts), list(embeddings), metadatas, ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list[str]:
+        texts = list(texts)
+        return self._add_labeled(texts, self._embed_documents(texts), metadatas, ids)
+
+    def _add_labeled(self, texts: list[str], embeddings, metadatas=None, ids=None) -> list[str]:
+        """Adds vectors under new labels (`next_label`, `next_label + 1`, ...) and maps the labels to their chunks."""
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if len(ids) != len(set(ids)):
+            raise ValueError("Duplicate ids found in the ids list.")
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.array(embeddings, dtype=np.float32).reshape(len(texts), self.index.d)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        if self.next_label is None:
+            self.index = wrap_id_map(self.index)
+            self.next_label = label_bound(self.index)
+        labels = np.arange(self.next_label, self.next_label + len(texts), dtype=np.int64)
+        self.index.add_with_ids(vectors, labels)
+        self.next_label += len(texts)
+        self.docstore.add({chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata)
+                           for chunk_id, text, metadata in zip(ids, texts, metadatas)})
+        self.index_to_docstore_id.update({int(label): chunk_id for label, chunk_id in zip(labels, ids)})
+        return ids
+
+    def delete(self, ids: list[str] | None = None, **kwargs) -> bool:
+        """Removes chunks by chunk id: their vectors (tombstoned in HNSW), label mappings and texts."""
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        wanted = set(ids)
+        if hasattr(self.docstore, "rows_for_ids"):
+            rows = [row for row, _ in self.docstore.rows_for_ids(list(wanted))]
+        else:
+            rows = [row for row, chunk_id in self.index_to_docstore_id.items() if chunk_id in wanted]
+        if not rows:
+            return False
+        remove_labels(self.index, rows)
+        if hasattr(self.docstore, "delete_rows"):
+            self.docstore.delete_rows(rows)
+        else:
+            for row in rows:
+                del self.index_to_docstore_id[row]
+            self.docstore.delete(list(wanted))
+        return True
+
+    def delete_documents(self, mongo_ids: list[str]) -> int:
+        """Removes every chunk of these Mongo documents. Returns the number of chunks removed."""
+        chunk_ids = [chunk_id for ids in chunk_ids_for_documents(self.docstore, mongo_ids).values() for chunk_id in ids]
+        if chunk_ids:
+            self.delete(chunk_ids)
+        return len(chunk_ids)
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None, fetch_k: int = 20, **kwargs):
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        mask = self.metadata_columns.mask(filter) if isinstance(filter, dict) and self.metadata_columns is not None else None
+        params = None
+        if mask is not None:
+            if not mask.any():
+                return []
+            params = selector_params(self.index, mask)
+            if params is None:
+                mask = None # The index type cannot take an ID selector; filter in Python below
+        if mask is not None:
+            # FAISS only visits matching labels, so the first k hits already satisfy the filter
+            wanted, filter_func = k, None
+        else:
+            wanted = k if filter is None else fetch_k
+            filter_func = self._create_filter_func(filter) if filter is not None else None
+
+        partition_names = self.partitions.select(filter) if self.partitions is not None and filter is not None else None
+        if partition_names is not None and not partition_names:
+            return []
+
+        search_k = wanted
+        while True:
+            if partition_names is not None:
+                scores, indices = self.partitions.search(partition_names, vector, search_k, mask)
+            else:
+                scores, indices = self._search(vector, search_k, params)
+            hits = [(int(i), score) for score, i in zip(scores[0], indices[0]) if i != -1] # -1: fewer hits than requested
+            docs_by_row = self._documents_for_rows([row_id for row_id, _ in hits])
+            # Labels without a chunk are removed chunks still in an HNSW graph; search deeper to make up for them
+            live_hits = [(row_id, score) for row_id, score in hits if isinstance(docs_by_row.get(row_id), Document)]
+            if len(live_hits) >= wanted or len(hits) < search_k or search_k >= 8 * wanted:
+                break
+            search_k *= 2
+        docs = []
+        for row_id, score in live_hits[:wanted]:
+            doc = docs_by_row[row_id]
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, score))
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            # Euclidean distances: lower is more similar
+            docs = [(doc, score) for doc, score in docs if score <= score_threshold]
+        return docs[:k]
+
+    def keyword_search_with_score(self, query: str, k: int = 4, filter=None, fetch_k: int = 20):
+        """Top `k` `(doc, bm25_score)` for the terms of `query`, best first; empty without a BM25 index."""
+        if self.bm25 is None:
+            return []
+        mask = self.metadata_columns.mask(filter) if isinstance(filter, dict) and self.metadata_columns is not None else None
+        filter_func = self._create_filter_func(filter) if filter is not None and mask is None else None
+        scores, labels = self.bm25.search(query, k if filter_func is None else max(k, fetch_k), mask)
+        docs_by_row = self._documents_for_rows([int(label) for label in labels])
+        docs = []
+        for label, score in zip(labels, scores):
+            doc = docs_by_row.get(int(label))
+            if isinstance(doc, Document) and (filter_func is None or filter_func(doc.metadata)):
+                docs.append((doc, float(score)))
+        return docs[:k]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter=None, fetch_k: int = 20, **kwargs):
+        """FAISS search; with `hybrid=True` (and a BM25 index) fused with a keyword search for `keyword_query` (default `query`).
+
+        `cutoff` (see RETRIEVAL_CUTOFF) drops the hits after the point where the scores stop standing out.
+        """
+        hybrid = kwargs.pop("hybrid", False)
+        keyword_query = kwargs.pop("keyword_query", None) or query
+        cutoff = kwargs.pop("cutoff", None)
+        dense = cut_hits(super().similarity_search_with_score(query, k, filter=filter, fetch_k=fetch_k, **kwargs), cutoff, "vector")
+        if not hybrid or self.bm25 is None:
+            return dense
+        keyword = cut_hits(self.keyword_search_with_score(keyword_query, k, filter, fetch_k), cutoff, "keyword", higher_is_better=True)
+        return reciprocal_rank_fusion([dense, keyword], k)
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        """Writes `index.faiss` and `chunks.sqlite` (the index file is replaced last, so readers never see it ahead of its chunks)."""
+        os.makedirs(folder_path, exist_ok=True)
+        faiss_file = os.path.join(folder_path, f"{index_name}.faiss")
+        faiss.write_index(self.index, faiss_file + ".tmp")
+
+        chunk_store_path = os.path.join(folder_path, CHUNK_STORE_FILENAME)
+        if isinstance(self.docstore, SqliteDocstore) and os.path.abspath(self.docstore.path) == os.path.abspath(chunk_store_path):
+            self.docstore.commit()
+        else:
+            write_chunk_store(chunk_store_path, self.docstore, self.index_to_docstore_id)
+        os.replace(faiss_file + ".tmp", faiss_file)
+
+        legacy_path = os.path.join(folder_path, f"{index_name}.pkl")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings, index_name: str = "index", *,
+                   allow_dangerous_deserialization: bool = False, writable: bool = False, **kwargs):
+        """Opens a saved store. Read-only stores memory-map the index; `writable=True` (the build) reads it into memory."""
+        chunk_store_path = os.path.join(folder_path, CHUNK_STORE_FILENAME)
+        if not os.path.exists(chunk_store_path):
+            print(f"No {CHUNK_STORE_FILENAME} in {folder_path}; loading the legacy pickled docstore "
+                  f"(run 'python faiss_vector_store.py migrate' to convert it).")
+            return super().load_local(folder_path, embeddings, index_name,
+                                      allow_dangerous_deserialization=allow_dangerous_deserialization, **kwargs)
+        index = read_faiss_index(os.path.join(folder_path, f"{index_name}.faiss"), mmap=not writable)
+        docstore = SqliteDocstore(chunk_store_path, read_only=not writable)
+        if writable:
+            index = wrap_id_map(index)
+            docstore.truncate_rows(label_bound(index))
+        return cls(embeddings, index, docstore, SqliteRowMap(docstore), **kwargs)
+
+def migrate_legacy_docstore(index_path: str):
+    """Converts a store saved with the pickled docstore (index.pkl) to chunks.sqlite."""
+    if not os.path.exists(os.path.join(index_path, LEGACY_DOCSTORE_FILENAME)):
+        print(f"No {LEGACY_DOCSTORE_FILENAME} in {index_path}. Nothing to migrate.")
+        return
+    start_time = time.time()
+    legacy_store = FAISS.load_local(index_path, None, allow_dangerous_deserialization=True)
+    print(f"Loaded legacy docstore with {len(legacy_store.index_to_docstore_id)} chunks in {time.time() - start_time:.2f} seconds.")
+    write_chunk_store(os.path.join(index_path, CHUNK_STORE_FILENAME), legacy_store.docstore, legacy_store.index_to_docstore_id)
+    os.remove(os.path.join(index_path, LEGACY_DOCSTORE_FILENAME))
+    print(f"Wrote {os.path.join(index_path, CHUNK_STORE_FILENAME)} in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="FAISS store maintenance.")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subcommands.add_parser("migrate", help=f"Convert a pickled docstore (index.pkl) to {CHUNK_STORE_FILENAME}.")
+    migrate_parser.add_argument("--index-path", default=current_index_path(VECTOR_STORE_PATH))
+    args = arg_parser.parse_args()
+    migrate_legacy_docstore(args.index_path)
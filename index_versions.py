@@ -0,0 +1,205 @@
+# index_versions.py
+"""Versioned FAISS index directories with atomic publish.
+
+Each build writes a new directory under `{VECTOR_STORE_PATH}/versions/` (a copy of the published
+version plus what the build adds) and publishes it by writing `manifest.json` and atomically
+swapping the `{VECTOR_STORE_PATH}/current` symlink to it. Readers resolve `current` once per load,
+so they never see a directory that is still being written; long-running readers (AnalysisService)
+poll `current_version()` and hot-swap to the new version. A version directory without a manifest is
+an unfinished build, which the next build resumes.
+
+    python index_versions.py list               # versions, newest first (* = published)
+    python index_versions.py publish <version>  # roll back / forward to an existing version
+    python index_versions.py verify [<version>] # re-check the manifest checksums
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+from config import VECTOR_STORE_PATH, INDEX_VERSIONS_TO_KEEP
+
+VERSIONS_DIRNAME = "versions"
+CURRENT_LINK_NAME = "current"
+MANIFEST_FILENAME = "manifest.json"
+LEGACY_INDEX_DIRNAME = "faiss_index" # Unversioned index written in place by older builds
+
+def _versions_dir(root: str) -> str:
+    return os.path.join(root, VERSIONS_DIRNAME)
+
+def current_version(root: str = VECTOR_STORE_PATH) -> str | None:
+    """Name of the published version, or None before the first versioned build."""
+    link = os.path.join(root, CURRENT_LINK_NAME)
+    return os.path.basename(os.readlink(link)) if os.path.islink(link) else None
+
+def current_index_path(root: str = VECTOR_STORE_PATH) -> str:
+    """Resolved directory of the published version (the legacy in-place directory if nothing is published yet)."""
+    version = current_version(root)
+    if version is None:
+        return os.path.join(root, LEGACY_INDEX_DIRNAME)
+    return os.path.join(_versions_dir(root), version)
+
+def list_versions(root: str = VECTOR_STORE_PATH) -> list[tuple[str, bool]]:
+    """(version, has_manifest) for every version directory, newest first."""
+    versions_dir = _versions_dir(root)
+    if not os.path.isdir(versions_dir):
+        return []
+    names = sorted((name for name in os.listdir(versions_dir) if os.path.isdir(os.path.join(versions_dir, name))), reverse=True)
+    return [(name, os.path.exists(os.path.join(versions_dir, name, MANIFEST_FILENAME))) for name in names]
+
+def prepare_build_dir(root: str = VECTOR_STORE_PATH) -> tuple[str, bool]:
+    """Directory for a build to write into, and whether it resumes an unfinished build.
+
+    Reuses the newest unpublished version directory (left by a build that crashed or was stopped
+    after a checkpoint); otherwise copies the published version into a new one.
+    """
+    unfinished = [name for name, published in list_versions(root) if not published]
+    if unfinished:
+        for stale in unfinished[1:]:
+            print(f"Removing abandoned unpublished index version {stale}.")
+            shutil.rmtree(os.path.join(_versions_dir(root), stale), ignore_errors=True)
+        build_dir = os.path.join(_versions_dir(root), unfinished[0])
+        print(f"Resuming unpublished index version {unfinished[0]}.")
+        return build_dir, True
+
+    version = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    build_dir = os.path.join(_versions_dir(root), version)
+    suffix = 1
+    while os.path.exists(build_dir):
+        build_dir = os.path.join(_versions_dir(root), f"{version}-{suffix}")
+        suffix += 1
+    source_dir = current_index_path(root)
+    if os.path.isdir(source_dir):
+        start_time = time.time()
+        shutil.copytree(source_dir, build_dir, ignore=shutil.ignore_patterns(MANIFEST_FILENAME, "*.tmp"))
+        print(f"Copied index {source_dir} to {build_dir} in {time.time() - start_time:.2f} seconds.")
+    else:
+        os.makedirs(build_dir)
+    return build_dir, False
+
+def discard_build_dir(build_dir: str):
+    """Removes a build directory that ended up identical to the published version."""
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _chunk_counts(chunk_store_path: str) -> dict[str, int]:
+    """Chunks per doc_type in a chunks.sqlite file."""
+    conn = sqlite3.connect(f"file:{chunk_store_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT json_extract(chunks.metadata, '$.doc_type'), COUNT(*) FROM rows JOIN chunks ON chunks.id = rows.id GROUP BY 1"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {doc_type or "unknown": count for doc_type, count in rows}
+
+def write_manifest(build_dir: str, vectors: int, embedding_model: str, index_params: dict):
+    """Counts, embedding model, index parameters and per-file SHA-256 of a finished build directory."""
+    files = {}
+    for directory, _, file_names in sorted(os.walk(build_dir)):
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, build_dir) # e.g. partitions/news-2024.faiss
+            if name == MANIFEST_FILENAME or name.endswith(".tmp"):
+                continue
+            files[name] = {"bytes": os.path.getsize(path), "sha256": _file_sha256(path)}
+    chunk_store_path = os.path.join(build_dir, "chunks.sqlite")
+    manifest = {
+        "version": os.path.basename(build_dir),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "embedding_model": embedding_model,
+        "index_params": index_params,
+        "vectors": vectors,
+        "chunks_by_doc_type": _chunk_counts(chunk_store_path) if os.path.exists(chunk_store_path) else {},
+        "files": files,
+    }
+    manifest_path = os.path.join(build_dir, MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+def read_manifest(version_dir: str) -> dict | None:
+    manifest_path = os.path.join(version_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def verify_version(version_dir: str) -> bool:
+    """True if every file listed in the manifest is present with the recorded size and checksum."""
+    manifest = read_manifest(version_dir)
+    if manifest is None:
+        print(f"No {MANIFEST_FILENAME} in {version_dir}.")
+        return False
+    ok = True
+    for name, expected in manifest["files"].items():
+        path = os.path.join(version_dir, name)
+        if not os.path.exists(path):
+            print(f"  {name}: missing")
+            ok = False
+        elif os.path.getsize(path) != expected["bytes"] or _file_sha256(path) != expected["sha256"]:
+            print(f"  {name}: checksum mismatch")
+            ok = False
+    print(f"Version {manifest['version']}: {'OK' if ok else 'CORRUPT'}")
+    return ok
+
+def publish(build_dir: str, root: str = VECTOR_STORE_PATH, keep: int = INDEX_VERSIONS_TO_KEEP):
+    """Points `current` at `build_dir` (which must have a manifest) with an atomic rename, then prunes old versions."""
+    if read_manifest(build_dir) is None:
+        raise FileNotFoundError(f"{build_dir} has no {MANIFEST_FILENAME}; only finished builds can be published.")
+    version = os.path.basename(os.path.normpath(build_dir))
+    link = os.path.join(root, CURRENT_LINK_NAME)
+    temp_link = link + ".tmp"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(os.path.join(VERSIONS_DIRNAME, version), temp_link)
+    os.replace(temp_link, link)
+    print(f"Published index version {version}.")
+    prune_versions(root, keep)
+
+def prune_versions(root: str = VECTOR_STORE_PATH, keep: int = INDEX_VERSIONS_TO_KEEP):
+    """Deletes published versions beyond the newest `keep` (never the current one or an unfinished build).
+
+    Readers still using a deleted version keep working: their open and memory-mapped files stay valid until closed.
+    """
+    current = current_version(root)
+    published = [name for name, has_manifest in list_versions(root) if has_manifest and name != current]
+    for name in published[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(_versions_dir(root), name), ignore_errors=True)
+        print(f"Removed old index version {name}.")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Versioned FAISS index directories.")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("list", help="List index versions, newest first.")
+    publish_parser = subcommands.add_parser("publish", help="Point 'current' at an existing version.")
+    publish_parser.add_argument("version")
+    verify_parser = subcommands.add_parser("verify", help="Check a version's files against its manifest.")
+    verify_parser.add_argument("version", nargs="?")
+    args = arg_parser.parse_args()
+
+    if args.command == "list":
+        current = current_version()
+        for name, has_manifest in list_versions():
+            manifest = read_manifest(os.path.join(_versions_dir(VECTOR_STORE_PATH), name)) if has_manifest else None
+            details = f"{manifest['vectors']} vectors, {manifest['embedding_model']}" if manifest else "unfinished build"
+            print(f"{'*' if name == current else ' '} {name}  {details}")
+    elif args.command == "publish":
+        publish(os.path.join(_versions_dir(VECTOR_STORE_PATH), args.version))
+    else:
+        version = args.version or current_version()
+        if version is None:
+            sys.exit("No published index version.")
+        sys.exit(0 if verify_version(os.path.join(_versions_dir(VECTOR_STORE_PATH), version)) else 1)
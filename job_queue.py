@@ -0,0 +1,206 @@
+# job_queue.py
+"""Background job subsystem used by main_api.py.
+
+Jobs are submitted with a kind ("analysis", "scraper", "build", ...) and JSON-serializable params,
+get an id immediately, and are run by a bounded worker pool with a concurrency limit per kind.
+State lives in a small SQLite file so queued/interrupted jobs are picked up again after a restart.
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+class JobStore:
+    """SQLite-backed job records. Safe to use from several threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT,
+                    progress TEXT,
+                    return_code INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+
+    def create(self, kind: str, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params), time.time()),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def recent(self, limit: int = 50, kind: str | None = None) -> list[dict]:
+        query = "SELECT * FROM jobs"
+        args = []
+        if kind:
+            query += " WHERE kind = ?"
+            args.append(kind)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def unfinished(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"]) if job["params"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["started_at"]:
+            end = job["finished_at"] or time.time()
+            job["run_seconds"] = round(end - job["started_at"], 3)
+            job["queue_seconds"] = round(job["started_at"] - job["created_at"], 3)
+        return job
+
+class JobManager:
+    """Runs jobs from a JobStore on a bounded thread pool with per-kind concurrency limits.
+
+    `runners` maps a job kind to `runner(job_id, params, report_progress) -> (return_code, result)`;
+    `report_progress(message)` updates the job's progress text. A runner that raises marks the
+    job as failed with the exception text.
+    """
+
+    def __init__(self, store: JobStore, runners: dict, max_workers: int = 4, kind_limits: dict | None = None):
+        self.store = store
+        self.runners = runners
+        self.max_workers = max_workers
+        self.kind_limits = kind_limits or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._pending = deque()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._dispatcher = None
+
+    def start(self):
+        """Re-queues jobs left queued/running by a previous process and starts dispatching."""
+        for job in self.store.unfinished():
+            if job["status"] == "running":
+                print(f"Job {job['id']} ({job['kind']}) was interrupted by a restart. Re-queuing it.")
+                self.store.update(job["id"], status="queued", progress="re-queued after restart", started_at=None)
+            with self._cond:
+                self._pending.append((job["id"], job["kind"], job["params"]))
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        # Running jobs finish in the background; queued ones stay 'queued' in the store for the next start
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind: str, params: dict | None = None) -> str:
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind '{kind}'. Expected one of: {', '.join(self.runners)}")
+        params = params or {}
+        job_id = self.store.create(kind, params)
+        with self._cond:
+            self._pending.append((job_id, kind, params))
+            self._cond.notify_all()
+        return job_id
+
+    def _has_capacity(self, kind: str) -> bool:
+        if sum(self._running.values()) >= self.max_workers:
+            return False
+        return self._running.get(kind, 0) < self.kind_limits.get(kind, self.max_workers)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    # Oldest job whose kind still has a free slot; other kinds are not blocked behind it
+                    job = next((j for j in self._pending if self._has_capacity(j[1])), None)
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                self._pending.remove(job)
+                self._running[job[1]] = self._running.get(job[1], 0) + 1
+            self._executor.submit(self._execute, *job)
+
+    def _execute(self, job_id: str, kind: str, params: dict):
+        job = self.store.get(job_id) or {}
+        self.store.update(job_id, status="running", started_at=time.time(), progress="started",
+                          attempts=(job.get("attempts") or 0) + 1)
+        try:
+            report_progress = lambda message: self.store.update(job_id, progress=str(message)[:500])
+            return_code, result = self.runners[kind](job_id, params, report_progress)
+            status = "succeeded" if return_code == 0 else "failed"
+            self.store.update(job_id, status=status, return_code=return_code, result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            self.store.update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            with self._cond:
+                self._running[kind] -= 1
+                self._cond.notify_all()
+
+def run_script_job(command: list[str], log_path: str, report_progress, progress_interval: float = 1.0) -> tuple[int, dict]:
+    """Runs a script as a subprocess, streaming its output to `log_path`.
+
+    The latest output line is reported as progress (at most once per `progress_interval` seconds).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    last_report = 0.0
+    last_line = ""
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True, errors="replace", bufsize=1)
+        for line in process.stdout:
+            log_file.write(line)
+            if line.strip():
+                last_line = line.strip()
+                if time.monotonic() - last_report >= progress_interval:
+                    report_progress(last_line)
+                    last_report = time.monotonic()
+        return_code = process.wait()
+    if last_line:
+        report_progress(last_line)
+    return return_code, {"log_path": log_path}
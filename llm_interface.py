@@ -10,16 +10,26 @@ from langchain.chains.query_constructor.base import AttributeInfo # For SelfQuer
 from langchain.retrievers.self_query.base import SelfQueryRetriever
 from langchain_community.vectorstores.faiss import FAISS as FAISSVectorStore
 from faiss_translator import FaissTranslator
+from faiss_vector_store import MaritimeFAISS
 import json # For robust JSON parsing
+import hashlib
 import datetime # For current date
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from prompts import (
     QUERY_DECOMPOSITION,
     BROAD_QUERY_GENERATION,
     RERANK_YES_NO,
+    RERANK_BATCH,
     FINAL_ANSWER_TEMPLATE,
 )
 
-from config import GEMINI_MODEL_NAME, GEMINI_API_KEY, MONGO_URI, MONGO_DATABASE_NAME, RETRIEVER_TOP_K
+from config import (
+    GEMINI_MODEL_NAME, GEMINI_API_KEY, MONGO_URI, MONGO_DATABASE_NAME,
+    RETRIEVAL_MODE, RETRIEVAL_MAX_CONCURRENCY, RETRIEVAL_TIMEOUT_SECONDS, RETRIEVAL_SEARCH_MODE, RETRIEVAL_CUTOFF, RETRIEVAL_STAGE_CAPS,
+    RERANK_MODE, RERANK_BATCH_SIZE, RERANK_MAX_CONCURRENCY, RERANKER_BACKEND, RERANK_MAX_CHUNKS_PER_DOC,
+)
 from data_base import MongoHandler
 # Attempt to import keyword lists from processor.py
 # This is a simple way; for complex projects, consider a shared config or constants file.
@@ -100,21 +110,109 @@ def format_docs_from_chunks(docs: list[Document]) -> str:
         formatted_docs.append(f"--- {source_info} ---\n{doc.page_content}")
     return "\n\n".join(formatted_docs)
 
-def get_full_docs_and_metadata_from_mongo(retrieved_chunks: list[Document]) -> dict:
-    """Retrieves full doc text & metadata from MongoDB using mongo_id from chunks."""
+# Chunk metadata uses 'news' / 'patent' as doc_type, but the Mongo collections are 'news' / 'patents'
+DOC_TYPE_TO_COLLECTION = {"news": "news", "patent": "patents", "patents": "patents"}
+
+# Fields needed for the final context and the PDF references. Bulky patent fields
+# (citations, cited_by, similar_documents) are left out of the bulk fetch.
+FULL_DOC_PROJECTIONS = {
+    "news": {"_id": 1, "title": 1, "date": 1, "url": 1, "text": 1, "scrape_time": 1,
+             "keywords_kongsberg": 1, "keywords_maritime": 1},
+    "patents": {"_id": 1, "title": 1, "date": 1, "url": 1, "patent_code": 1, "abstract": 1, "claims": 1,
+                "description": 1, "publication_date": 1, "priority_date": 1, "status": 1, "scrape_time": 1,
+                "keywords_kongsberg": 1, "keywords_maritime": 1},
+}
+
+_mongo_handler = None
+_mongo_handler_lock = threading.Lock()
+
+def get_mongo_handler() -> MongoHandler:
+    """Returns a process-wide MongoHandler (MongoClient is thread-safe and pools its connections)."""
+    global _mongo_handler
+    with _mongo_handler_lock:
+        if _mongo_handler is None:
+            _mongo_handler = MongoHandler(MONGO_URI, MONGO_DATABASE_NAME)
+        return _mongo_handler
+
+def fetch_full_documents(chunks: list[Document], mongo_handler: MongoHandler | None = None) -> dict:
+    """Bulk-fetches the full Mongo documents behind `chunks`: one `$in` query per collection.
+
+    Returns a dict mongo_id -> document (documents that were not found are absent).
+    """
+    mongo_handler = mongo_handler or get_mongo_handler()
+    ids_by_collection = {}
+    for chunk in chunks:
+        mongo_id = chunk.metadata.get('mongo_id')
+        if not mongo_id:
+            continue
+        collection = DOC_TYPE_TO_COLLECTION.get(chunk.metadata.get('doc_type', "news"), "news")
+        ids_by_collection.setdefault(collection, set()).add(mongo_id)
+
+    full_docs = {}
+    for collection, mongo_ids in ids_by_collection.items():
+        full_docs.update(mongo_handler.get_documents_by_ids(collection, mongo_ids, FULL_DOC_PROJECTIONS.get(collection)))
+    return full_docs
+
+class FullDocPrefetcher:
+    """Fetches full Mongo documents in the background while reranking is still running.
+
+    Pass `submit` as the reranker's `on_relevant` callback; every batch of relevant chunks is
+    bulk-fetched on a small thread pool. `collect()` waits for the in-flight fetches and returns
+    the mongo_id -> document dict to hand to `get_full_docs_and_metadata_from_mongo`.
+    """
+
+    def __init__(self, mongo_handler: MongoHandler | None = None, max_workers: int = 2):
+        self.mongo_handler = mongo_handler or get_mongo_handler()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo-prefetch")
+        self._futures = []
+        self._submitted_ids = set()
+        self._lock = threading.Lock()
+
+    def submit(self, chunks: list[Document]):
+        with self._lock:
+            new_chunks = []
+            for chunk in chunks:
+                mongo_id = chunk.metadata.get('mongo_id')
+                if mongo_id and mongo_id not in self._submitted_ids:
+                    self._submitted_ids.add(mongo_id)
+                    new_chunks.append(chunk)
+            if new_chunks:
+                self._futures.append(self._executor.submit(fetch_full_documents, new_chunks, self.mongo_handler))
+
+    def collect(self) -> dict:
+        full_docs = {}
+        for future in self._futures:
+            try:
+                full_docs.update(future.result())
+            except Exception as e:
+                # Anything missing here is fetched again by get_full_docs_and_metadata_from_mongo
+                print(f"  - Warning: Background full-doc fetch failed ({e}).")
+        self._executor.shutdown(wait=False)
+        print(f"Prefetched {len(full_docs)} full documents from MongoDB during reranking.")
+        return full_docs
+
+def get_full_docs_and_metadata_from_mongo(retrieved_chunks: list[Document], prefetched_docs: dict | None = None) -> dict:
+    """Retrieves full doc text & metadata from MongoDB using mongo_id from chunks.
+
+    Documents already in `prefetched_docs` (see FullDocPrefetcher) are not fetched again; the
+    rest are bulk-fetched with one `$in` query per collection.
+    """
     if not retrieved_chunks:
         return {"context_str": "", "analyzed_metadata": []}
         
-    print(f"Received {len(retrieved_chunks)} chunks for full doc processing. Fetching from MongoDB...")
-    mongo_handler = MongoHandler(MONGO_URI, MONGO_DATABASE_NAME)
+    full_docs = dict(prefetched_docs or {})
+    missing_chunks = [c for c in retrieved_chunks if c.metadata.get('mongo_id') and c.metadata.get('mongo_id') not in full_docs]
+    print(f"Received {len(retrieved_chunks)} chunks for full doc processing. "
+          f"{len(full_docs)} documents prefetched, fetching the rest from MongoDB...")
+    if missing_chunks:
+        full_docs.update(fetch_full_documents(missing_chunks))
     unique_docs_data = {}
     added_mongo_ids = set()
 
     for chunk in retrieved_chunks:
         mongo_id = chunk.metadata.get('mongo_id')
         if not mongo_id or mongo_id in added_mongo_ids: continue
-        domain = chunk.metadata.get('doc_type', "news")
-        full_doc_data = mongo_handler.get_document_by_id(domain, mongo_id)
+        full_doc_data = full_docs.get(mongo_id)
         doc_display_data = {}
         if full_doc_data:
             content = full_doc_data.get('text', chunk.page_content)
@@ -124,6 +222,7 @@ def get_full_docs_and_metadata_from_mongo(retrieved_chunks: list[Document]) -> d
             print(f"  - Warning: Full doc not found for mongo_id: {mongo_id}. Using chunk data.")
             doc_display_data = {k: v for k, v in chunk.metadata.items()}
             doc_display_data['content'] = chunk.page_content
+        doc_display_data.setdefault('doc_type', chunk.metadata.get('doc_type'))
         doc_display_data['mongo_id'] = mongo_id # Ensure it's there
         doc_display_data['original_chunk_page_content'] = chunk.page_content
         unique_docs_data[mongo_id] = doc_display_data
@@ -147,7 +246,10 @@ def create_reranking_llm_chain(llm):
     prompt = ChatPromptTemplate.from_template(RERANK_YES_NO)
     return prompt | llm | StrOutputParser()
 
-def rerank_documents_with_llm(original_query: str, documents: list[Document], llm_for_reranking, reranking_chain):
+# All rerank functions accept an optional `on_relevant(list[Document])` callback that is called
+# as soon as some chunks are known to be relevant (used to start full-doc fetches early).
+
+def rerank_documents_with_llm(original_query: str, documents: list[Document], llm_for_reranking, reranking_chain, on_relevant=None):
     """Reranks documents based on LLM's assessment of relevance."""
     if not documents:
         return []
@@ -160,19 +262,180 @@ def rerank_documents_with_llm(original_query: str, documents: list[Document], ll
             print(f"  - Doc (Title: {doc.metadata.get('title', 'N/A')[:30]}...) assessment: {relevance_assessment}")
             if "yes" in relevance_assessment.lower():
                 reranked_documents.append(doc)
+                if on_relevant:
+                    on_relevant([doc])
         except Exception as e:
             print(f"    Error reranking doc: {doc.metadata.get('title', 'N/A')}. Error: {e}")
     print(f"Reranked down to {len(reranked_documents)} documents.")
     return reranked_documents
 
-# Helper to process a single sub-query (or broad query without self-query filters)
-def retrieve_and_rerank(query_dict: dict, vector_store, filter_gen_llm, rerank_llm, rerank_chain_instance, document_content_desc, metadata_field_info_list, is_broad_query=False):
+def rerank_documents_with_llm_concurrent(original_query: str, documents: list[Document], reranking_chain, max_concurrency: int = RERANK_MAX_CONCURRENCY,
+                                         on_relevant=None):
+    """Same YES/NO judgment per chunk as `rerank_documents_with_llm`, but sent through `.batch` with bounded concurrency."""
+    if not documents:
+        return []
+
+    print(f"Reranking {len(documents)} documents with LLM (.batch, max_concurrency={max_concurrency}) for original query: '{original_query}'...")
+    inputs = [{"query": original_query, "document_text": doc.page_content} for doc in documents]
+    keep = [False] * len(documents)
+    for i, relevance_assessment in reranking_chain.batch_as_completed(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True):
+        if isinstance(relevance_assessment, Exception):
+            print(f"    Error reranking doc: {documents[i].metadata.get('title', 'N/A')}. Error: {relevance_assessment}")
+        elif "yes" in relevance_assessment.lower():
+            keep[i] = True
+            if on_relevant:
+                on_relevant([documents[i]])
+    reranked_documents = [doc for doc, kept in zip(documents, keep) if kept]
+    print(f"Reranked down to {len(reranked_documents)} documents.")
+    return reranked_documents
+
+def create_batch_reranking_llm_chain(llm):
+    """Creates a chain that judges a whole numbered batch of chunks in a single LLM call (see RERANK_BATCH)."""
+    prompt = ChatPromptTemplate.from_template(RERANK_BATCH)
+    return prompt | llm | StrOutputParser()
+
+def parse_batch_rerank_verdicts(output: str, num_chunks: int) -> list:
+    """Parses the batched reranker output into one verdict per chunk.
+
+    Returns a list of True/False/None (None = no usable verdict for that chunk number).
+    Accepts a JSON object {"1": "YES", ...} or a JSON list of "YES"/"NO" strings (or booleans).
+    """
+    verdicts = [None] * num_chunks
+    try:
+        parsed = JsonOutputParser().parse(output)
+    except Exception as e:
+        print(f"    Warning: Could not parse batched rerank output as JSON ({e}). Output: '{output[:200]}'")
+        return verdicts
+
+    if isinstance(parsed, list):
+        parsed = {str(i + 1): v for i, v in enumerate(parsed)}
+    if not isinstance(parsed, dict):
+        return verdicts
+    for key, value in parsed.items():
+        try:
+            position = int(str(key).strip().strip("[]#")) - 1
+        except ValueError:
+            continue
+        if not 0 <= position < num_chunks:
+            continue
+        if isinstance(value, bool):
+            verdicts[position] = value
+        elif isinstance(value, str): # null or numbers are no verdict (str(None) would read as "no")
+            verdict = value.strip().lower()
+            if verdict.startswith("yes"):
+                verdicts[position] = True
+            elif verdict.startswith("no"):
+                verdicts[position] = False
+    return verdicts
+
+def rerank_documents_with_llm_batched(original_query: str, documents: list[Document], batch_reranking_chain, reranking_chain,
+                                      batch_size: int = RERANK_BATCH_SIZE, max_concurrency: int = RERANK_MAX_CONCURRENCY,
+                                      on_relevant=None):
+    """Reranks documents with one LLM call per `batch_size` chunks.
+
+    Batches are sent concurrently (bounded by `max_concurrency`). Chunks whose verdict is missing
+    from a batch response (malformed JSON, skipped numbers, failed call) are re-judged one by one
+    with the YES/NO `reranking_chain` so no chunk is silently dropped or kept.
+    """
+    if not documents:
+        return []
+
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    print(f"Reranking {len(documents)} documents with LLM in {len(batches)} batch call(s) of up to {batch_size} for original query: '{original_query}'...")
+    inputs = []
+    for batch in batches:
+        numbered_chunks = "\n\n".join(f"[{i + 1}]\n{doc.page_content}" for i, doc in enumerate(batch))
+        inputs.append({"query": original_query, "num_chunks": len(batch), "numbered_chunks": numbered_chunks})
+
+    keep = [False] * len(documents)
+    unresolved_positions = []
+    for batch_index, output in batch_reranking_chain.batch_as_completed(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True):
+        batch = batches[batch_index]
+        offset = batch_index * batch_size
+        if isinstance(output, Exception):
+            print(f"    Error reranking batch {batch_index + 1}/{len(batches)}: {output}")
+            verdicts = [None] * len(batch)
+        else:
+            verdicts = parse_batch_rerank_verdicts(output, len(batch))
+        for i, verdict in enumerate(verdicts):
+            if verdict is None:
+                unresolved_positions.append(offset + i)
+            else:
+                keep[offset + i] = verdict
+        if on_relevant:
+            relevant_in_batch = [doc for doc, verdict in zip(batch, verdicts) if verdict]
+            if relevant_in_batch:
+                on_relevant(relevant_in_batch)
+
+    if unresolved_positions:
+        unresolved_positions.sort()
+        print(f"  - {len(unresolved_positions)} chunk(s) had no verdict in the batched response. Re-judging them individually.")
+        unresolved_docs = [documents[i] for i in unresolved_positions]
+        kept_ids = {id(doc) for doc in rerank_documents_with_llm_concurrent(original_query, unresolved_docs, reranking_chain, max_concurrency, on_relevant)}
+        for i in unresolved_positions:
+            keep[i] = id(documents[i]) in kept_ids
+
+    reranked_documents = [doc for doc, kept in zip(documents, keep) if kept]
+    print(f"Reranked down to {len(reranked_documents)} documents.")
+    return reranked_documents
+
+def create_llm_reranker(reranking_llm, mode: str = RERANK_MODE, batch_size: int = RERANK_BATCH_SIZE, max_concurrency: int = RERANK_MAX_CONCURRENCY):
+    """Returns a `rerank(original_query, documents, on_relevant=None) -> list[Document]` callable for the chosen mode.
+
+    Modes: "batched" (many chunks per call), "concurrent" (one chunk per call via `.batch`),
+    "sequential" (the original one-call-at-a-time loop).
+    """
+    reranking_chain = create_reranking_llm_chain(reranking_llm)
+    if mode == "batched":
+        batch_reranking_chain = create_batch_reranking_llm_chain(reranking_llm)
+        return lambda original_query, documents, on_relevant=None: rerank_documents_with_llm_batched(
+            original_query, documents, batch_reranking_chain, reranking_chain, batch_size, max_concurrency, on_relevant
+        )
+    if mode == "concurrent":
+        return lambda original_query, documents, on_relevant=None: rerank_documents_with_llm_concurrent(
+            original_query, documents, reranking_chain, max_concurrency, on_relevant
+        )
+    if mode == "sequential":
+        return lambda original_query, documents, on_relevant=None: rerank_documents_with_llm(
+            original_query, documents, reranking_llm, reranking_chain, on_relevant
+        )
+    raise ValueError(f"Unknown rerank mode '{mode}'. Expected 'batched', 'concurrent' or 'sequential'.")
+
+def create_reranker(backend: str, reranking_llm, rerank_mode: str = RERANK_MODE, rerank_batch_size: int = RERANK_BATCH_SIZE,
+                    rerank_max_concurrency: int = RERANK_MAX_CONCURRENCY):
+    """Builds the `rerank(original_query, documents, on_relevant=None)` callable for "llm", "cross_encoder" or "hybrid"."""
+    if backend == "llm":
+        return create_llm_reranker(reranking_llm, mode=rerank_mode, batch_size=rerank_batch_size, max_concurrency=rerank_max_concurrency)
+    # Local backends need sentence-transformers; only import them when asked for
+    from reranker_utils import create_cross_encoder_reranker, create_hybrid_reranker
+    if backend == "cross_encoder":
+        return create_cross_encoder_reranker()
+    if backend == "hybrid":
+        llm_reranker = create_llm_reranker(reranking_llm, mode=rerank_mode, batch_size=rerank_batch_size, max_concurrency=rerank_max_concurrency)
+        return create_hybrid_reranker(llm_reranker)
+    raise ValueError(f"Unknown reranker backend '{backend}'. Expected 'llm', 'cross_encoder' or 'hybrid'.")
+
+# Helper to retrieve chunks for a single sub-query (or broad query without self-query filters)
+def retrieve_chunks(query_dict: dict, vector_store, filter_gen_llm, document_content_desc, metadata_field_info_list, is_broad_query=False,
+                    search_mode: str = RETRIEVAL_SEARCH_MODE, cutoff: dict | None = RETRIEVAL_CUTOFF, stage_caps: dict = RETRIEVAL_STAGE_CAPS):
+    """Retrieves chunks for one query. `search_mode` "hybrid" fuses FAISS and BM25 keyword hits when the store has a BM25 index.
+
+    At most `stage_caps["sub_query"]` (broad query: `stage_caps["broad_query"]`) chunks are retrieved, and a MaritimeFAISS
+    store shortens them further by their scores according to `cutoff` (see retrieval_cutoff.py).
+    """
     # query in query_dict is now the raw sub-query or broad_query, augmented with current_date prefix just before this call.
     augmented_query_with_date = query_dict["augmented_query_with_date"] 
     original_user_query = query_dict["original_user_query"]
     print(f"\nProcessing for retrieval: '{augmented_query_with_date}' (Broad: {is_broad_query}, from original: '{original_user_query}')")
+    top_k = stage_caps["broad_query" if is_broad_query else "sub_query"]
+    extra_search_kwargs = {}
+    if isinstance(vector_store, MaritimeFAISS) and cutoff:
+        extra_search_kwargs["cutoff"] = cutoff
+    if search_mode == "hybrid" and getattr(vector_store, "bm25", None) is not None:
+        # Keywords come from the plain query: the date preamble would match chunks on "current", "date", "user", ...
+        extra_search_kwargs.update({"hybrid": True, "keyword_query": query_dict["query"]})
     if is_broad_query:
-        retriever = vector_store.as_retriever(search_kwargs={"k": RETRIEVER_TOP_K * 2, "fetch_k": RETRIEVER_TOP_K * 2})
+        retriever = vector_store.as_retriever(search_kwargs={"k": top_k, "fetch_k": top_k, **extra_search_kwargs})
     else:
         # If we're working with a FAISS vector store, plug in our custom translator
         if isinstance(vector_store, FAISSVectorStore):
@@ -183,7 +446,7 @@ def retrieve_and_rerank(query_dict: dict, vector_store, filter_gen_llm, rerank_l
                 document_content_desc,
                 metadata_field_info_list,
                 enable_limit=False,
-                search_kwargs={"k": RETRIEVER_TOP_K, "fetch_k": RETRIEVER_TOP_K},
+                search_kwargs={"k": top_k, "fetch_k": top_k, **extra_search_kwargs},
                 structured_query_translator=translator,
                 verbose=True,
             )
@@ -194,16 +457,138 @@ def retrieve_and_rerank(query_dict: dict, vector_store, filter_gen_llm, rerank_l
                 document_content_desc,
                 metadata_field_info_list,
                 enable_limit=False,
-                search_kwargs={"k": RETRIEVER_TOP_K, "fetch_k": RETRIEVER_TOP_K},
+                search_kwargs={"k": top_k, "fetch_k": top_k, **extra_search_kwargs},
                 verbose=True,
             )
     try:
         retrieved_chunks = retriever.invoke(augmented_query_with_date)
     except Exception as e:
         print(f"  - Warning: SelfQueryRetriever failed ({e}). Falling back to plain similarity search.")
-        fallback_retriever = vector_store.as_retriever(search_kwargs={"k": RETRIEVER_TOP_K, "fetch_k": RETRIEVER_TOP_K})
+        fallback_retriever = vector_store.as_retriever(search_kwargs={"k": top_k, "fetch_k": top_k, **extra_search_kwargs})
         retrieved_chunks = fallback_retriever.invoke(augmented_query_with_date)
-    return rerank_documents_with_llm(original_user_query, retrieved_chunks, rerank_llm, rerank_chain_instance)
+    print(f"  - Retrieved {len(retrieved_chunks)} chunks for '{query_dict['query']}'.")
+    return retrieved_chunks
+
+def retrieve_and_rerank(query_dict: dict, vector_store, filter_gen_llm, reranker, document_content_desc, metadata_field_info_list, is_broad_query=False,
+                        search_mode: str = RETRIEVAL_SEARCH_MODE, cutoff: dict | None = RETRIEVAL_CUTOFF, stage_caps: dict = RETRIEVAL_STAGE_CAPS):
+    """Retrieves chunks for one query and reranks them against the original user query.
+
+    `reranker` is a `rerank(original_query, documents, on_relevant=None)` callable, see `create_reranker`; `search_mode`, `cutoff` and
+    `stage_caps` as in `retrieve_chunks`. The RAG chain
+    itself retrieves all queries first and reranks the merged candidates once (see `merge_and_deduplicate_candidates`).
+    """
+    retrieved_chunks = retrieve_chunks(query_dict, vector_store, filter_gen_llm, document_content_desc, metadata_field_info_list, is_broad_query,
+                                       search_mode, cutoff, stage_caps)
+    return reranker(query_dict["original_user_query"], retrieved_chunks)
+
+def chunk_key(doc: Document) -> str:
+    """Stable identity for a chunk: its docstore id if the store set one, else the build's content+mongo_id hash."""
+    doc_id = getattr(doc, "id", None)
+    if doc_id:
+        return str(doc_id)
+    return hashlib.sha256((doc.page_content + str(doc.metadata.get('mongo_id'))).encode('utf-8')).hexdigest()
+
+def merge_and_deduplicate_candidates(list_of_chunk_lists, max_chunks_per_doc: int = RERANK_MAX_CHUNKS_PER_DOC,
+                                     max_candidates: int | None = None):
+    """Merges retrieval results from all queries into one rerank candidate list.
+
+    Lists are interleaved by rank (every query's best hit first), duplicate chunks are dropped by
+    chunk id, and at most `max_chunks_per_doc` chunks are kept per `mongo_id` (chunks without a
+    mongo_id are always kept). With `max_candidates` only that many of the best-ranked candidates are kept.
+    Returns `(candidates, stats)`.
+    """
+    candidates = []
+    seen_chunk_keys = set()
+    chunks_per_doc = {}
+    total_retrieved = sum(len(cl) for cl in list_of_chunk_lists)
+    duplicate_chunks = 0
+    extra_doc_chunks = 0
+    longest = max((len(cl) for cl in list_of_chunk_lists), default=0)
+    for rank in range(longest):
+        for chunk_list in list_of_chunk_lists:
+            if rank >= len(chunk_list):
+                continue
+            chunk = chunk_list[rank]
+            key = chunk_key(chunk)
+            if key in seen_chunk_keys:
+                duplicate_chunks += 1
+                continue
+            seen_chunk_keys.add(key)
+            mongo_id = chunk.metadata.get('mongo_id')
+            if mongo_id:
+                if chunks_per_doc.get(mongo_id, 0) >= max_chunks_per_doc:
+                    extra_doc_chunks += 1
+                    continue
+                chunks_per_doc[mongo_id] = chunks_per_doc.get(mongo_id, 0) + 1
+            candidates.append(chunk)
+
+    over_cap = 0
+    if max_candidates is not None and len(candidates) > max_candidates:
+        over_cap = len(candidates) - max_candidates
+        candidates = candidates[:max_candidates]
+    stats = {
+        "retrieved_chunks": total_retrieved,
+        "duplicate_chunks": duplicate_chunks,
+        "extra_chunks_of_same_doc": extra_doc_chunks,
+        "candidates_over_cap": over_cap,
+        "rerank_candidates": len(candidates),
+        "rerank_judgments_saved": total_retrieved - len(candidates),
+    }
+    print(f"Merged {total_retrieved} retrieved chunks into {len(candidates)} rerank candidates "
+          f"({duplicate_chunks} duplicate chunks, {extra_doc_chunks} extra chunks of already-covered documents, "
+          f"{over_cap} over the rerank cap). "
+          f"Saved {stats['rerank_judgments_saved']} rerank judgments.")
+    return candidates, stats
+
+def run_retrieval_tasks(tasks, mode=RETRIEVAL_MODE, max_concurrency=RETRIEVAL_MAX_CONCURRENCY, timeout_seconds=RETRIEVAL_TIMEOUT_SECONDS):
+    """Runs (label, callable) retrieval tasks and returns their results in input order.
+
+    In "concurrent" mode the callables share a bounded thread pool and each one gets
+    `timeout_seconds` counted from the moment it starts running. A task that times out
+    or raises contributes an empty list instead of failing the whole report.
+    """
+    if mode != "concurrent" or len(tasks) <= 1:
+        results = []
+        for label, task_fn in tasks:
+            try:
+                results.append(task_fn())
+            except Exception as e:
+                print(f"  - Warning: Retrieval for '{label}' failed ({e}). Continuing without it.")
+                results.append([])
+        return results
+
+    started_at = {}
+
+    def _run(i, task_fn):
+        started_at[i] = time.monotonic()
+        return task_fn()
+
+    results = [[] for _ in tasks]
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(tasks))), thread_name_prefix="retrieval")
+    futures = {executor.submit(_run, i, task_fn): i for i, (_, task_fn) in enumerate(tasks)}
+    pending = set(futures)
+    print(f"Running {len(tasks)} retrievals concurrently (max_concurrency={max_concurrency}, timeout={timeout_seconds}s each)...")
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f"  - Warning: Retrieval for '{tasks[i][0]}' failed ({e}). Continuing without it.")
+            if not timeout_seconds:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                i = futures[future]
+                if i in started_at and now - started_at[i] > timeout_seconds:
+                    # The worker thread cannot be killed; we just stop waiting for it.
+                    print(f"  - Warning: Retrieval for '{tasks[i][0]}' exceeded {timeout_seconds}s. Continuing without it.")
+                    pending.discard(future)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
 
 def parse_main_llm_output(response_message: AIMessage):
     """Parses the AIMessage from main_llm, separating thoughts and final answer."""
@@ -236,8 +621,23 @@ def parse_main_llm_output(response_message: AIMessage):
     print(f"Final Answer Preview: {final_answer[:100]}...")
     return {"final_answer": final_answer, "reasoning_trail": reasoning_trail}
 
-def create_rag_chain(vector_store, main_llm_for_answer, reranking_llm, decomposition_llm, filter_generation_llm, broad_query_llm):
-    """RAG chain: Date-Aware Decomp & BroadQuery -> ParallelRetrievals -> Rerank -> Aggregate -> FullDoc -> NativeThoughts+Answer."""
+def create_rag_chain(vector_store, main_llm_for_answer, reranking_llm, decomposition_llm, filter_generation_llm, broad_query_llm,
+                     retrieval_mode: str = RETRIEVAL_MODE, max_concurrency: int = RETRIEVAL_MAX_CONCURRENCY,
+                     retrieval_timeout_seconds: float = RETRIEVAL_TIMEOUT_SECONDS,
+                     rerank_mode: str = RERANK_MODE, rerank_batch_size: int = RERANK_BATCH_SIZE,
+                     rerank_max_concurrency: int = RERANK_MAX_CONCURRENCY, reranker_backend: str = RERANKER_BACKEND,
+                     max_chunks_per_doc: int = RERANK_MAX_CHUNKS_PER_DOC, search_mode: str = RETRIEVAL_SEARCH_MODE,
+                     cutoff: dict | None = RETRIEVAL_CUTOFF, stage_caps: dict = RETRIEVAL_STAGE_CAPS):
+    """RAG chain: Date-Aware Decomp & BroadQuery -> ParallelRetrievals -> Merge -> Rerank -> Aggregate -> FullDoc -> NativeThoughts+Answer.
+
+    `retrieval_mode` is "concurrent" (bounded thread pool, see `run_retrieval_tasks`) or "sequential".
+    `rerank_mode` is "batched", "concurrent" or "sequential" (see `create_llm_reranker`).
+    `reranker_backend` is "llm", "cross_encoder" or "hybrid" (see `create_reranker`).
+    `max_chunks_per_doc` caps how many chunks of the same document are sent to the reranker.
+    `search_mode` is "hybrid" (FAISS + BM25, fused by reciprocal rank) or "dense" (see `retrieve_chunks`).
+    `cutoff` adaptively shortens each query's hits and `stage_caps` bounds every stage (see `retrieve_chunks`); `stage_caps["rerank"]`
+    caps the merged candidates sent to the reranker.
+    """
     
     document_content_description = "News and patent documents related to maritime industry, technology, Nordics."
     max_kw_in_desc = 50
@@ -254,53 +654,52 @@ def create_rag_chain(vector_store, main_llm_for_answer, reranking_llm, decomposi
 
     query_decomposition_chain = create_query_decomposition_chain(decomposition_llm)
     broad_query_generation_chain = create_broad_query_generation_chain(broad_query_llm)
-    reranking_chain_instance = create_reranking_llm_chain(reranking_llm)
+    reranker = create_reranker(reranker_backend, reranking_llm, rerank_mode=rerank_mode,
+                               rerank_batch_size=rerank_batch_size, rerank_max_concurrency=rerank_max_concurrency)
 
     final_answer_prompt = ChatPromptTemplate.from_template(FINAL_ANSWER_TEMPLATE)
 
-    def aggregate_and_deduplicate_chunks(list_of_chunk_lists):
-        all_chunks = []
-        seen_mongo_ids = set()
-        for chunk_list in list_of_chunk_lists:
-            for chunk in chunk_list:
-                mongo_id = chunk.metadata.get('mongo_id')
-                if mongo_id and mongo_id not in seen_mongo_ids:
-                    all_chunks.append(chunk)
-                    seen_mongo_ids.add(mongo_id)
-                elif not mongo_id: 
-                    all_chunks.append(chunk)
-        print(f"Aggregated and de-duplicated to {len(all_chunks)} chunks from {sum(len(cl) for cl in list_of_chunk_lists)} initial chunks.")
-        return all_chunks
-
     def parallel_retrieval_step(input_dict):
         sub_queries_list = input_dict["sub_queries_list"]
         broad_query_str = input_dict["broad_query_str"]
         original_user_query = input_dict["original_user_query"]
         current_date_str = input_dict["current_date"] # This is the string like "2024-07-15"
         
-        processed_chunk_lists = []
-        # Augment sub-queries with current date before sending to retrieve_and_rerank
-        for sq_str in sub_queries_list: 
-            augmented_sq = f"Current date: {current_date_str}. User query: {sq_str}"
-            chunks = retrieve_and_rerank(
-                {"query": sq_str, "augmented_query_with_date": augmented_sq, "original_user_query": original_user_query},
-                vector_store, filter_generation_llm, reranking_llm, reranking_chain_instance,
-                document_content_description, metadata_field_info, is_broad_query=False
+        # Augment sub-queries and the broad query with current date before sending to retrieve_chunks.
+        # Each task is a closure so the sub-queries can run on the retrieval thread pool.
+        # Reranking happens once, after all results are merged (see merge_and_rerank_step).
+        def make_task(query_str, is_broad_query):
+            augmented_query = f"Current date: {current_date_str}. User query: {query_str}"
+            return lambda: retrieve_chunks(
+                {"query": query_str, "augmented_query_with_date": augmented_query, "original_user_query": original_user_query},
+                vector_store, filter_generation_llm,
+                document_content_description, metadata_field_info, is_broad_query=is_broad_query, search_mode=search_mode,
+                cutoff=cutoff, stage_caps=stage_caps
             )
-            processed_chunk_lists.append(chunks)
-        
-        # Augment broad query with current date
-        augmented_bq = f"Current date: {current_date_str}. User query: {broad_query_str}"
-        broad_query_chunks = retrieve_and_rerank(
-            {"query": broad_query_str, "augmented_query_with_date": augmented_bq, "original_user_query": original_user_query},
-            vector_store, filter_generation_llm, reranking_llm, reranking_chain_instance,
-            document_content_description, metadata_field_info, is_broad_query=True
+
+        tasks = [(sq_str, make_task(sq_str, False)) for sq_str in sub_queries_list]
+        tasks.append((broad_query_str, make_task(broad_query_str, True)))
+        # Results come back in task order (sub-queries first, broad query last) regardless of completion order
+        processed_chunk_lists = run_retrieval_tasks(
+            tasks, mode=retrieval_mode, max_concurrency=max_concurrency, timeout_seconds=retrieval_timeout_seconds
         )
-        processed_chunk_lists.append(broad_query_chunks)
         return {"all_retrieved_chunk_lists": processed_chunk_lists, 
                 "original_user_query": original_user_query, 
                 "current_date": current_date_str}
 
+    def merge_and_rerank_step(input_dict):
+        candidates, rerank_stats = merge_and_deduplicate_candidates(input_dict["all_retrieved_chunk_lists"], max_chunks_per_doc,
+                                                                     stage_caps.get("rerank"))
+        # Full documents of relevant chunks are fetched from Mongo while the remaining batches are still being reranked
+        prefetcher = FullDocPrefetcher()
+        reranked_chunks = reranker(input_dict["original_user_query"], candidates, on_relevant=prefetcher.submit)
+        # Candidates were already de-duplicated and capped per document before reranking
+        return {"relevant_chunks": reranked_chunks,
+                "prefetched_docs": prefetcher.collect(),
+                "rerank_stats": rerank_stats,
+                "original_user_query": input_dict["original_user_query"],
+                "current_date": input_dict["current_date"]}
+
     rag_chain = (
         # Step 1: Generate sub-queries and broad query. current_date is passed through.
         RunnableParallel({
@@ -310,18 +709,16 @@ def create_rag_chain(vector_store, main_llm_for_answer, reranking_llm, decomposi
             "current_date": itemgetter("current_date") 
         }).with_config(run_name="GenerateSubAndBroadQueries")
         
-        # Step 2: Augment queries with date and perform parallel retrieval and reranking
-        | RunnableLambda(parallel_retrieval_step).with_config(run_name="AugmentAndParallelRetrieveRerank")
+        # Step 2: Augment queries with date and perform parallel retrieval
+        | RunnableLambda(parallel_retrieval_step).with_config(run_name="AugmentAndParallelRetrieve")
         
-        # Step 3: Aggregate and de-duplicate all chunks
-        | RunnableLambda(lambda x: {"aggregated_chunks": aggregate_and_deduplicate_chunks(x["all_retrieved_chunk_lists"]), 
-                                   "original_user_query": x["original_user_query"],
-                                   "current_date": x["current_date"]})
-           .with_config(run_name="AggregateAllChunks")
+        # Step 3: Merge and de-duplicate all chunks (capped per document), rerank each unique candidate once
+        | RunnableLambda(merge_and_rerank_step).with_config(run_name="MergeRerank")
            
         # Step 4: Fetch full documents for the final set of relevant chunks
         | RunnableParallel({
-            "result_from_fetch": lambda x: get_full_docs_and_metadata_from_mongo(x["aggregated_chunks"]),
+            "result_from_fetch": lambda x: get_full_docs_and_metadata_from_mongo(x["relevant_chunks"], x["prefetched_docs"]),
+            "rerank_stats": itemgetter("rerank_stats"),
             "original_user_query": itemgetter("original_user_query"),
             "current_date": itemgetter("current_date")
         }).with_config(run_name="FetchFullDocsForAggregated")
@@ -331,21 +728,24 @@ def create_rag_chain(vector_store, main_llm_for_answer, reranking_llm, decomposi
             "prompt_input_for_final_answer": lambda x: {"context": x["result_from_fetch"]["context_str"], 
                                                       "question": x["original_user_query"],
                                                       "current_date": x["current_date"]},
-            "analyzed_metadata_for_pdf": lambda x: x["result_from_fetch"]["analyzed_metadata"]
+            "analyzed_metadata_for_pdf": lambda x: x["result_from_fetch"]["analyzed_metadata"],
+            "rerank_stats": itemgetter("rerank_stats")
         })
         
         # Step 6: Generate final answer (main_llm_for_answer has include_thoughts=True)
         | RunnableParallel({
             "llm_response_with_potential_thoughts": itemgetter("prompt_input_for_final_answer") | final_answer_prompt | main_llm_for_answer,
-            "analyzed_metadata": itemgetter("analyzed_metadata_for_pdf")
+            "analyzed_metadata": itemgetter("analyzed_metadata_for_pdf"),
+            "rerank_stats": itemgetter("rerank_stats")
         })
         
         # Step 7: Parse the LLM response to separate final answer and thoughts
         | RunnableLambda(lambda x: {
             **parse_main_llm_output(x["llm_response_with_potential_thoughts"]),
-            "analyzed_metadata": x["analyzed_metadata"]
+            "analyzed_metadata": x["analyzed_metadata"],
+            "rerank_stats": x["rerank_stats"]
           }).with_config(run_name="ParseLLMOutputAndThoughts")
     )
 
-    print("RAG chain (DateAwareDecomp+BroadQuery->ParallelRetrieve->Rerank->Aggregate->NativeThoughts) created.")
+    print("RAG chain (DateAwareDecomp+BroadQuery->ParallelRetrieve->Merge->Rerank->Aggregate->NativeThoughts) created.")
     return rag_chain 
\ No newline at end of file
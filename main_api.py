@@ -1,30 +1,166 @@
-from fastapi import FastAPI, Request, UploadFile, Form
-from fastapi.responses import JSONResponse, FileResponse
-from subprocess import run
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, UploadFile, Form, HTTPException
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pymongo import MongoClient
 import os
+import sys
+import hashlib
 
-app = FastAPI()
+from config import (
+    JOB_STORE_PATH, JOB_LOG_DIR, JOB_MAX_WORKERS, JOB_KIND_CONCURRENCY, PDF_OUTPUT_FILENAME,
+    REPORT_STORE_PATH, REPORT_STORE_MAX_BYTES, REPORT_STORE_TTL_SECONDS,
+)
+from analysis_service import AnalysisService
+from job_queue import JobStore, JobManager, run_script_job
+from report_store import ReportStore, report_etag, etag_matches
+from main import run_analysis_pipeline
+
+# One pipeline per API process: embedding model, FAISS index and RAG chain are loaded at startup
+analysis_service = AnalysisService()
+report_store = ReportStore(REPORT_STORE_PATH, REPORT_STORE_MAX_BYTES, REPORT_STORE_TTL_SECONDS)
+
+# Fields of the analyzed documents kept in the report metadata (full texts are left out)
+REPORT_DOC_FIELDS = ("mongo_id", "title", "url", "date", "doc_type", "patent_code")
+
+def build_report_metadata(query: str, result: dict) -> dict:
+    """Query, chunk set and answer metadata saved next to the PDF."""
+    documents = []
+    for doc in result["analyzed_metadata"]:
+        entry = {field: doc.get(field) for field in REPORT_DOC_FIELDS if doc.get(field) is not None}
+        chunk_text = doc.get("original_chunk_page_content")
+        if chunk_text:
+            entry["chunk_sha256"] = hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
+        documents.append(entry)
+    return {
+        "query": query,
+        "current_date": result["current_date"],
+        "generation_date": result["generation_date"],
+        "final_answer": result["final_answer"],
+        "rerank_stats": result["rerank_stats"],
+        "documents": documents,
+    }
+
+def run_analysis_job(job_id, params, report_progress):
+    report_progress("running analysis pipeline")
+    # Each run writes its own PDF; concurrent analyses never share a file
+    pdf_path = report_store.new_temp_path()
+    result = run_analysis_pipeline(params["query"], service=analysis_service, pdf_filename=pdf_path)
+    if result is None:
+        return 1, None
+    report_id = report_store.save(pdf_path, build_report_metadata(params["query"], result))
+    return 0, {"report_id": report_id, "pdf": f"/get-report/{report_id}", "rerank_stats": result["rerank_stats"]}
+
+def script_job_runner(script):
+    # Scraper and index builds keep running as separate processes; their output goes to a per-job log
+    def run_script(job_id, params, report_progress):
+        return run_script_job([sys.executable, "-u", script], os.path.join(JOB_LOG_DIR, f"{job_id}.log"), report_progress)
+    return run_script
+
+job_manager = JobManager(
+    JobStore(JOB_STORE_PATH),
+    runners={
+        "analysis": run_analysis_job,
+        "scraper": script_job_runner("run_scrape.py"),
+        "build": script_job_runner("build_vector_store.py"),
+    },
+    max_workers=JOB_MAX_WORKERS,
+    kind_limits=JOB_KIND_CONCURRENCY,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        analysis_service.load()
+        analysis_service.warm_up()
+    except Exception as e:
+        # Keep the API up (scraper / build endpoints still work); analysis jobs retry the load
+        print(f"Analysis service not ready at startup: {e}")
+    # Index versions published by builds are swapped in without a restart
+    analysis_service.start_index_watcher()
+    job_manager.start()
+    yield
+    job_manager.stop()
+    analysis_service.stop_index_watcher()
+
+app = FastAPI(lifespan=lifespan)
+
+def job_accepted(job_id: str):
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    })
 
 @app.get("/")
 def home():
-    return {"message": "API is running"}
+    return {"message": "API is running", "analysis_ready": analysis_service.is_loaded}
 
 @app.post("/run-scraper")
 def run_scraper():
-    result = run(["python", "run_scrape.py"])
-    return {"status": "completed", "return_code": result.returncode}
+    return job_accepted(job_manager.submit("scraper"))
 
 @app.post("/build-vector-store")
 def build_vector_store():
-    result = run(["python", "build_vector_store.py"])
-    return {"status": "vector store built", "return_code": result.returncode}
+    return job_accepted(job_manager.submit("build"))
 
 @app.post("/run-analysis")
 def run_analysis(query: str = Form(...)):
-    result = run(["python", "main.py", query])
-    return {"status": "analysis complete", "pdf": "/get-report"}
+    return job_accepted(job_manager.submit("analysis", {"query": query}))
+
+@app.get("/jobs")
+def list_jobs(kind: str | None = None, limit: int = 50):
+    return {"jobs": job_manager.store.recent(limit=limit, kind=kind)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("queued", "running"):
+        return JSONResponse(status_code=202, content={"status": job["status"], "progress": job["progress"]})
+    return {"status": job["status"], "return_code": job["return_code"], "result": job["result"], "error": job["error"]}
+
+# Report ids are content hashes: a report URL never changes content, while "latest" must be revalidated
+REPORT_CACHE_CONTROL = "private, max-age=86400, immutable"
+LATEST_REPORT_CACHE_CONTROL = "no-cache"
+
+def report_response(report_id: str, request: Request, cache_control: str):
+    stored = report_store.get(report_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Report not found or expired")
+    pdf_path, _ = stored
+    etag = report_etag(report_id)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(pdf_path, filename="maritime_analysis.pdf", media_type='application/pdf', headers=headers)
 
 @app.get("/get-report")
-def get_report():
-    return FileResponse("analysis_report_langchain.pdf", filename="maritime_analysis.pdf", media_type='application/pdf')
+def get_report(request: Request):
+    # Latest report; kept for clients that do not track report ids yet
+    report_id = report_store.latest()
+    if report_id is None:
+        if os.path.exists(PDF_OUTPUT_FILENAME):
+            return FileResponse(PDF_OUTPUT_FILENAME, filename="maritime_analysis.pdf", media_type='application/pdf',
+                                headers={"Cache-Control": LATEST_REPORT_CACHE_CONTROL})
+        raise HTTPException(status_code=404, detail="No report available")
+    return report_response(report_id, request, LATEST_REPORT_CACHE_CONTROL)
+
+@app.get("/get-report/{report_id}")
+def get_report_by_id(report_id: str, request: Request):
+    return report_response(report_id, request, REPORT_CACHE_CONTROL)
+
+@app.get("/get-report/{report_id}/metadata")
+def get_report_metadata(report_id: str):
+    stored = report_store.get(report_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Report not found or expired")
+    return stored[1]
@@ -0,0 +1,263 @@
+# metadata_columns.py
+"""Typed, columnar copy of the chunk metadata, used to filter FAISS searches.
+
+Self-query filters (FaissTranslator output) used to be checked in Python on the `fetch_k` nearest chunks, so a
+restrictive filter (`doc_type == 'patent' AND date >= ...`) often left few or no hits. The build now writes
+`metadata_columns.npz` next to the index, with one entry per FAISS label:
+  - dates as int64 epoch seconds (MISSING_DATE when absent or unparsable)
+  - categorical fields (doc_type, patent_code, title) as int32 codes into a table of distinct values
+  - keyword lists as one packed bitmap per keyword (its postings)
+`MetadataColumns.mask(filter)` compiles a filter into a boolean NumPy mask over labels, which the store passes
+to FAISS as an IDSelectorBitmap so only matching vectors are searched. Filters on fields or values the columns
+cannot evaluate compile to None, and the store falls back to the Python filter.
+"""
+import ast
+import datetime
+import json
+import os
+import sqlite3
+import time
+from operator import eq, ge, gt, le, lt, ne
+import numpy as np
+from dateutil import parser as date_parser
+
+from chunk_store import CHUNK_STORE_FILENAME
+
+METADATA_COLUMNS_FILENAME = "metadata_columns.npz"
+DATE_FIELDS = ("date",)
+CATEGORICAL_FIELDS = ("doc_type", "patent_code", "title")
+KEYWORD_FIELDS = ("keywords_kongsberg", "keywords_maritime")
+MISSING_DATE = np.iinfo(np.int64).min
+
+COMPARISONS = {"$eq": eq, "$neq": ne, "$gt": gt, "$gte": ge, "$lt": lt, "$lte": le}
+
+def to_epoch(value) -> int | None:
+    """Epoch seconds (UTC for naive values) of a date, datetime or date string; None if it is not a date."""
+    if isinstance(value, str) and value.strip().startswith("{"):
+        # The query constructor sometimes emits {"date": "...", "type": "date"}, which FaissTranslator stringifies
+        try:
+            value = ast.literal_eval(value.strip()).get("date")
+        except (ValueError, SyntaxError, AttributeError):
+            return None
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        try:
+            value = datetime.datetime.fromisoformat(value.strip())
+        except ValueError:
+            try:
+                value = date_parser.parse(value)
+            except (ValueError, OverflowError):
+                return None
+    if not isinstance(value, datetime.datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+def keyword_list(value) -> list[str]:
+    """Keywords of a metadata value: a list, or a list stored as its string (stores built before lists were kept)."""
+    if isinstance(value, str):
+        if not value.startswith("["):
+            return [value] if value else []
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return []
+    if not isinstance(value, (list, tuple)):
+        return []
+    return [str(keyword).lower() for keyword in value if keyword not in (None, "")]
+
+def _category_value(value) -> str | None:
+    return None if value in (None, "") else str(value)
+
+class _NotCompilable(Exception):
+    """A filter part the columns cannot evaluate."""
+
+class MetadataColumns:
+    def __init__(self, num_rows: int, dates: dict, categories: dict, keywords: dict):
+        """`dates[field]` int64 array; `categories[field]` (codes, values); `keywords[field]` (values, packed bitmaps)."""
+        self.num_rows = num_rows
+        self.dates = dates
+        self.categories = categories
+        self.keywords = keywords
+
+    @classmethod
+    def build(cls, rows, num_rows: int):
+        """Columns for `(label, metadata)` pairs; labels without metadata match no filter."""
+        dates = {field: np.full(num_rows, MISSING_DATE, dtype=np.int64) for field in DATE_FIELDS}
+        codes = {field: np.full(num_rows, -1, dtype=np.int32) for field in CATEGORICAL_FIELDS}
+        category_codes = {field: {} for field in CATEGORICAL_FIELDS}
+        postings = {field: {} for field in KEYWORD_FIELDS}
+        for label, metadata in rows:
+            for field in DATE_FIELDS:
+                epoch = to_epoch(metadata.get(field))
+                if epoch is not None:
+                    dates[field][label] = epoch
+            for field in CATEGORICAL_FIELDS:
+                value = _category_value(metadata.get(field))
+                if value is not None:
+                    codes[field][label] = category_codes[field].setdefault(value, len(category_codes[field]))
+            for field in KEYWORD_FIELDS:
+                for keyword in keyword_list(metadata.get(field)):
+                    postings[field].setdefault(keyword, []).append(label)
+
+        categories = {field: (codes[field], list(category_codes[field])) for field in CATEGORICAL_FIELDS}
+        keywords = {}
+        for field, labels_by_keyword in postings.items():
+            values = sorted(labels_by_keyword)
+            bitmaps = np.zeros((len(values), (num_rows + 7) // 8), dtype=np.uint8)
+            for position, keyword in enumerate(values):
+                bits = np.zeros(num_rows, dtype=bool)
+                bits[labels_by_keyword[keyword]] = True
+                bitmaps[position] = np.packbits(bits, bitorder="little")
+            keywords[field] = (values, bitmaps)
+        return cls(num_rows, dates, categories, keywords)
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store_path: str, num_rows: int):
+        """Columns for every labelled chunk in a chunks.sqlite file (opened read-only)."""
+        conn = sqlite3.connect(f"file:{chunk_store_path}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute("SELECT rows.row, chunks.metadata FROM rows JOIN chunks ON chunks.id = rows.id")
+            return cls.build(((row, json.loads(metadata)) for row, metadata in cursor if row < num_rows), num_rows)
+        finally:
+            conn.close()
+
+    def save(self, index_path: str):
+        arrays = {"num_rows": np.array(self.num_rows, dtype=np.int64)}
+        for field, values in self.dates.items():
+            arrays[f"date:{field}"] = values
+        for field, (codes, values) in self.categories.items():
+            arrays[f"codes:{field}"] = codes
+            arrays[f"categories:{field}"] = np.array(values, dtype=np.str_)
+        for field, (values, bitmaps) in self.keywords.items():
+            arrays[f"keywords:{field}"] = np.array(values, dtype=np.str_)
+            arrays[f"bitmaps:{field}"] = bitmaps
+        path = os.path.join(index_path, METADATA_COLUMNS_FILENAME)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_path: str):
+        """Columns saved next to an index, or None if the index was built without them."""
+        path = os.path.join(index_path, METADATA_COLUMNS_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            dates, categories, keywords = {}, {}, {}
+            for key in arrays.files:
+                kind, _, field = key.partition(":")
+                if kind == "date":
+                    dates[field] = arrays[key]
+                elif kind == "codes":
+                    categories[field] = (arrays[key], arrays[f"categories:{field}"].tolist())
+                elif kind == "keywords":
+                    keywords[field] = (arrays[key].tolist(), arrays[f"bitmaps:{field}"])
+            return cls(int(arrays["num_rows"]), dates, categories, keywords)
+
+    def mask(self, filter: dict) -> np.ndarray | None:
+        """Boolean mask over labels of the chunks matching a FaissTranslator filter, or None if it cannot be compiled."""
+        try:
+            return self._compile(filter)
+        except _NotCompilable:
+            return None
+
+    def _compile(self, filter: dict) -> np.ndarray:
+        if not isinstance(filter, dict):
+            raise _NotCompilable
+        mask = np.ones(self.num_rows, dtype=bool)
+        for key, value in filter.items():
+            if key == "$and":
+                for part in value:
+                    mask &= self._compile(part)
+            elif key == "$or":
+                either = np.zeros(self.num_rows, dtype=bool)
+                for part in value:
+                    either |= self._compile(part)
+                mask &= either
+            elif key == "$not":
+                parts = value if isinstance(value, list) else [value]
+                for part in parts:
+                    mask &= ~self._compile(part)
+            elif key.startswith("$"):
+                raise _NotCompilable
+            elif isinstance(value, dict):
+                for op, operand in value.items():
+                    mask &= self._condition(key, op, operand)
+            elif isinstance(value, list):
+                mask &= self._condition(key, "$in", value)
+            else:
+                mask &= self._condition(key, "$eq", value)
+        return mask
+
+    def _condition(self, field: str, op: str, operand) -> np.ndarray:
+        if field in self.dates:
+            return self._date_condition(self.dates[field], op, operand)
+        if field in self.categories:
+            return self._category_condition(*self.categories[field], op, operand)
+        if field in self.keywords:
+            return self._keyword_condition(*self.keywords[field], op, operand)
+        raise _NotCompilable
+
+    def _date_condition(self, epochs: np.ndarray, op: str, operand) -> np.ndarray:
+        present = epochs != MISSING_DATE
+        if op in ("$in", "$nin"):
+            if not isinstance(operand, list):
+                raise _NotCompilable
+            wanted = [to_epoch(value) for value in operand]
+            if None in wanted:
+                raise _NotCompilable
+            found = present & np.isin(epochs, wanted)
+            return found if op == "$in" else ~found
+        if op not in COMPARISONS:
+            raise _NotCompilable
+        epoch = to_epoch(operand)
+        if epoch is None:
+            raise _NotCompilable
+        result = COMPARISONS[op](epochs, epoch)
+        return result if op == "$neq" else result & present
+
+    def _category_condition(self, codes: np.ndarray, values: list, op: str, operand) -> np.ndarray:
+        # Evaluate the comparison once per distinct value, then look the answer up by code (the last entry is "missing")
+        if op in ("$in", "$nin"):
+            if not isinstance(operand, list):
+                raise _NotCompilable
+            wanted = {str(value) for value in operand}
+            matches = [value in wanted for value in values] + [False]
+            if op == "$nin":
+                matches = [not match for match in matches]
+        elif op in COMPARISONS:
+            compare = COMPARISONS[op]
+            operand = str(operand)
+            matches = [compare(value, operand) for value in values] + [op == "$neq"]
+        else:
+            raise _NotCompilable
+        return np.array(matches, dtype=bool)[codes]
+
+    def _keyword_condition(self, values: list, bitmaps: np.ndarray, op: str, operand) -> np.ndarray:
+        # A keyword list "equals" a keyword when it contains it, as the query constructor intends for list fields
+        if op in ("$eq", "$neq"):
+            wanted = [operand]
+        elif op in ("$in", "$nin") and isinstance(operand, list):
+            wanted = operand
+        else:
+            raise _NotCompilable
+        positions = {keyword: position for position, keyword in enumerate(values)}
+        found = np.zeros(self.num_rows, dtype=bool)
+        for keyword in wanted:
+            position = positions.get(str(keyword).lower())
+            if position is not None:
+                found |= np.unpackbits(bitmaps[position], count=self.num_rows, bitorder="little").astype(bool)
+        return found if op in ("$eq", "$in") else ~found
+
+def write_metadata_columns(index_path: str, num_rows: int):
+    """Rebuilds metadata_columns.npz for the index at `index_path` from its chunks.sqlite."""
+    start_time = time.time()
+    columns = MetadataColumns.from_chunk_store(os.path.join(index_path, CHUNK_STORE_FILENAME), num_rows)
+    columns.save(index_path)
+    print(f"Wrote metadata columns for {num_rows} labels to {index_path} in {time.time() - start_time:.2f} seconds.")
+    return columns
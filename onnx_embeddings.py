@@ -0,0 +1,146 @@
+# onnx_embeddings.py
+"""ONNX Runtime embedding backend (EMBEDDING_BACKEND = "onnx" in config.py).
+
+Runs the sentence-transformer exported to ONNX (optionally dynamically quantized to int8) on CPU,
+with the same mean pooling + L2 normalization as `HuggingFaceEmbeddings(normalize_embeddings=True)`,
+so vectors stay compatible with an index built by the PyTorch backend. Neither loading nor running
+it imports torch.
+
+    python onnx_embeddings.py export    # needs torch + transformers, writes model.onnx / model.int8.onnx
+    python onnx_embeddings.py check     # compares against the PyTorch backend, exits 1 outside tolerance
+"""
+import argparse
+import os
+import sys
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR, ONNX_USE_INT8, EMBEDDING_MAX_SEQ_LENGTH
+
+ONNX_MODEL_FILENAME = "model.onnx"
+ONNX_INT8_MODEL_FILENAME = "model.int8.onnx"
+# Minimum cosine similarity to the PyTorch embedding of the same text
+PARITY_MIN_COSINE = {"fp32": 0.9999, "int8": 0.98}
+PARITY_SAMPLE_TEXTS = [
+    "Autonomous surface vessels are being tested for mine countermeasure missions in the Baltic Sea.",
+    "The shipyard delivered the first LNG-powered icebreaker to the Finnish Transport Infrastructure Agency.",
+    "A hull cleaning robot comprising magnetic tracks and a rotating brush assembly.",
+    "ECDIS",
+    "Patent US 2021/0123456 A1 describes a ballast water treatment system using UV reactors and filtration.",
+    "Naval procurement budgets increased by 12 percent, with frigate programmes receiving most of the funding. " * 20,
+]
+
+def onnx_model_path(model_dir: str = ONNX_MODEL_DIR, use_int8: bool = ONNX_USE_INT8) -> str:
+    return os.path.join(model_dir, ONNX_INT8_MODEL_FILENAME if use_int8 else ONNX_MODEL_FILENAME)
+
+def export_onnx_model(model_name: str = EMBEDDING_MODEL_NAME, model_dir: str = ONNX_MODEL_DIR, quantize: bool = True):
+    """Exports the Hugging Face transformer behind `model_name` to ONNX, plus an int8 dynamically quantized copy."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name).eval()
+    tokenizer.save_pretrained(model_dir) # tokenizer.json, read by the `tokenizers` library at run time
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    fp32_path = os.path.join(model_dir, ONNX_MODEL_FILENAME)
+    print(f"Exporting {hub_name} to {fp32_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in [*input_names, "last_hidden_state"]},
+            opset_version=14,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(model_dir, ONNX_INT8_MODEL_FILENAME)
+        print(f"Quantizing to {int8_path}...")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print("ONNX export finished.")
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, use_int8: bool = ONNX_USE_INT8,
+                 max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH, batch_size: int = 32, num_threads: int | None = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_path = onnx_model_path(model_dir, use_int8)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found. Run 'python onnx_embeddings.py export' first.")
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        pad_token = "[PAD]"
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        print(f"Loaded ONNX embedding model {model_path}")
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        # Mean pooling over real tokens, then L2 normalization (as sentence-transformers does for this model)
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        # Batch texts of similar length together to keep padding small, then restore input order
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            batch_vectors = self._embed_batch([texts[i] for i in positions])
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+            vectors[positions] = batch_vectors
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+def check_parity(use_int8: bool = ONNX_USE_INT8, texts: list[str] = PARITY_SAMPLE_TEXTS) -> bool:
+    """Compares ONNX and PyTorch embeddings of `texts`; True if every cosine similarity is within tolerance."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    reference = np.array(HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME, model_kwargs={"device": "cpu"}, encode_kwargs={"normalize_embeddings": True}
+    ).embed_documents(texts))
+    candidate = np.array(OnnxEmbeddings(use_int8=use_int8).embed_documents(texts))
+    cosines = (reference * candidate).sum(axis=1)
+    min_cosine = PARITY_MIN_COSINE["int8" if use_int8 else "fp32"]
+    print(f"ONNX ({'int8' if use_int8 else 'fp32'}) vs PyTorch: min cosine {cosines.min():.5f}, "
+          f"max abs diff {np.abs(reference - candidate).max():.5f} (required cosine >= {min_cosine})")
+    return bool(cosines.min() >= min_cosine)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="ONNX embedding backend.")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    export_parser = subcommands.add_parser("export", help="Export the embedding model to ONNX (+ int8).")
+    export_parser.add_argument("--no-quantize", action="store_true")
+    check_parser = subcommands.add_parser("check", help="Check ONNX embeddings against the PyTorch backend.")
+    check_parser.add_argument("--fp32", action="store_true", help="Check model.onnx instead of the int8 model.")
+    args = arg_parser.parse_args()
+
+    if args.command == "export":
+        export_onnx_model(quantize=not args.no_quantize)
+    else:
+        sys.exit(0 if check_parity(use_int8=not args.fp32) else 1)
@@ -0,0 +1,259 @@
+# partitioned_index.py
+"""Per-(doc_type, publication year) copies of the index, searched only when a filter rules partitions out.
+
+The build derives one small index per partition (e.g. `news-2024`, `patent-1987`, `news-undated`) from the main
+index and writes them under `partitions/` with a catalog (`partitions/catalog.json`: doc type, year, date range,
+vector count and index type of each). Vectors keep their global labels, so hits from any partition map to
+chunks.sqlite and vectors.f32 like hits from the main index. A partition is only rebuilt when its labels change,
+so an incremental build usually rewrites just the current year of each doc type.
+
+A query whose self-query filter bounds `doc_type` and/or `date` (see `filter_bounds`) searches the partitions
+the catalog says can match and merges their top k; "news of the last two years" then scans two partitions
+instead of the whole corpus. Queries the filter cannot narrow down use the main index.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+import faiss
+
+from config import FAISS_PARTITION_FLAT_MAX_VECTORS, FAISS_RESCORE_FACTOR
+from faiss_index_utils import (
+    build_index_from_vectors,
+    resolve_index_params,
+    apply_search_params,
+    vectors_for_labels,
+    search_with_rescore,
+    selector_params,
+    read_faiss_index,
+    is_quantized,
+    label_bound,
+)
+from metadata_columns import MISSING_DATE, to_epoch
+
+PARTITIONS_DIRNAME = "partitions"
+CATALOG_FILENAME = "catalog.json"
+UNDATED_YEAR = "undated"
+
+def _partition_name(doc_type: str, year: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", f"{doc_type}-{year}")
+
+def partition_labels(columns) -> dict[tuple[str, str], np.ndarray]:
+    """Labels of the indexed chunks per (doc_type, year), from the metadata columns."""
+    codes, doc_types = columns.categories["doc_type"]
+    epochs = columns.dates["date"]
+    dated = epochs != MISSING_DATE
+    years = np.where(dated, epochs, 0).astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+    partitions = {}
+    for code, doc_type in enumerate(doc_types):
+        of_type = codes == code
+        for year in np.unique(years[of_type & dated]):
+            partitions[(doc_type, str(year))] = np.flatnonzero(of_type & dated & (years == year))
+        undated = np.flatnonzero(of_type & ~dated)
+        if len(undated):
+            partitions[(doc_type, UNDATED_YEAR)] = undated
+    return partitions
+
+def _labels_digest(labels: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(labels, dtype=np.int64).tobytes()).hexdigest()
+
+def read_catalog(index_path: str) -> dict | None:
+    catalog_path = os.path.join(index_path, PARTITIONS_DIRNAME, CATALOG_FILENAME)
+    if not os.path.exists(catalog_path):
+        return None
+    with open(catalog_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def remove_partitions(index_path: str):
+    shutil.rmtree(os.path.join(index_path, PARTITIONS_DIRNAME), ignore_errors=True)
+
+def build_partitions(index, index_path: str, columns, index_type: str, rescore_vectors=None,
+                     flat_max_vectors: int = FAISS_PARTITION_FLAT_MAX_VECTORS) -> dict:
+    """Writes the partition indexes and catalog for `index`, reusing partitions whose labels did not change.
+
+    Partitions up to `flat_max_vectors` vectors are exact (flat); larger ones use the main index type.
+    """
+    start_time = time.time()
+    partitions_dir = os.path.join(index_path, PARTITIONS_DIRNAME)
+    os.makedirs(partitions_dir, exist_ok=True)
+    previous = (read_catalog(index_path) or {}).get("partitions", {})
+    entries = {}
+    rebuilt = 0
+    for (doc_type, year), labels in sorted(partition_labels(columns).items()):
+        name = _partition_name(doc_type, year)
+        digest = _labels_digest(labels)
+        partition_type = "flat" if len(labels) <= flat_max_vectors else index_type
+        old = previous.get(name)
+        if (old and old["labels_sha256"] == digest and old["index_type"] == partition_type
+                and os.path.exists(os.path.join(partitions_dir, old["file"]))):
+            entries[name] = old
+            continue
+        params = resolve_index_params(partition_type, len(labels))
+        partition_index = build_index_from_vectors(vectors_for_labels(index, labels, rescore_vectors), partition_type, params, labels=labels)
+        file_name = f"{name}.faiss"
+        faiss.write_index(partition_index, os.path.join(partitions_dir, file_name + ".tmp"))
+        os.replace(os.path.join(partitions_dir, file_name + ".tmp"), os.path.join(partitions_dir, file_name))
+        dates = columns.dates["date"][labels]
+        entries[name] = {
+            "doc_type": doc_type,
+            "year": year,
+            "vectors": int(len(labels)),
+            "min_date": None if year == UNDATED_YEAR else int(dates.min()),
+            "max_date": None if year == UNDATED_YEAR else int(dates.max()),
+            "index_type": partition_type,
+            "params": params,
+            "file": file_name,
+            "labels_sha256": digest,
+        }
+        rebuilt += 1
+
+    for name, entry in previous.items():
+        if name not in entries:
+            stale_path = os.path.join(partitions_dir, entry["file"])
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+    catalog = {"label_bound": label_bound(index), "partitions": entries}
+    catalog_path = os.path.join(partitions_dir, CATALOG_FILENAME)
+    with open(catalog_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(catalog_path + ".tmp", catalog_path)
+    print(f"Wrote {len(entries)} index partitions ({rebuilt} rebuilt, {len(entries) - rebuilt} unchanged) "
+          f"in {time.time() - start_time:.2f} seconds.")
+    return catalog
+
+def filter_bounds(filter) -> tuple[set | None, int | None, int | None]:
+    """(allowed doc types, min date, max date) implied by a FaissTranslator filter; None where it does not narrow.
+
+    Conservative: a partition outside these bounds cannot hold a match, but one inside may still hold none.
+    """
+    if not isinstance(filter, dict):
+        return None, None, None
+    doc_types, low, high = None, None, None
+
+    def narrow(bounds):
+        nonlocal doc_types, low, high
+        part_types, part_low, part_high = bounds
+        if part_types is not None:
+            doc_types = part_types if doc_types is None else doc_types & part_types
+        if part_low is not None:
+            low = part_low if low is None else max(low, part_low)
+        if part_high is not None:
+            high = part_high if high is None else min(high, part_high)
+
+    for key, value in filter.items():
+        if key == "$and":
+            for part in value:
+                narrow(filter_bounds(part))
+        elif key == "$or":
+            parts = [filter_bounds(part) for part in value]
+            # The union narrows only where every alternative does
+            if parts and all(part[0] is not None for part in parts):
+                narrow((set().union(*(part[0] for part in parts)), None, None))
+            if parts and all(part[1] is not None for part in parts):
+                narrow((None, min(part[1] for part in parts), None))
+            if parts and all(part[2] is not None for part in parts):
+                narrow((None, None, max(part[2] for part in parts)))
+        elif key == "doc_type":
+            conditions = value if isinstance(value, dict) else {"$in": value} if isinstance(value, list) else {"$eq": value}
+            for op, operand in conditions.items():
+                if op == "$eq":
+                    narrow(({str(operand)}, None, None))
+                elif op == "$in" and isinstance(operand, list):
+                    narrow(({str(item) for item in operand}, None, None))
+        elif key == "date" and isinstance(value, dict):
+            for op, operand in value.items():
+                epoch = to_epoch(operand)
+                if epoch is None:
+                    continue
+                if op in ("$gt", "$gte", "$eq"):
+                    narrow((None, epoch, None))
+                if op in ("$lt", "$lte", "$eq"):
+                    narrow((None, None, epoch))
+    return doc_types, low, high
+
+class PartitionedIndex:
+    def __init__(self, index_path: str, catalog: dict, rescore_vectors=None, rescore_factor: int = FAISS_RESCORE_FACTOR):
+        self.index_path = index_path
+        self.catalog = catalog
+        self.rescore_vectors = rescore_vectors
+        self.rescore_factor = rescore_factor
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, index_path: str, main_index, rescore_vectors=None):
+        """The partitions of the index at `index_path`, or None if it has none or they were built for other labels."""
+        catalog = read_catalog(index_path)
+        if catalog is None:
+            return None
+        if catalog.get("label_bound") != label_bound(main_index):
+            print(f"Index partitions in {index_path} do not match the index; searching the full index.")
+            return None
+        return cls(index_path, catalog, rescore_vectors)
+
+    def _index(self, name: str):
+        # Memory-mapped on first use, so partitions no query touches cost no RAM
+        with self._lock:
+            if name not in self._indexes:
+                entry = self.catalog["partitions"][name]
+                partition_index = read_faiss_index(os.path.join(self.index_path, PARTITIONS_DIRNAME, entry["file"]))
+                apply_search_params(partition_index, entry["params"])
+                self._indexes[name] = partition_index
+            return self._indexes[name]
+
+    def select(self, filter) -> list[str] | None:
+        """Names of the partitions that can hold matches of `filter`, or None if it rules none of them out."""
+        doc_types, low, high = filter_bounds(filter)
+        if doc_types is None and low is None and high is None:
+            return None
+        selected = []
+        for name, entry in self.catalog["partitions"].items():
+            if doc_types is not None and entry["doc_type"] not in doc_types:
+                continue
+            if (low is not None or high is not None) and entry["min_date"] is None:
+                continue # Undated chunks never match a date condition
+            if low is not None and entry["max_date"] < low:
+                continue
+            if high is not None and entry["min_date"] > high:
+                continue
+            selected.append(name)
+        return selected
+
+    def search(self, names: list[str], queries: np.ndarray, k: int, mask: np.ndarray | None = None):
+        """Top `k` `(distances, labels)` over the partitions `names`, like `index.search` (restricted to `mask` if given)."""
+        distances = [np.full((len(queries), 0), np.inf, dtype=np.float32)]
+        labels = [np.full((len(queries), 0), -1, dtype=np.int64)]
+        for name in names:
+            partition_index = self._index(name)
+            params = selector_params(partition_index, mask) if mask is not None else None
+            rescore = self.rescore_vectors if is_quantized(self.catalog["partitions"][name]["index_type"]) else None
+            partition_k = min(k, partition_index.ntotal)
+            if mask is not None and params is None:
+                # No selector for this index type: search the whole partition and drop the labels outside the mask
+                partition_k = partition_index.ntotal
+            partition_distances, partition_labels_found = search_with_rescore(
+                partition_index, queries, partition_k, rescore, self.rescore_factor, params=params
+            )
+            if mask is not None and params is None:
+                outside = (partition_labels_found >= len(mask)) | ~mask[np.clip(partition_labels_found, 0, len(mask) - 1)]
+                partition_labels_found[outside] = -1
+            distances.append(partition_distances)
+            labels.append(partition_labels_found)
+        distances = np.hstack(distances)
+        labels = np.hstack(labels)
+        distances[labels < 0] = np.inf
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        merged_distances = np.take_along_axis(distances, order, axis=1)
+        merged_labels = np.take_along_axis(labels, order, axis=1)
+        if merged_labels.shape[1] < k:
+            padding = k - merged_labels.shape[1]
+            merged_distances = np.pad(merged_distances, ((0, 0), (0, padding)), constant_values=np.inf)
+            merged_labels = np.pad(merged_labels, ((0, 0), (0, padding)), constant_values=-1)
+        return merged_distances, merged_labels
+
+    def vectors(self, names: list[str]) -> int:
+        return sum(self.catalog["partitions"][name]["vectors"] for name in names)
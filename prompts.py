@@ -37,6 +37,19 @@ RERANK_YES_NO = (
     "Answer with a single word, either YES or NO. Do not add anything else."
 )
 
+# ---------------------------------------------------------------------------
+# 3b. Batched reranking prompt (many chunks per call, one verdict per chunk)
+# ---------------------------------------------------------------------------
+RERANK_BATCH = (
+    "Query: '{query}'\n"
+    "Below are {num_chunks} numbered chunks. For EACH chunk decide whether it is "
+    "relevant to the query.\n\n"
+    "{numbered_chunks}\n\n"
+    "Respond ONLY with a valid JSON object that maps every chunk number (as a "
+    "string) to either \"YES\" or \"NO\", e.g. {{\"1\": \"YES\", \"2\": \"NO\"}}. "
+    "Do not add anything else."
+)
+
 # ---------------------------------------------------------------------------
 # 4. Final answer synthesis
 # ---------------------------------------------------------------------------
@@ -0,0 +1,136 @@
+# report_store.py
+"""Content-addressed store for generated PDF reports.
+
+Every analysis writes its PDF to a temporary file, which is then saved under the SHA-256 of its
+bytes (`<id>.pdf`) next to a `<id>.json` with the query, the chunk set and the answer metadata.
+Reports are evicted when older than the TTL, and least-recently-served first once the store
+grows past its size budget.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+def report_etag(report_id: str) -> str:
+    """Strong ETag of a report: the id is the hash of the PDF bytes."""
+    return f'"{report_id}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if an If-None-Match header matches `etag`, compared weakly (a `W/` prefix is ignored, RFC 9110 13.1.2)."""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+class ReportStore:
+    def __init__(self, root: str, max_bytes: int, ttl_seconds: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def new_temp_path(self) -> str:
+        """A unique path to write a new PDF to before it is saved."""
+        return os.path.join(self.root, "tmp", f"{uuid.uuid4().hex}.pdf")
+
+    def _pdf_path(self, report_id: str) -> str:
+        return os.path.join(self.root, f"{report_id}.pdf")
+
+    def _meta_path(self, report_id: str) -> str:
+        return os.path.join(self.root, f"{report_id}.json")
+
+    def save(self, temp_pdf_path: str, metadata: dict) -> str:
+        """Moves the PDF into the store under its content hash and writes its metadata. Returns the report id."""
+        sha = hashlib.sha256()
+        with open(temp_pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        report_id = sha.hexdigest()
+
+        with self._lock:
+            if os.path.exists(self._pdf_path(report_id)):
+                os.remove(temp_pdf_path)
+            else:
+                os.replace(temp_pdf_path, self._pdf_path(report_id))
+            metadata = {**metadata, "report_id": report_id, "size_bytes": os.path.getsize(self._pdf_path(report_id)),
+                        "created_at": time.time()}
+            temp_meta_path = self._meta_path(report_id) + ".tmp"
+            with open(temp_meta_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(temp_meta_path, self._meta_path(report_id))
+        print(f"Saved report {report_id} ({metadata['size_bytes']} bytes) to {self.root}")
+        self.evict()
+        return report_id
+
+    def get(self, report_id: str):
+        """Returns `(pdf_path, metadata)` or None if the report is unknown or expired. Marks it as recently used."""
+        if not report_id or any(c not in "0123456789abcdef" for c in report_id):
+            return None
+        pdf_path, meta_path = self._pdf_path(report_id), self._meta_path(report_id)
+        with self._lock:
+            if not (os.path.exists(pdf_path) and os.path.exists(meta_path)):
+                return None
+            if self.ttl_seconds and time.time() - os.path.getmtime(pdf_path) > self.ttl_seconds:
+                self._remove(report_id)
+                return None
+            with open(meta_path, encoding="utf-8") as f:
+                metadata = json.load(f)
+            # The metadata file's mtime is the "last served" time used for LRU eviction
+            os.utime(meta_path)
+        return pdf_path, metadata
+
+    def latest(self) -> str | None:
+        """Id of the most recently created report, if any."""
+        report_ids = self._report_ids()
+        if not report_ids:
+            return None
+        return max(report_ids, key=lambda rid: os.path.getmtime(self._pdf_path(rid)))
+
+    def _report_ids(self) -> list[str]:
+        return [name[:-4] for name in os.listdir(self.root)
+                if name.endswith(".pdf") and os.path.exists(self._meta_path(name[:-4]))]
+
+    def _remove(self, report_id: str):
+        for path in (self._pdf_path(report_id), self._meta_path(report_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Drops expired reports, then least-recently-served ones until the store fits in `max_bytes`."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for report_id in self._report_ids():
+                try:
+                    created = os.path.getmtime(self._pdf_path(report_id))
+                    last_used = os.path.getmtime(self._meta_path(report_id))
+                    size = os.path.getsize(self._pdf_path(report_id)) + os.path.getsize(self._meta_path(report_id))
+                except FileNotFoundError:
+                    continue
+                if self.ttl_seconds and now - created > self.ttl_seconds:
+                    self._remove(report_id)
+                    continue
+                entries.append((last_used, size, report_id))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, report_id in sorted(entries):
+                if total_bytes <= self.max_bytes or len(entries) - evicted <= 1:
+                    break
+                self._remove(report_id)
+                total_bytes -= size
+                evicted += 1
+            if evicted:
+                print(f"Evicted {evicted} report(s) from {self.root} to stay under {self.max_bytes} bytes.")
+
+            # Temp files left behind by crashed runs
+            tmp_dir = os.path.join(self.root, "tmp")
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                if now - os.path.getmtime(path) > 24 * 3600:
+                    os.remove(path)
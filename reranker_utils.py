@@ -0,0 +1,78 @@
+# reranker_utils.py
+"""Local (non-LLM) reranking backends.
+
+Every factory here returns a `rerank(original_query, documents, on_relevant=None) -> list[Document]` callable,
+the same shape as `llm_interface.create_llm_reranker`, so `retrieve_and_rerank` can use any of them.
+"""
+import threading
+import numpy as np
+from langchain_core.documents import Document
+
+from config import (
+    CROSS_ENCODER_MODEL_NAME,
+    CROSS_ENCODER_BATCH_SIZE,
+    CROSS_ENCODER_SCORE_THRESHOLD,
+    CROSS_ENCODER_TOP_N,
+    HYBRID_RERANK_LLM_CANDIDATES,
+)
+
+_cross_encoders = {}
+_cross_encoders_lock = threading.Lock()
+
+def get_cross_encoder(model_name: str = CROSS_ENCODER_MODEL_NAME, device: str = "cpu"):
+    """Loads (once per process) and returns a sentence-transformers CrossEncoder."""
+    with _cross_encoders_lock:
+        key = (model_name, device)
+        if key not in _cross_encoders:
+            # Imported lazily so the LLM-only setup does not need to load torch for reranking
+            from sentence_transformers import CrossEncoder
+            print(f"Initializing cross-encoder: {model_name} on {device}")
+            _cross_encoders[key] = CrossEncoder(model_name, device=device)
+        return _cross_encoders[key]
+
+def score_with_cross_encoder(model, query: str, documents: list[Document], batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> np.ndarray:
+    """Scores (query, chunk) pairs in vectorized batches. Higher is more relevant."""
+    pairs = [(query, doc.page_content) for doc in documents]
+    scores = model.predict(pairs, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(scores, dtype=np.float32).reshape(len(documents))
+
+def select_by_score(scores: np.ndarray, score_threshold: float | None = None, top_n: int | None = None) -> list[int]:
+    """Returns positions sorted by descending score, cut by threshold and/or top-n."""
+    order = np.argsort(-scores, kind="stable")
+    if score_threshold is not None:
+        order = order[scores[order] >= score_threshold]
+    if top_n:
+        order = order[:top_n]
+    return order.tolist()
+
+def create_cross_encoder_reranker(model_name: str = CROSS_ENCODER_MODEL_NAME, score_threshold: float | None = CROSS_ENCODER_SCORE_THRESHOLD,
+                                  top_n: int | None = CROSS_ENCODER_TOP_N, batch_size: int = CROSS_ENCODER_BATCH_SIZE):
+    """Reranker that keeps chunks by local cross-encoder score instead of a Gemini YES/NO.
+
+    The returned documents are ordered by score (best first).
+    """
+    model = get_cross_encoder(model_name)
+
+    def rerank(original_query: str, documents: list[Document], on_relevant=None) -> list[Document]:
+        if not documents:
+            return []
+        scores = score_with_cross_encoder(model, original_query, documents, batch_size)
+        kept_positions = select_by_score(scores, score_threshold, top_n)
+        print(f"Cross-encoder reranked {len(documents)} documents down to {len(kept_positions)} "
+              f"(threshold={score_threshold}, top_n={top_n}, best score={scores.max():.3f}).")
+        reranked_documents = [documents[i] for i in kept_positions]
+        if on_relevant and reranked_documents:
+            on_relevant(reranked_documents)
+        return reranked_documents
+
+    return rerank
+
+def create_hybrid_reranker(llm_reranker, model_name: str = CROSS_ENCODER_MODEL_NAME, llm_candidates: int = HYBRID_RERANK_LLM_CANDIDATES,
+                           score_threshold: float | None = CROSS_ENCODER_SCORE_THRESHOLD, batch_size: int = CROSS_ENCODER_BATCH_SIZE):
+    """Cross-encoder prunes to the best `llm_candidates` chunks, then `llm_reranker` makes the final call."""
+    prune = create_cross_encoder_reranker(model_name, score_threshold=score_threshold, top_n=llm_candidates, batch_size=batch_size)
+
+    def rerank(original_query: str, documents: list[Document], on_relevant=None) -> list[Document]:
+        return llm_reranker(original_query, prune(original_query, documents), on_relevant=on_relevant)
+
+    return rerank
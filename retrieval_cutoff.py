@@ -0,0 +1,67 @@
+# retrieval_cutoff.py
+"""Adaptive cutoff of ranked retrieval hits, so the reranker only sees candidates that stand out.
+
+A fixed k sends every query's 50 (broad query: 100) nearest chunks to the reranker, even when only a handful
+are close to the query. `cut_hits` shortens a best-first `(doc, score)` list with any combination of:
+  - max_distance:       absolute, drop hits farther than this (FAISS squared L2; 0..4 for normalized embeddings)
+  - max_distance_ratio: relative gap, drop hits farther than this multiple of the best hit's distance
+  - knee:               cut where the sorted scores jump away from the best hits (Kneedle-style, see `knee_position`)
+never keeping fewer than `min_keep` hits. Every rule is off unless configured (RETRIEVAL_CUTOFF in config.py). Distance rules only apply to distances; the knee also works on
+"higher is better" scores such as BM25.
+"""
+import numpy as np
+
+def knee_position(scores: np.ndarray, min_gain: float, min_jump: float = 0.0) -> int | None:
+    """Number of hits before the knee of best-first distances, or None if the curve has no clear knee.
+
+    The distances are scaled to [0, 1] along both axes; where they rise fastest above the diagonal (by at least
+    `min_gain`) is the first hit after the jump. Any concave curve has such a point, so the step from the
+    previous hit must also be at least `min_jump` of the whole range: a smooth curve has no knee.
+    """
+    if len(scores) < 3 or scores[-1] <= scores[0]:
+        return None
+    rise = (scores - scores[0]) / (scores[-1] - scores[0])
+    gain = rise - np.linspace(0.0, 1.0, len(scores))
+    position = int(np.argmax(gain))
+    if gain[position] < min_gain or position == 0 or rise[position] - rise[position - 1] < min_jump:
+        return None
+    return position
+
+def cutoff_position(scores, max_distance: float | None = None, max_distance_ratio: float | None = None, knee: bool = False,
+                    knee_min_gain: float = 0.2, knee_min_jump: float = 0.0, min_keep: int = 1,
+                    higher_is_better: bool = False) -> tuple[int, str | None]:
+    """How many of the best-first `scores` to keep, and the rule that cut the list (None if nothing was cut)."""
+    scores = np.asarray(scores, dtype=np.float64)
+    keep, rule = len(scores), None
+
+    def cut(position, name):
+        nonlocal keep, rule
+        position = max(position, min(min_keep, len(scores)))
+        if position < keep:
+            keep, rule = position, name
+
+    def first_above(limit):
+        above = np.flatnonzero(scores > limit)
+        return int(above[0]) if len(above) else len(scores)
+
+    if len(scores) == 0:
+        return 0, None
+    if not higher_is_better:
+        if max_distance is not None:
+            cut(first_above(max_distance), "max_distance")
+        if max_distance_ratio is not None:
+            cut(first_above(scores[0] * max_distance_ratio), "max_distance_ratio")
+    if knee:
+        position = knee_position(-scores if higher_is_better else scores, knee_min_gain, knee_min_jump)
+        if position is not None:
+            cut(position, "knee")
+    return keep, rule
+
+def cut_hits(hits: list, settings: dict | None, label: str = "", higher_is_better: bool = False) -> list:
+    """`hits` shortened by `settings` (see RETRIEVAL_CUTOFF in config.py); prints how many were dropped and why."""
+    if not settings or not hits:
+        return hits
+    keep, rule = cutoff_position([score for _, score in hits], higher_is_better=higher_is_better, **settings)
+    if rule is not None:
+        print(f"  - Adaptive cutoff ({rule}) kept {keep} of {len(hits)} {label} hits, dropped {len(hits) - keep}.")
+    return hits[:keep]
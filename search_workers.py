@@ -0,0 +1,384 @@
+# search_workers.py
+"""Scatter-gather search over index shards served by separate processes, on one host or several.
+
+With SEARCH_WORKER_SHARDS > 0 each build also splits the index by label (label % shards) into
+`shards/shard-<i>.faiss` in the index version. A worker serves one shard: it memory-maps that shard plus the
+version's chunks.sqlite / metadata columns, answers `search` requests with the same semantics as the
+in-process store (filters, re-scoring, removed chunks), and switches to a newly published version on its own.
+The API then only holds the embedding model: `ShardedSearchStore` sends each query to every shard in
+parallel and merges the hits by distance.
+
+Requests travel over `multiprocessing.connection` (pickled messages over TCP, authenticated with
+SEARCH_WORKER_AUTHKEY), so any client that knows the key can run code in a worker: workers refuse to start
+without a key, listen on 127.0.0.1 unless given `--host`, and must only be exposed on a trusted network.
+Each host running workers needs the index versions directory (a shared or synced VECTOR_STORE_PATH). `LocalTransport` runs a worker in the
+calling process with the same request/response contract, for tests and debugging.
+
+    python search_workers.py serve --shard 0 --port 7601   # one worker
+    python search_workers.py local                         # every shard on this host, ports SEARCH_WORKER_BASE_PORT + i
+    python search_workers.py check                         # shard / version / vector count of each configured worker
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import faiss
+
+from config import (
+    VECTOR_STORE_PATH,
+    INDEX_RELOAD_CHECK_SECONDS,
+    SEARCH_WORKER_SHARDS,
+    SEARCH_WORKER_ADDRESSES,
+    SEARCH_WORKER_AUTHKEY,
+    SEARCH_WORKER_TIMEOUT_SECONDS,
+    SEARCH_WORKER_BASE_PORT,
+)
+from faiss_index_utils import (
+    build_index_from_vectors,
+    resolve_index_params,
+    apply_search_params,
+    vectors_for_labels,
+    read_faiss_index,
+    load_rescore_vectors,
+    is_quantized,
+    label_bound,
+)
+from faiss_vector_store import MaritimeFAISS
+from chunk_store import CHUNK_STORE_FILENAME, SqliteDocstore, SqliteRowMap
+from metadata_columns import MetadataColumns
+from index_versions import current_version, current_index_path
+
+SHARDS_DIRNAME = "shards"
+SHARD_CATALOG_FILENAME = "catalog.json"
+
+def read_shard_catalog(index_path: str) -> dict | None:
+    catalog_path = os.path.join(index_path, SHARDS_DIRNAME, SHARD_CATALOG_FILENAME)
+    if not os.path.exists(catalog_path):
+        return None
+    with open(catalog_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def remove_shards(index_path: str):
+    shutil.rmtree(os.path.join(index_path, SHARDS_DIRNAME), ignore_errors=True)
+
+def build_shards(index, index_path: str, num_shards: int, index_type: str, live_labels, rescore_vectors=None) -> dict:
+    """Writes `num_shards` indexes holding the live labels with `label % num_shards == shard`, reusing unchanged ones."""
+    start_time = time.time()
+    shards_dir = os.path.join(index_path, SHARDS_DIRNAME)
+    previous = read_shard_catalog(index_path)
+    if previous is not None and previous["num_shards"] != num_shards:
+        remove_shards(index_path)
+        previous = None
+    os.makedirs(shards_dir, exist_ok=True)
+    live_labels = np.sort(np.asarray(list(live_labels), dtype=np.int64))
+    entries = []
+    rebuilt = 0
+    for shard in range(num_shards):
+        labels = live_labels[live_labels % num_shards == shard]
+        digest = hashlib.sha256(labels.tobytes()).hexdigest()
+        shard_type = index_type if len(labels) else "flat"
+        old = previous["shards"][shard] if previous else None
+        if (old and old["labels_sha256"] == digest and old["index_type"] == shard_type
+                and os.path.exists(os.path.join(shards_dir, old["file"]))):
+            entries.append(old)
+            continue
+        params = resolve_index_params(shard_type, len(labels))
+        shard_index = build_index_from_vectors(vectors_for_labels(index, labels, rescore_vectors), shard_type, params, labels=labels)
+        file_name = f"shard-{shard}.faiss"
+        faiss.write_index(shard_index, os.path.join(shards_dir, file_name + ".tmp"))
+        os.replace(os.path.join(shards_dir, file_name + ".tmp"), os.path.join(shards_dir, file_name))
+        entries.append({"file": file_name, "vectors": int(len(labels)), "index_type": shard_type,
+                        "params": params, "labels_sha256": digest})
+        rebuilt += 1
+    catalog = {"label_bound": label_bound(index), "num_shards": num_shards, "shards": entries}
+    catalog_path = os.path.join(shards_dir, SHARD_CATALOG_FILENAME)
+    with open(catalog_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(catalog_path + ".tmp", catalog_path)
+    print(f"Wrote {num_shards} search worker shards ({rebuilt} rebuilt) in {time.time() - start_time:.2f} seconds.")
+    return catalog
+
+def _require_authkey(authkey: str | None) -> bytes:
+    if not authkey:
+        raise ValueError("SEARCH_WORKER_AUTHKEY is not set. Set the same secret for the search workers and the API in .env.")
+    return authkey.encode()
+
+def load_shard_store(index_path: str, shard: int) -> MaritimeFAISS:
+    """Read-only store over one shard of the index version at `index_path` (no embedding model: queries arrive as vectors)."""
+    catalog = read_shard_catalog(index_path)
+    if catalog is None:
+        raise FileNotFoundError(f"No search worker shards in {index_path}. Set SEARCH_WORKER_SHARDS and rebuild.")
+    if not 0 <= shard < catalog["num_shards"]:
+        raise ValueError(f"Shard {shard} does not exist; {index_path} has {catalog['num_shards']} shards.")
+    entry = catalog["shards"][shard]
+    index = read_faiss_index(os.path.join(index_path, SHARDS_DIRNAME, entry["file"]))
+    apply_search_params(index, entry["params"])
+    docstore = SqliteDocstore(os.path.join(index_path, CHUNK_STORE_FILENAME), read_only=True)
+    store = MaritimeFAISS(None, index, docstore, SqliteRowMap(docstore))
+    store.metadata_columns = MetadataColumns.load(index_path)
+    if is_quantized(entry["index_type"]):
+        store.rescore_vectors = load_rescore_vectors(index_path, index.d, catalog["label_bound"])
+    return store
+
+class ShardServer:
+    """Answers requests for one shard of the published index, switching to new versions as they are published."""
+
+    def __init__(self, shard: int, root: str = VECTOR_STORE_PATH, reload_check_seconds: float = INDEX_RELOAD_CHECK_SECONDS):
+        self.shard = shard
+        self.root = root
+        self.reload_check_seconds = reload_check_seconds
+        self.version = None
+        self.store = None
+        self.num_shards = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        self._in_flight = {} # store -> requests using it
+        self._load()
+
+    def _load(self):
+        version = current_version(self.root)
+        index_path = current_index_path(self.root)
+        start_time = time.time()
+        store = load_shard_store(index_path, self.shard)
+        with self._store_lock:
+            old_store, self.store, self.version = self.store, store, version
+            close_old = old_store is not None and old_store not in self._in_flight
+        # Requests still running on the old store close it when the last of them finishes (see _release_store)
+        if close_old:
+            old_store.docstore.close()
+        self.num_shards = read_shard_catalog(index_path)["num_shards"]
+        print(f"Shard {self.shard}/{self.num_shards}: serving {store.index.ntotal} vectors of index version {version} "
+              f"(loaded in {time.time() - start_time:.2f} seconds).")
+
+    def _maybe_reload(self):
+        if not self.reload_check_seconds or time.time() - self._last_check < self.reload_check_seconds:
+            return
+        with self._lock:
+            if time.time() - self._last_check < self.reload_check_seconds:
+                return
+            self._last_check = time.time()
+            version = current_version(self.root)
+            if version is not None and version != self.version:
+                try:
+                    self._load()
+                except Exception as e:
+                    print(f"Shard {self.shard}: error loading index version {version}: {e}. Still serving {self.version}.")
+
+    def _acquire_store(self) -> MaritimeFAISS:
+        with self._store_lock:
+            store = self.store
+            self._in_flight[store] = self._in_flight.get(store, 0) + 1
+            return store
+
+    def _release_store(self, store: MaritimeFAISS):
+        with self._store_lock:
+            self._in_flight[store] -= 1
+            if self._in_flight[store]:
+                return
+            del self._in_flight[store]
+            if store is self.store:
+                return
+        store.docstore.close()
+
+    def handle(self, method: str, kwargs: dict):
+        self._maybe_reload()
+        store = self._acquire_store()
+        try:
+            if method == "search":
+                hits = store.similarity_search_with_score_by_vector(
+                    np.asarray(kwargs["embedding"], dtype=np.float32), k=kwargs["k"], filter=kwargs.get("filter"),
+                    fetch_k=kwargs.get("fetch_k", 20), score_threshold=kwargs.get("score_threshold"),
+                )
+                return [(doc, float(score)) for doc, score in hits]
+            if method == "info":
+                return {"shard": self.shard, "num_shards": self.num_shards, "version": self.version, "vectors": int(store.index.ntotal)}
+            raise ValueError(f"Unknown search worker method '{method}'.")
+        finally:
+            self._release_store(store)
+
+def _serve_connection(server: ShardServer, conn):
+    with conn:
+        while True:
+            try:
+                method, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                response = ("ok", server.handle(method, kwargs))
+            except Exception as e:
+                response = ("error", f"{type(e).__name__}: {e}")
+            conn.send(response)
+
+def serve(shard: int, host: str = "127.0.0.1", port: int = SEARCH_WORKER_BASE_PORT, authkey: str | None = SEARCH_WORKER_AUTHKEY):
+    """Runs a worker for `shard` until the process is stopped (one thread per client connection)."""
+    authkey = _require_authkey(authkey)
+    server = ShardServer(shard)
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"Search worker for shard {shard} listening on {host}:{port}.")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e: # e.g. a client with the wrong authkey
+                print(f"Search worker {shard}: rejected connection ({e}).")
+                continue
+            threading.Thread(target=_serve_connection, args=(server, conn), daemon=True).start()
+
+class ConnectionTransport:
+    """Client side of a worker connection. Idle connections are pooled, so concurrent queries do not queue up."""
+
+    def __init__(self, address: str, authkey: str | None = SEARCH_WORKER_AUTHKEY, timeout: float = SEARCH_WORKER_TIMEOUT_SECONDS):
+        host, _, port = address.rpartition(":")
+        self.address = address
+        self._endpoint = (host or "localhost", int(port))
+        self._authkey = _require_authkey(authkey)
+        self.timeout = timeout
+        self._idle = queue.SimpleQueue()
+
+    def _request(self, conn, method: str, kwargs: dict):
+        conn.send((method, kwargs))
+        if not conn.poll(self.timeout):
+            raise TimeoutError(f"no answer within {self.timeout} seconds")
+        return conn.recv()
+
+    def call(self, method: str, **kwargs):
+        try:
+            conn, pooled = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, pooled = None, False
+        try:
+            if conn is None:
+                conn = Client(self._endpoint, authkey=self._authkey)
+            try:
+                status, result = self._request(conn, method, kwargs)
+            except (EOFError, OSError):
+                if not pooled:
+                    raise
+                # The worker restarted since this connection was last used; requests are safe to repeat
+                conn.close()
+                conn = Client(self._endpoint, authkey=self._authkey)
+                status, result = self._request(conn, method, kwargs)
+        except Exception as e:
+            if conn is not None:
+                conn.close() # The answer may still arrive; never reuse this connection
+            raise RuntimeError(f"Search worker {self.address}: {type(e).__name__}: {e}") from e
+        self._idle.put(conn)
+        if status == "error":
+            raise RuntimeError(f"Search worker {self.address}: {result}")
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class LocalTransport:
+    """Same contract as ConnectionTransport, served by a ShardServer in this process (requests and results are still pickled)."""
+
+    def __init__(self, server: ShardServer):
+        self.server = server
+        self.address = f"local:{server.shard}"
+
+    def call(self, method: str, **kwargs):
+        method, kwargs = pickle.loads(pickle.dumps((method, kwargs)))
+        try:
+            result = self.server.handle(method, kwargs)
+        except Exception as e:
+            raise RuntimeError(f"Search worker {self.address}: {type(e).__name__}: {e}") from e
+        return pickle.loads(pickle.dumps(result))
+
+    def close(self):
+        pass
+
+class ShardedSearchStore(MaritimeFAISS):
+    """LangChain vector store that embeds queries locally and searches every shard through its transport."""
+
+    def __init__(self, embedding_function, transports: list):
+        super().__init__(embedding_function, None, None, {})
+        self.transports = transports
+        self._fanout = ThreadPoolExecutor(max_workers=max(len(transports), 1), thread_name_prefix="search-fanout")
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None, fetch_k: int = 20, **kwargs):
+        request = {"embedding": [float(value) for value in embedding], "k": k, "filter": filter, "fetch_k": fetch_k,
+                   "score_threshold": kwargs.get("score_threshold")}
+        futures = [self._fanout.submit(transport.call, "search", **request) for transport in self.transports]
+        hits = []
+        for future in futures:
+            try:
+                hits.extend(future.result())
+            except Exception as e:
+                # One slow or failed shard degrades the results instead of failing the whole analysis
+                print(f"Warning: {e}. Results exclude this shard.")
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:k]
+
+    def shard_info(self) -> list[dict]:
+        return [transport.call("info") for transport in self.transports]
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self._fanout.shutdown(wait=False)
+
+def connect_search_workers(embeddings, addresses: list[str] = SEARCH_WORKER_ADDRESSES, authkey: str | None = SEARCH_WORKER_AUTHKEY,
+                           timeout: float = SEARCH_WORKER_TIMEOUT_SECONDS) -> ShardedSearchStore:
+    """ShardedSearchStore over the workers at `addresses`; warns if they do not cover every shard of one version."""
+    _require_authkey(authkey)
+    store = ShardedSearchStore(embeddings, [ConnectionTransport(address, authkey, timeout) for address in addresses])
+    infos = store.shard_info()
+    served = sorted(info["shard"] for info in infos)
+    expected = list(range(infos[0]["num_shards"])) if infos else []
+    if served != expected:
+        print(f"Warning: search workers serve shards {served} but the index has shards {expected}; results will be incomplete.")
+    versions = {info["version"] for info in infos}
+    if len(versions) > 1:
+        print(f"Warning: search workers serve different index versions {sorted(versions)} (a reload is probably in progress).")
+    print(f"Connected to {len(infos)} search workers ({sum(info['vectors'] for info in infos)} vectors, versions {sorted(versions)}).")
+    return store
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Search workers serving index shards.")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    serve_parser = subcommands.add_parser("serve", help="Serve one shard.")
+    serve_parser.add_argument("--shard", type=int, required=True)
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (0.0.0.0 = all; trusted networks only)")
+    serve_parser.add_argument("--port", type=int)
+    local_parser = subcommands.add_parser("local", help="Serve every shard from this host, one process each.")
+    local_parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (0.0.0.0 = all; trusted networks only)")
+    subcommands.add_parser("check", help="Show what each worker in SEARCH_WORKER_ADDRESSES serves.")
+    args = arg_parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.shard, args.host, args.port or SEARCH_WORKER_BASE_PORT + args.shard)
+    elif args.command == "local":
+        _require_authkey(SEARCH_WORKER_AUTHKEY)
+        shard_catalog = read_shard_catalog(current_index_path(VECTOR_STORE_PATH))
+        num_shards = shard_catalog["num_shards"] if shard_catalog else SEARCH_WORKER_SHARDS
+        if not num_shards:
+            raise SystemExit("The published index has no shards. Set SEARCH_WORKER_SHARDS and rebuild.")
+        processes = [
+            multiprocessing.get_context("spawn").Process(target=serve, args=(shard, args.host, SEARCH_WORKER_BASE_PORT + shard))
+            for shard in range(num_shards)
+        ]
+        for process in processes:
+            process.start()
+        print("SEARCH_WORKER_ADDRESSES=" + ",".join(f"localhost:{SEARCH_WORKER_BASE_PORT + shard}" for shard in range(num_shards)))
+        for process in processes:
+            process.join()
+    else:
+        for transport in [ConnectionTransport(address) for address in SEARCH_WORKER_ADDRESSES]:
+            try:
+                print(f"{transport.address}: {transport.call('info')}")
+            except Exception as e:
+                print(f"{transport.address}: {e}")
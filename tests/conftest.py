@@ -0,0 +1,41 @@
+# tests/conftest.py
+"""Makes the top-level modules importable, satisfies config.py's required environment variables and builds small test stores."""
+import os
+import sys
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import faiss
+import pytest
+
+NUM_CHUNKS = 600
+DIMENSION = 96 # Divisible by the default pq_m
+
+def _make_store(index_path, index_type: str):
+    """MaritimeFAISS over NUM_CHUNKS random vectors in `index_path`: doc_type alternates patent / news by label."""
+    from faiss_index_utils import build_index_from_vectors, resolve_index_params, is_quantized
+    from faiss_vector_store import MaritimeFAISS
+    from chunk_store import CHUNK_STORE_FILENAME, SqliteDocstore, SqliteRowMap
+    from metadata_columns import MetadataColumns
+
+    vectors = np.random.RandomState(0).rand(NUM_CHUNKS, DIMENSION).astype(np.float32)
+    # One year, so each doc_type partition has enough vectors to train PQ codebooks
+    metadatas = [{"doc_type": "news" if i % 2 else "patent", "date": "2024-01-01", "mongo_id": str(i)}
+                 for i in range(NUM_CHUNKS)]
+    docstore = SqliteDocstore(os.path.join(str(index_path), CHUNK_STORE_FILENAME), read_only=False)
+    store = MaritimeFAISS(None, faiss.IndexFlatL2(DIMENSION), docstore, SqliteRowMap(docstore))
+    store.add_embeddings(list(zip([f"chunk {i}" for i in range(NUM_CHUNKS)], vectors)), metadatas)
+    docstore.commit()
+    store.index = build_index_from_vectors(vectors, index_type, resolve_index_params(index_type, NUM_CHUNKS),
+                                           labels=np.arange(NUM_CHUNKS, dtype=np.int64))
+    store.metadata_columns = MetadataColumns.build(enumerate(metadatas), NUM_CHUNKS)
+    if is_quantized(index_type):
+        store.rescore_vectors = vectors
+    return store, vectors
+
+@pytest.fixture
+def make_store():
+    return _make_store
@@ -0,0 +1,41 @@
+# tests/test_batch_rerank.py
+"""Batched reranker output parsing, and individual re-judging of chunks without a verdict."""
+import pytest
+
+pytest.importorskip("langchain_google_genai") # llm_interface builds Gemini chains
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from llm_interface import parse_batch_rerank_verdicts, rerank_documents_with_llm_batched
+
+@pytest.mark.parametrize("output, expected", [
+    ('{"1": "YES", "2": "no", "3": "Yes, it is"}', [True, False, True]),
+    ('```json\n{"[1]": "NO", "#3": "YES"}\n```', [False, None, True]),
+    ('["YES", "NO"]', [True, False, None]),
+    ('["YES", "NO", "YES", "YES"]', [True, False, True]), # Extra entries are ignored
+    ('{"0": "YES", "4": "YES", "two": "YES", "2": "YES"}', [None, True, None]), # Out of range / non-numeric keys
+    ('{"1": "maybe", "2": null, "3": 1}', [None, None, None]),
+    ('[true, false]', [True, False, None]),
+    ("The first chunk is relevant.", [None, None, None]),
+    ('"YES"', [None, None, None]),
+])
+def test_parse_batch_rerank_verdicts(output, expected):
+    assert parse_batch_rerank_verdicts(output, 3) == expected
+
+def test_unresolved_chunks_are_rejudged_individually():
+    documents = [Document(page_content=f"chunk {i} {'relevant' if i % 2 else 'off topic'}") for i in range(5)]
+    # Batch 1 (chunks 0-2) skips chunk 2, batch 2 (chunks 3-4) is malformed
+    batch_outputs = {3: '{"1": "NO", "2": "YES"}', 2: "not json"}
+    batch_chain = RunnableLambda(lambda inputs: batch_outputs[inputs["num_chunks"]])
+    single_calls = []
+
+    def judge(inputs):
+        single_calls.append(inputs["document_text"])
+        return "YES" if "relevant" in inputs["document_text"] else "NO"
+
+    relevant = []
+    kept = rerank_documents_with_llm_batched("query", documents, batch_chain, RunnableLambda(judge), batch_size=3,
+                                             on_relevant=relevant.extend)
+    assert sorted(single_calls) == ["chunk 2 off topic", "chunk 3 relevant", "chunk 4 off topic"]
+    assert kept == [documents[1], documents[3]]
+    assert sorted(doc.page_content for doc in relevant) == ["chunk 1 relevant", "chunk 3 relevant"]
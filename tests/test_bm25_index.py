@@ -0,0 +1,52 @@
+# tests/test_bm25_index.py
+"""BM25 tokenization, masked keyword search and reciprocal rank fusion."""
+import math
+import numpy as np
+from langchain_core.documents import Document
+
+from bm25_index import tokenize, write_bm25_index, BM25Index, reciprocal_rank_fusion
+from chunk_store import CHUNK_STORE_FILENAME, SqliteDocstore, SqliteRowMap
+
+TEXTS = [
+    "The new frigate carries an ECDIS and a NASAMS air defence launcher.",
+    "ECDIS ECDIS updates for the icebreaker fleet.",
+    "Hull cleaning robot with magnetic tracks.",
+    "Patent US-2023/0123456 describes an ECDIS display.",
+]
+
+def test_tokenize_splits_compounds_and_drops_long_tokens():
+    assert tokenize("Patent US-2023/0123456, ECDIS!") == ["patent", "us-2023/0123456", "us", "2023", "0123456", "ecdis"]
+    assert tokenize("snake_case " + "x" * 65) == ["snake", "case"]
+
+def write_index(tmp_path) -> BM25Index:
+    docstore = SqliteDocstore(str(tmp_path / CHUNK_STORE_FILENAME), read_only=False)
+    docstore.add({f"id-{i}": Document(page_content=text, metadata={"title": f"Doc {i}"}) for i, text in enumerate(TEXTS)})
+    SqliteRowMap(docstore).update({i: f"id-{i}" for i in range(len(TEXTS))})
+    docstore.commit()
+    docstore.close()
+    write_bm25_index(str(tmp_path), len(TEXTS))
+    return BM25Index.load(str(tmp_path))
+
+def test_search_scores_like_bm25(tmp_path):
+    index = write_index(tmp_path)
+    scores, labels = index.search("ecdis", k=10)
+    assert labels.tolist() == [1, 3, 0] # Two occurrences first, then the shorter chunk
+    lengths = np.array([len(tokenize(f"{text} Doc {i}")) for i, text in enumerate(TEXTS)])
+    k1, b, avg = index.stats["k1"], index.stats["b"], lengths.mean()
+    idf = math.log(1 + (4 - 3 + 0.5) / (3 + 0.5))
+    expected = idf * 2 * (k1 + 1) / (2 + k1 * (1 - b + b * lengths[1] / avg))
+    assert np.isclose(scores[0], expected, rtol=1e-5)
+
+def test_search_with_mask(tmp_path):
+    index = write_index(tmp_path)
+    mask = np.array([True, False, False, True])
+    assert index.search("ecdis", k=10, mask=mask)[1].tolist() == [3, 0]
+    assert index.search("ecdis", k=1, mask=mask)[1].tolist() == [3]
+    assert len(index.search("submarine", k=10)[1]) == 0
+
+def test_reciprocal_rank_fusion_ordering():
+    a, b, c, d = (Document(id=name, page_content=name) for name in "abcd")
+    fused = reciprocal_rank_fusion([[(a, 0.1), (b, 0.2), (c, 0.3)], [(c, 9.0), (b, 5.0), (d, 1.0)]], k=3, rrf_k=60)
+    # c: 1/61 + 1/63 > b: 1/62 + 1/62 > a: 1/61 > d: 1/63; scores ignore the original score scales
+    assert [doc.id for doc, _ in fused] == ["c", "b", "a"]
+    assert np.isclose(fused[0][1], 1 / 61 + 1 / 63) and np.isclose(fused[1][1], 2 / 62)
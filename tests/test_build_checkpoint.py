@@ -0,0 +1,59 @@
+# tests/test_build_checkpoint.py
+"""Build watermarks only cover documents that were ingested, in Mongo's (scrape_time, _id) order."""
+import datetime
+from bson import ObjectId
+
+from build_checkpoint import WatermarkTracker, load_watermarks, save_watermarks, _sort_key
+
+def key(minute: int, doc_id="a"):
+    return (datetime.datetime(2024, 1, 1, 0, minute), doc_id)
+
+def test_ordered_watermark_stops_at_the_first_unfinished_batch():
+    tracker = WatermarkTracker({"news": key(0)})
+    positions = [tracker.register("news", key(minute)) for minute in (1, 2, 3, 4)]
+    tracker.finished("news", positions[0])
+    tracker.finished("news", positions[2])
+    assert tracker.watermarks() == {"news": key(1)} # Batch 2 still running
+    tracker.finished("news", positions[1])
+    assert tracker.watermarks() == {"news": key(3)}
+
+def test_ordered_watermark_stops_at_a_failed_batch():
+    tracker = WatermarkTracker()
+    positions = [tracker.register("patents", key(minute)) for minute in (1, 2, 3)]
+    tracker.finished("patents", positions[0])
+    tracker.finished("patents", positions[1], ok=False)
+    tracker.finished("patents", positions[2])
+    assert tracker.watermarks() == {"patents": key(1)}
+    assert tracker.watermarks() == {"patents": key(1)} # For the rest of the run
+
+def test_partitioned_watermark_moves_once_the_source_and_all_batches_finished():
+    tracker = WatermarkTracker({"news": key(0)}, ordered=False)
+    # Partitions read concurrently register out of key order
+    positions = [tracker.register("news", key(minute)) for minute in (5, 2, 7)]
+    for position in positions:
+        tracker.finished("news", position)
+    assert tracker.watermarks() == {"news": key(0)} # More batches may still be read
+    late = tracker.register("news", key(3))
+    tracker.source_finished("news")
+    assert tracker.watermarks() == {"news": key(0)}
+    tracker.finished("news", late)
+    assert tracker.watermarks() == {"news": key(7)}
+
+def test_partitioned_watermark_does_not_move_after_a_failure():
+    tracker = WatermarkTracker(ordered=False)
+    tracker.finished("news", tracker.register("news", key(1)), ok=False)
+    tracker.finished("news", tracker.register("news", key(2)))
+    tracker.source_finished("news")
+    assert tracker.watermarks() == {}
+
+def test_sort_key_follows_mongo_order():
+    early, late = ObjectId("000000000000000000000001"), ObjectId("ffffffffffffffffffffff00")
+    keys = [key(1, late), key(1, "z-string"), (None, "x"), key(0, early), key(1, early), key(1, "a-string")]
+    # Missing scrape_time first; equal times order strings before ObjectIds, ObjectIds by their bytes
+    assert sorted(keys, key=_sort_key) == [(None, "x"), key(0, early), key(1, "a-string"), key(1, "z-string"),
+                                           key(1, early), key(1, late)]
+
+def test_watermarks_round_trip(tmp_path):
+    watermarks = {"news": key(1, ObjectId("000000000000000000000001")), "patents": key(2, "p-1")}
+    save_watermarks(str(tmp_path), watermarks)
+    assert load_watermarks(str(tmp_path)) == watermarks
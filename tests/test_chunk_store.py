@@ -0,0 +1,20 @@
+# tests/test_chunk_store.py
+"""SqliteDocstore lookups by many row ids stay within SQLite's bound-parameter limit."""
+import sqlite3
+from langchain_core.documents import Document
+
+from chunk_store import SqliteDocstore, SqliteRowMap
+
+def test_get_by_rows_with_more_ids_than_sqlite_parameters(tmp_path):
+    docstore = SqliteDocstore(str(tmp_path / "chunks.sqlite"), read_only=False)
+    row_map = SqliteRowMap(docstore)
+    num_chunks = 3000
+    docstore.add({f"id-{i}": Document(page_content=f"chunk {i}", metadata={"n": i}) for i in range(num_chunks)})
+    row_map.update({i: f"id-{i}" for i in range(num_chunks)})
+    docstore.commit()
+    # Builds differ (999 before SQLite 3.32, 32766 or more after); use a limit below the number of ids
+    docstore._conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 1000)
+    documents = docstore.get_by_rows(list(range(num_chunks)) + [num_chunks]) # The last row has no chunk
+    assert len(documents) == num_chunks
+    assert documents[1234].page_content == "chunk 1234" and documents[1234].metadata == {"n": 1234}
+    assert docstore.get_by_rows([]) == {}
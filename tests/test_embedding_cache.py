@@ -0,0 +1,33 @@
+# tests/test_embedding_cache.py
+"""CachedEmbeddings returns the same vector for a chunk whether or not it was already cached."""
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+
+DIMENSION = 8
+
+class RandomEmbeddings(Embeddings):
+    """Deterministic fp32 vectors with more precision than float16 keeps."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [np.random.RandomState(sum(text.encode())).rand(DIMENSION).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+@pytest.mark.parametrize("dtype", ["float16", "float32"])
+def test_hits_and_misses_return_the_same_vectors(tmp_path, dtype):
+    model = RandomEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache("test-model", DIMENSION, root=str(tmp_path), dtype=dtype))
+    texts = ["first chunk", "second chunk"]
+    computed = embeddings.embed_documents(texts)
+    cached = embeddings.embed_documents(texts + ["third chunk"])
+    assert model.calls == 3
+    assert cached[:2] == computed
+    assert np.allclose(cached[2], model.embed_query("third chunk"), atol=1e-3)
@@ -0,0 +1,34 @@
+# tests/test_filtered_search.py
+"""Filtered searches return only matching chunks, whatever the index type (selector pushdown or Python fallback)."""
+import numpy as np
+import pytest
+
+from conftest import NUM_CHUNKS
+from faiss_index_utils import INDEX_TYPES
+from partitioned_index import build_partitions, PartitionedIndex
+
+NEWS_FILTER = {"doc_type": {"$eq": "news"}}
+
+@pytest.mark.parametrize("partitioned", [False, True])
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_filtered_search_returns_only_matches(tmp_path, make_store, index_type, partitioned):
+    store, vectors = make_store(tmp_path, index_type)
+    if partitioned:
+        build_partitions(store.index, str(tmp_path), store.metadata_columns, index_type, store.rescore_vectors, flat_max_vectors=0)
+        store.partitions = PartitionedIndex.load(str(tmp_path), store.index, store.rescore_vectors)
+    hits = store.similarity_search_with_score_by_vector(vectors[3] + 0.01, k=5, filter=NEWS_FILTER, fetch_k=60)
+    assert len(hits) == 5
+    assert all(doc.metadata["doc_type"] == "news" for doc, _ in hits)
+    if partitioned:
+        # Partitions restrict to a mask themselves, with or without an ID selector
+        names = list(store.partitions.catalog["partitions"])
+        _, labels = store.partitions.search(names, vectors[3:4], 5, store.metadata_columns.mask(NEWS_FILTER))
+        assert len(labels[0]) == 5 and all(label % 2 == 1 for label in labels[0])
+
+def test_flat_filtered_search_matches_brute_force(tmp_path, make_store):
+    store, vectors = make_store(tmp_path, "flat")
+    query = vectors[10] + 0.01
+    hits = store.similarity_search_with_score_by_vector(query, k=10, filter=NEWS_FILTER)
+    news = np.arange(1, NUM_CHUNKS, 2)
+    expected = news[np.argsort(((vectors[news] - query) ** 2).sum(axis=1))[:10]]
+    assert [doc.metadata["mongo_id"] for doc, _ in hits] == [str(i) for i in expected]
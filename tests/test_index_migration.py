@@ -0,0 +1,48 @@
+# tests/test_index_migration.py
+"""Migrating the published index writes and publishes a new version; published versions are never changed in place."""
+import os
+import faiss
+import pytest
+
+from faiss_index_utils import FAISS_INDEX_FILENAME, migrate_index, migrate_published_index, save_index_params, load_index_params
+from index_versions import write_manifest, publish, current_version, verify_version
+from partitioned_index import build_partitions, read_catalog
+from search_workers import build_shards, read_shard_catalog
+from vector_store_utils import load_vector_store
+
+NUM_SHARDS = 2
+
+def publish_flat_version(root, make_store) -> str:
+    build_dir = os.path.join(str(root), "versions", "v1")
+    os.makedirs(build_dir)
+    store, vectors = make_store(build_dir, "flat")
+    faiss.write_index(store.index, os.path.join(build_dir, FAISS_INDEX_FILENAME))
+    save_index_params(build_dir, {"index_type": "flat"})
+    store.metadata_columns.save(build_dir)
+    build_partitions(store.index, build_dir, store.metadata_columns, "flat", flat_max_vectors=0)
+    build_shards(store.index, build_dir, NUM_SHARDS, "flat", range(len(vectors)))
+    store.docstore.seal()
+    write_manifest(build_dir, store.index.ntotal, "test-model", {"index_type": "flat"})
+    publish(build_dir, str(root))
+    return build_dir
+
+def test_migration_publishes_a_new_version(tmp_path, make_store):
+    old_dir = publish_flat_version(tmp_path, make_store)
+    new_dir = migrate_published_index("sq8", root=str(tmp_path))
+
+    assert current_version(str(tmp_path)) == os.path.basename(new_dir) != "v1"
+    assert verify_version(old_dir) and load_index_params(old_dir)["index_type"] == "flat"
+    assert verify_version(new_dir) and load_index_params(new_dir)["index_type"] == "sq8"
+    assert read_catalog(new_dir) is not None # Small partitions stay flat
+    assert {entry["index_type"] for entry in read_shard_catalog(new_dir)["shards"]} == {"sq8"}
+
+    store = load_vector_store(None, new_dir)
+    assert store.partitions is not None
+    hits = store.similarity_search_with_score_by_vector(store.rescore_vectors[4], k=3, filter={"doc_type": {"$eq": "patent"}})
+    assert hits[0][0].metadata["mongo_id"] == "4"
+
+def test_published_version_is_not_migrated_in_place(tmp_path, make_store):
+    old_dir = publish_flat_version(tmp_path, make_store)
+    with pytest.raises(ValueError, match="published"):
+        migrate_index(old_dir, "hnsw")
+    assert verify_version(old_dir)
@@ -0,0 +1,53 @@
+# tests/test_job_queue.py
+"""JobManager re-queues jobs interrupted by a restart and runs them within the per-kind limits."""
+import threading
+import time
+
+from job_queue import JobStore, JobManager
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_restart_requeues_interrupted_jobs_within_kind_limits(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    # Left behind by a process that died while running two builds and with an analysis still queued
+    interrupted = [store.create("build", {"n": i}) for i in range(2)]
+    for job_id in interrupted:
+        store.update(job_id, status="running", started_at=time.time(), attempts=1)
+    queued = store.create("analysis", {"query": "q"})
+
+    release = threading.Event()
+    lock = threading.Lock()
+    running = {"build": 0}
+    max_running = {"build": 0}
+
+    def build_runner(job_id, params, report_progress):
+        with lock:
+            running["build"] += 1
+            max_running["build"] = max(max_running["build"], running["build"])
+        release.wait(5)
+        with lock:
+            running["build"] -= 1
+        return 0, {"n": params["n"]}
+
+    manager = JobManager(store, {"build": build_runner, "analysis": lambda job_id, params, report_progress: (0, None)},
+                         max_workers=4, kind_limits={"build": 1})
+    manager.start()
+    try:
+        # The analysis is not held up behind the builds, and only one build runs at a time
+        wait_for(lambda: store.get(queued)["status"] == "succeeded")
+        wait_for(lambda: running["build"] == 1)
+        waiting = [store.get(job_id) for job_id in interrupted if store.get(job_id)["status"] == "queued"]
+        assert len(waiting) == 1 and waiting[0]["progress"] == "re-queued after restart"
+        release.set()
+        wait_for(lambda: all(store.get(job_id)["status"] == "succeeded" for job_id in interrupted))
+    finally:
+        release.set()
+        manager.stop()
+    assert max_running["build"] == 1
+    for job_id in interrupted:
+        job = store.get(job_id)
+        assert job["attempts"] == 2 and job["result"] == {"n": job["params"]["n"]}
@@ -0,0 +1,57 @@
+# tests/test_onnx_embeddings.py
+"""ONNX backend: pooling and normalization on a stand-in session, and parity with the PyTorch backend."""
+import os
+import numpy as np
+import pytest
+
+from onnx_embeddings import OnnxEmbeddings, onnx_model_path, check_parity
+
+MAX_SEQ_LENGTH = 6
+VOCABULARY = ["[PAD]", "[UNK]", "autonomous", "vessels", "ecdis", "the", "hull", "robot", "patent", "ballast", "water"]
+
+class TableSession:
+    """Stands in for an onnxruntime session: token embeddings looked up from a fixed table."""
+
+    def __init__(self, dimension: int = 16):
+        self.table = np.random.RandomState(0).randn(len(VOCABULARY), dimension).astype(np.float32)
+        self.fed = []
+
+    def run(self, output_names, feed: dict):
+        self.fed.append(sorted(feed))
+        return [self.table[feed["input_ids"]]]
+
+def stub_embeddings(batch_size: int) -> OnnxEmbeddings:
+    tokenizers = pytest.importorskip("tokenizers")
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel({token: i for i, token in enumerate(VOCABULARY)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+    tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+    embeddings = OnnxEmbeddings.__new__(OnnxEmbeddings) # Skips loading onnxruntime and the exported model
+    embeddings.tokenizer, embeddings.session, embeddings.batch_size = tokenizer, TableSession(), batch_size
+    embeddings.input_names = {"input_ids", "attention_mask"}
+    return embeddings
+
+def reference_embedding(session: TableSession, text: str) -> np.ndarray:
+    """Mean of the (truncated, unpadded) token vectors, L2-normalized, as sentence-transformers computes it."""
+    ids = [VOCABULARY.index(word) if word in VOCABULARY else 1 for word in text.split()][:MAX_SEQ_LENGTH]
+    pooled = session.table[ids].mean(axis=0)
+    return pooled / np.linalg.norm(pooled)
+
+def test_pooling_and_normalization_match_reference():
+    embeddings = stub_embeddings(batch_size=2)
+    texts = ["ecdis", "the hull robot", "autonomous vessels unknownword", "patent ballast water " * 4, "the ecdis"]
+    vectors = np.array(embeddings.embed_documents(texts))
+    expected = np.array([reference_embedding(embeddings.session, text) for text in texts])
+    assert np.allclose(vectors, expected, atol=1e-6) # Padding, truncation and input order do not change the vectors
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.allclose(embeddings.embed_query("the ecdis"), expected[4], atol=1e-6)
+    assert all(fed == ["attention_mask", "input_ids"] for fed in embeddings.session.fed) # Only inputs the model declares
+
+@pytest.mark.parametrize("use_int8", [False, True], ids=["fp32", "int8"])
+def test_onnx_matches_torch(use_int8):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("torch")
+    pytest.importorskip("langchain_huggingface")
+    if not os.path.exists(onnx_model_path(use_int8=use_int8)):
+        pytest.skip(f"{onnx_model_path(use_int8=use_int8)} not exported (python onnx_embeddings.py export)")
+    assert check_parity(use_int8=use_int8)
@@ -0,0 +1,42 @@
+# tests/test_report_api.py
+"""Report downloads: ETag revalidation and the cache policy of report ids vs. the latest report."""
+import os
+import pytest
+
+pytest.importorskip("langchain_google_genai") # main_api loads the analysis pipeline
+from fastapi.testclient import TestClient
+
+from report_store import ReportStore
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # main_api creates ./api_jobs and ./reports on import
+    import main_api
+    monkeypatch.setattr(main_api, "report_store", ReportStore(str(tmp_path / "reports"), 10**6, 3600))
+    return main_api, TestClient(main_api.app)
+
+def save_report(main_api, content: bytes) -> str:
+    temp_path = main_api.report_store.new_temp_path()
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    return main_api.report_store.save(temp_path, {"query": "q"})
+
+def test_report_by_id_revalidates_to_304(api):
+    main_api, client = api
+    report_id = save_report(main_api, b"%PDF report")
+    response = client.get(f"/get-report/{report_id}")
+    assert response.status_code == 200 and response.content == b"%PDF report"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert client.get(f"/get-report/{report_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/get-report/{report_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+def test_latest_report_is_not_cached_as_immutable(api):
+    main_api, client = api
+    first = save_report(main_api, b"%PDF first")
+    response = client.get("/get-report")
+    assert response.headers["cache-control"] == "no-cache" and response.headers["etag"] == f'"{first}"'
+    os.utime(main_api.report_store._pdf_path(first), (1, 1))
+    save_report(main_api, b"%PDF second")
+    response = client.get("/get-report", headers={"If-None-Match": f'"{first}"'})
+    assert response.status_code == 200 and response.content == b"%PDF second"
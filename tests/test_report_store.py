@@ -0,0 +1,56 @@
+# tests/test_report_store.py
+"""ReportStore saves reports under their content hash, evicts by TTL and size, and matches ETags."""
+import os
+import time
+import pytest
+
+from report_store import ReportStore, report_etag, etag_matches
+
+def save_report(store: ReportStore, content: bytes, age_seconds: float = 0.0, served_seconds_ago: float = 0.0) -> str:
+    temp_path = store.new_temp_path()
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    report_id = store.save(temp_path, {"query": content.decode()})
+    now = time.time()
+    os.utime(store._pdf_path(report_id), (now - age_seconds, now - age_seconds))
+    os.utime(store._meta_path(report_id), (now - served_seconds_ago, now - served_seconds_ago))
+    return report_id
+
+def test_save_is_content_addressed(tmp_path):
+    store = ReportStore(str(tmp_path), max_bytes=10**6, ttl_seconds=3600)
+    first = save_report(store, b"report a")
+    assert save_report(store, b"report a") == first
+    pdf_path, metadata = store.get(first)
+    assert open(pdf_path, "rb").read() == b"report a" and metadata["query"] == "report a"
+    assert store.get("not-a-hash") is None
+
+def test_evict_drops_expired_reports(tmp_path):
+    store = ReportStore(str(tmp_path), max_bytes=10**6, ttl_seconds=3600)
+    expired = save_report(store, b"old report", age_seconds=7200)
+    fresh = save_report(store, b"new report")
+    store.evict()
+    assert store.get(expired) is None and store.get(fresh) is not None
+    assert store.latest() == fresh
+
+def test_evict_drops_least_recently_served_over_budget(tmp_path):
+    store = ReportStore(str(tmp_path), max_bytes=10**6, ttl_seconds=0)
+    ids = [save_report(store, f"report {i}".encode() * 100, served_seconds_ago=100 - i) for i in range(3)]
+    sizes = [os.path.getsize(store._pdf_path(report_id)) + os.path.getsize(store._meta_path(report_id)) for report_id in ids]
+    store.max_bytes = sizes[1] + sizes[2] # Room for the two most recently served
+    store.evict()
+    assert [store.get(report_id) is not None for report_id in ids] == [False, True, True]
+    store.max_bytes = 0 # The last report is always kept
+    store.evict()
+    assert len(store._report_ids()) == 1
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", W/"abc"', True),
+    ("*", True),
+    ('"other"', False),
+    ('"abcd"', False),
+    ("", False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, report_etag("abc")) is matches
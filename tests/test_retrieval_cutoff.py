@@ -0,0 +1,24 @@
+# tests/test_retrieval_cutoff.py
+"""The default RETRIEVAL_CUTOFF keeps every hit, and the knee only cuts a real jump in the scores."""
+import numpy as np
+
+from config import RETRIEVAL_CUTOFF
+from retrieval_cutoff import cutoff_position, cut_hits
+
+SMOOTH = 0.5 + np.log(np.linspace(1, 20, 50)) / 3 # Concave (a bend above min_gain), but no hit stands out
+JUMP = np.concatenate([np.linspace(0.3, 0.35, 8), np.linspace(0.9, 1.0, 42)])
+
+def test_default_settings_keep_every_hit():
+    for scores in (SMOOTH, JUMP):
+        hits = [(f"doc {i}", score) for i, score in enumerate(scores)]
+        assert cut_hits(hits, RETRIEVAL_CUTOFF, "vector") == hits
+
+def test_knee_needs_a_jump():
+    settings = dict(RETRIEVAL_CUTOFF, knee=True)
+    assert cutoff_position(SMOOTH, **settings) == (50, None)
+    assert cutoff_position(JUMP, **settings) == (8, "knee")
+    assert cutoff_position(-JUMP, higher_is_better=True, **settings) == (8, "knee")
+
+def test_min_keep():
+    settings = dict(RETRIEVAL_CUTOFF, knee=True, min_keep=10)
+    assert cutoff_position(JUMP, **settings) == (10, "knee")
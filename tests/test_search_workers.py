@@ -0,0 +1,93 @@
+# tests/test_search_workers.py
+"""Sharded search through LocalTransport returns what the unsharded store returns, and workers require an authkey."""
+import os
+import sqlite3
+import numpy as np
+import pytest
+
+from conftest import NUM_CHUNKS
+from faiss_index_utils import save_rescore_vectors
+from index_versions import write_manifest, publish
+from search_workers import (
+    build_shards,
+    ShardServer,
+    LocalTransport,
+    ShardedSearchStore,
+    ConnectionTransport,
+    connect_search_workers,
+    serve,
+)
+
+NUM_SHARDS = 3
+NEWS_FILTER = {"doc_type": {"$eq": "news"}}
+
+def publish_sharded_version(root, make_store, index_type: str, version: str = "v1"):
+    """Unsharded store of a published version at `root` with NUM_SHARDS worker shards, and its vectors."""
+    build_dir = os.path.join(str(root), "versions", version)
+    os.makedirs(build_dir)
+    store, vectors = make_store(build_dir, index_type)
+    store.metadata_columns.save(build_dir)
+    if store.rescore_vectors is not None:
+        save_rescore_vectors(build_dir, np.arange(NUM_CHUNKS, dtype=np.int64), vectors)
+    build_shards(store.index, build_dir, NUM_SHARDS, index_type, range(NUM_CHUNKS), store.rescore_vectors)
+    write_manifest(build_dir, NUM_CHUNKS, "test-model", {"index_type": index_type})
+    publish(build_dir, str(root))
+    return store, vectors
+
+def sharded_store(root) -> ShardedSearchStore:
+    servers = [ShardServer(shard, str(root), reload_check_seconds=0) for shard in range(NUM_SHARDS)]
+    return ShardedSearchStore(None, [LocalTransport(server) for server in servers])
+
+def hit_ids(hits) -> list[str]:
+    return [doc.metadata["mongo_id"] for doc, _ in hits]
+
+@pytest.mark.parametrize("search_filter", [None, NEWS_FILTER])
+@pytest.mark.parametrize("index_type", ["flat", "sq8"])
+def test_sharded_search_matches_unsharded(tmp_path, make_store, index_type, search_filter):
+    store, vectors = publish_sharded_version(tmp_path, make_store, index_type)
+    sharded = sharded_store(tmp_path)
+    for query in (vectors[7] + 0.01, vectors[120] - 0.02):
+        expected = store.similarity_search_with_score_by_vector(query, k=10, filter=search_filter, fetch_k=40)
+        hits = sharded.similarity_search_with_score_by_vector(query, k=10, filter=search_filter, fetch_k=40)
+        assert hit_ids(hits) == hit_ids(expected)
+        assert np.allclose([score for _, score in hits], [score for _, score in expected], atol=1e-4)
+    assert sum(info["vectors"] for info in sharded.shard_info()) == NUM_CHUNKS
+    sharded.close()
+
+class FailingTransport:
+    address = "failing"
+
+    def call(self, method: str, **kwargs):
+        raise RuntimeError("Search worker failing: TimeoutError")
+
+    def close(self):
+        pass
+
+def test_failed_shard_leaves_the_other_shards_results(tmp_path, make_store):
+    _, vectors = publish_sharded_version(tmp_path, make_store, "flat")
+    sharded = sharded_store(tmp_path)
+    sharded.transports[1] = FailingTransport()
+    hits = sharded.similarity_search_with_score_by_vector(vectors[0], k=20)
+    assert len(hits) == 20 and all(int(mongo_id) % NUM_SHARDS != 1 for mongo_id in hit_ids(hits))
+    sharded.close()
+
+@pytest.mark.parametrize("authkey", [None, ""])
+def test_workers_and_clients_require_an_authkey(authkey):
+    with pytest.raises(ValueError, match="SEARCH_WORKER_AUTHKEY"):
+        serve(0, authkey=authkey)
+    with pytest.raises(ValueError, match="SEARCH_WORKER_AUTHKEY"):
+        ConnectionTransport("localhost:7601", authkey=authkey)
+    with pytest.raises(ValueError, match="SEARCH_WORKER_AUTHKEY"):
+        connect_search_workers(None, ["localhost:7601"], authkey=authkey)
+
+def test_reload_closes_the_previous_docstore(tmp_path, make_store):
+    publish_sharded_version(tmp_path, make_store, "flat", "v1")
+    server = ShardServer(0, str(tmp_path), reload_check_seconds=3600)
+    first_docstore = server.store.docstore
+    running = server._acquire_store() # A request still running on v1
+    publish_sharded_version(tmp_path, make_store, "flat", "v2")
+    assert server.handle("info", {})["version"] == "v2"
+    assert first_docstore.search("missing") == "ID missing not found." # Still open for the running request
+    server._release_store(running)
+    with pytest.raises(sqlite3.ProgrammingError):
+        first_docstore.search("missing")
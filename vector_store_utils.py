@@ -1,19 +1,33 @@
 # vector_store_utils.py
 import os
-import torch # Import torch to check for CUDA
+import time
 from langchain_community.vectorstores import Chroma
 from langchain_community.vectorstores import FAISS
-# from langchain_community.embeddings import HuggingFaceEmbeddings # Old import
-from langchain_huggingface import HuggingFaceEmbeddings # New import
-from config import EMBEDDING_MODEL_NAME, VECTOR_STORE_PATH
+from config import EMBEDDING_MODEL_NAME, VECTOR_STORE_PATH, EMBEDDING_BACKEND, ONNX_USE_INT8, FAISS_PARTITIONED_SEARCH, SEARCH_WORKER_ADDRESSES
+from faiss_index_utils import load_index_params, apply_search_params, is_quantized, load_rescore_vectors, label_bound
+from faiss_vector_store import MaritimeFAISS
+from metadata_columns import MetadataColumns
+from partitioned_index import PartitionedIndex
+from bm25_index import BM25Index
+from index_versions import current_index_path
 # Removed ChromaDB-specific embedding function import
 
-def get_embedding_function():
-    """Initializes and returns the embedding function."""
-    print(f"Initializing embedding model: {EMBEDDING_MODEL_NAME}")
+def get_embedding_function(device=None, num_threads=None):
+    """Initializes and returns the embedding function (on CUDA if available, unless `device` is given).
+
+    With EMBEDDING_BACKEND = "onnx" the model runs on ONNX Runtime (CPU, `num_threads` intra-op threads) and torch is not imported.
+    """
+    print(f"Initializing embedding model: {EMBEDDING_MODEL_NAME} (backend: {EMBEDDING_BACKEND})")
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(num_threads=num_threads)
+
+    # Imported here so the ONNX backend (API nodes) does not need torch
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
 
     # Determine device based on CUDA availability
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
     print(f"Using device: {device} for embeddings")
 
     # Initialize the base HuggingFaceEmbeddings
@@ -32,6 +46,48 @@ def get_embedding_function():
     # For now, return the HuggingFace embeddings compatible with FAISS
     return hf_embeddings
 
+def get_embedding_cache_name():
+    """Model identity for the embedding cache; int8 ONNX vectors are close to, but not the same as, the PyTorch ones."""
+    if EMBEDDING_BACKEND == "onnx" and ONNX_USE_INT8:
+        return f"{EMBEDDING_MODEL_NAME}-onnx-int8"
+    return EMBEDDING_MODEL_NAME
+
+def get_index_path():
+    """Directory of the published FAISS index version (resolved now; see index_versions.py)."""
+    return current_index_path(VECTOR_STORE_PATH)
+
+def load_vector_store(embeddings, index_path=None, writable=False):
+    """Loads the persisted FAISS store (built by build_vector_store.py) and applies its search parameters.
+
+    Readers get a memory-mapped index with chunks read lazily from chunks.sqlite; `writable=True` is for the build.
+    """
+    index_path = index_path or get_index_path()
+    start_time = time.time()
+    vector_store = MaritimeFAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True, writable=writable)
+    index_params = load_index_params(index_path)
+    apply_search_params(vector_store.index, index_params)
+    if is_quantized(index_params["index_type"]):
+        vector_store.rescore_vectors = load_rescore_vectors(index_path, vector_store.index.d, label_bound(vector_store.index))
+    if not writable:
+        vector_store.metadata_columns = MetadataColumns.load(index_path)
+        if vector_store.metadata_columns is None:
+            print(f"No metadata columns in {index_path}; filters are applied in Python after the search.")
+        if FAISS_PARTITIONED_SEARCH:
+            vector_store.partitions = PartitionedIndex.load(index_path, vector_store.index, vector_store.rescore_vectors)
+        vector_store.bm25 = BM25Index.load(index_path)
+        if vector_store.bm25 is None:
+            print(f"No BM25 index in {index_path}; hybrid retrieval searches FAISS only.")
+    print(f"Loaded FAISS vector store with {vector_store.index.ntotal} documents from {index_path} "
+          f"(index type: {index_params['index_type']}) in {time.time() - start_time:.3f} seconds.")
+    return vector_store
+
+def load_search_store(embeddings, index_path=None):
+    """Store the API searches: the search workers when SEARCH_WORKER_ADDRESSES is set, else the local index."""
+    if SEARCH_WORKER_ADDRESSES:
+        from search_workers import connect_search_workers
+        return connect_search_workers(embeddings, SEARCH_WORKER_ADDRESSES)
+    return load_vector_store(embeddings, index_path)
+
 def get_retriever(vector_store, top_k):
     """Creates a retriever from the vector store."""
     if not vector_store: